@@ -12,6 +12,7 @@ from typing import Any, Union
 import modal
 
 from .config import DataTrainingArguments, ModelArguments, app_config
+from .feature_store import StoredSplit, is_complete, store_key, write_split
 from .logs import get_logger, setup_logging
 
 try:
@@ -54,6 +55,7 @@ def train(
     import evaluate
     import torch
     from datasets import DatasetDict, load_dataset
+    from huggingface_hub import HfApi
     from transformers import (
         AutoConfig,
         AutoFeatureExtractor,
@@ -165,41 +167,56 @@ def train(
                 "the `--output_dir` or add `--overwrite_output_dir` to train from scratch."
             )
 
-    logger.info("4. Load datasets")
-    raw_datasets = DatasetDict()
-    raw_datasets["train"] = load_dataset(
-        "mozilla-foundation/common_voice_11_0",
-        "hi",
-        split="train+validation",
-        use_auth_token=os.environ["HF_TOKEN"],
-    )
-    raw_datasets["eval"] = load_dataset(
-        "mozilla-foundation/common_voice_11_0",
-        "hi",
-        split="test",
-        use_auth_token=os.environ["HF_TOKEN"],
+    logger.info("4. Resolve dataset revision")
+    # Pinned to a commit, so that the features stored for it stay valid.
+    dataset_revision = (
+        HfApi()
+        .dataset_info(
+            app_config.dataset,
+            revision=data_args.dataset_revision,
+            token=os.environ["HF_TOKEN"],
+        )
+        .sha
     )
+    logger.info(f"Using {app_config.dataset} at revision {dataset_revision}")
+
+    def load_raw_datasets() -> DatasetDict:
+        raw_datasets = DatasetDict()
+        raw_datasets["train"] = load_dataset(
+            app_config.dataset,
+            "hi",
+            split="train+validation",
+            revision=dataset_revision,
+            use_auth_token=os.environ["HF_TOKEN"],
+        )
+        raw_datasets["eval"] = load_dataset(
+            app_config.dataset,
+            "hi",
+            split="test",
+            revision=dataset_revision,
+            use_auth_token=os.environ["HF_TOKEN"],
+        )
 
-    # Most ASR datasets only provide input audio samples (audio) and
-    # the corresponding transcribed text (sentence).
-    # Common Voice contains additional metadata information,
-    # such as accent and locale, which we can disregard for ASR.
-    # Keeping the training function as general as possible,
-    # we only consider the input audio and transcribed text for fine-tuning,
-    # discarding the additional metadata information:
-    raw_datasets = raw_datasets.remove_columns(
-        [
-            "accent",
-            "age",
-            "client_id",
-            "down_votes",
-            "gender",
-            "locale",
-            "path",
-            "segment",
-            "up_votes",
-        ]
-    )
+        # Most ASR datasets only provide input audio samples (audio) and
+        # the corresponding transcribed text (sentence).
+        # Common Voice contains additional metadata information,
+        # such as accent and locale, which we can disregard for ASR.
+        # Keeping the training function as general as possible,
+        # we only consider the input audio and transcribed text for fine-tuning,
+        # discarding the additional metadata information:
+        return raw_datasets.remove_columns(
+            [
+                "accent",
+                "age",
+                "client_id",
+                "down_votes",
+                "gender",
+                "locale",
+                "path",
+                "segment",
+                "up_votes",
+            ]
+        )
 
     logger.info("5. Load pretrained model, tokenizer, and feature extractor")
     #
@@ -266,22 +283,6 @@ def train(
             language=data_args.language, task=data_args.task
         )
 
-    logger.info("6. Resample speech dataset if necessary")
-    dataset_sampling_rate = (
-        next(iter(raw_datasets.values()))
-        .features[data_args.audio_column_name]
-        .sampling_rate
-    )
-    if dataset_sampling_rate != feature_extractor.sampling_rate:
-        logger.info("Resampling necessary")
-        raw_datasets = raw_datasets.cast_column(
-            data_args.audio_column_name,
-            datasets.features.Audio(
-                sampling_rate=feature_extractor.sampling_rate
-            ),
-        )
-
-    logger.info("7. Preprocessing the datasets.")
     # We need to read the audio files as arrays and tokenize the targets.
     max_input_length = (
         data_args.max_duration_in_seconds * feature_extractor.sampling_rate
@@ -289,11 +290,6 @@ def train(
     min_input_length = (
         data_args.min_duration_in_seconds * feature_extractor.sampling_rate
     )
-    audio_column_name = data_args.audio_column_name
-    num_workers = data_args.preprocessing_num_workers
-    text_column_name = data_args.text_column_name
-    model_input_name = feature_extractor.model_input_names[0]
-    do_lower_case = data_args.do_lower_case
     # if SpecAugment is used for whisper models, return attention_mask to guide the mask along time axis
     forward_attention_mask = (
         getattr(config, "model_type", None) == "whisper"
@@ -301,66 +297,92 @@ def train(
         and getattr(config, "mask_time_prob", 0) > 0
     )
 
-    if data_args.max_train_samples is not None:
-        raw_datasets["train"] = raw_datasets["train"].select(
-            range(data_args.max_train_samples)
-        )
+    # Features and labels are computed once per dataset revision and preprocessing
+    # configuration, and later runs read them from the feature store.
+    store_dir = pathlib.Path(
+        app_config.feature_store_dir,
+        store_key(
+            dataset_revision,
+            feature_extractor.to_dict(),
+            tokenizer=tokenizer.name_or_path,
+            model_revision=model_args.model_revision,
+            language=data_args.language,
+            task=data_args.task,
+            do_lower_case=data_args.do_lower_case,
+            forward_attention_mask=forward_attention_mask,
+            max_train_samples=data_args.max_train_samples,
+            max_eval_samples=data_args.max_eval_samples,
+        ),
+    )
+    split_names = ["train", "eval"]
 
-    if data_args.max_eval_samples is not None:
-        raw_datasets["eval"] = raw_datasets["eval"].select(
-            range(data_args.max_eval_samples)
-        )
+    with training_args.main_process_first(desc="dataset pre-processing"):
+        if all(is_complete(store_dir / name) for name in split_names):
+            logger.info(f"6. Reading preprocessed datasets from {store_dir}")
+        else:
+            raw_datasets = load_raw_datasets()
 
-    def prepare_dataset(batch):
-        # process audio
-        sample = batch[audio_column_name]
-        inputs = feature_extractor(
-            sample["array"],
-            sampling_rate=sample["sampling_rate"],
-            return_attention_mask=forward_attention_mask,
-        )
-        # process audio length
-        batch[model_input_name] = inputs.get(model_input_name)[0]
-        batch["input_length"] = len(sample["array"])
-        if forward_attention_mask:
-            batch["attention_mask"] = inputs.get("attention_mask")[0]
-
-        # process targets
-        input_str = (
-            batch[text_column_name].lower()
-            if do_lower_case
-            else batch[text_column_name]
-        )
-        batch["labels"] = tokenizer(input_str).input_ids
-        return batch
-
-    with training_args.main_process_first(desc="dataset map pre-processing"):
-        vectorized_datasets = raw_datasets.map(
-            prepare_dataset,
-            remove_columns=next(iter(raw_datasets.values())).column_names,
-            num_proc=data_args.preprocessing_num_workers,
-            desc="preprocess train dataset",
-        )
+            logger.info("6. Resample speech dataset if necessary")
+            dataset_sampling_rate = (
+                next(iter(raw_datasets.values()))
+                .features[data_args.audio_column_name]
+                .sampling_rate
+            )
+            if dataset_sampling_rate != feature_extractor.sampling_rate:
+                logger.info("Resampling necessary")
+                raw_datasets = raw_datasets.cast_column(
+                    data_args.audio_column_name,
+                    datasets.features.Audio(
+                        sampling_rate=feature_extractor.sampling_rate
+                    ),
+                )
 
-    # filter data that is shorter than min_input_length or longer than
-    # max_input_length
-    def is_audio_in_length_range(length):
-        return length > min_input_length and length < max_input_length
+            logger.info(f"7. Preprocessing the datasets into {store_dir}")
+            if data_args.max_train_samples is not None:
+                raw_datasets["train"] = raw_datasets["train"].select(
+                    range(data_args.max_train_samples)
+                )
 
-    vectorized_datasets = vectorized_datasets.filter(
-        is_audio_in_length_range,
-        num_proc=num_workers,
-        input_columns=["input_length"],
-    )
+            if data_args.max_eval_samples is not None:
+                raw_datasets["eval"] = raw_datasets["eval"].select(
+                    range(data_args.max_eval_samples)
+                )
+
+            for name in split_names:
+                if is_complete(store_dir / name):
+                    continue
+                write_split(
+                    raw_datasets[name],
+                    store_dir / name,
+                    feature_extractor=feature_extractor,
+                    tokenizer=tokenizer,
+                    audio_column_name=data_args.audio_column_name,
+                    text_column_name=data_args.text_column_name,
+                    do_lower_case=data_args.do_lower_case,
+                    forward_attention_mask=forward_attention_mask,
+                    num_workers=data_args.preprocessing_num_workers,
+                )
+
+    # Only data longer than min_input_length and shorter than max_input_length
+    # is read.
+    vectorized_datasets = {
+        name: StoredSplit(
+            store_dir / name,
+            min_input_length=min_input_length,
+            max_input_length=max_input_length,
+        )
+        for name in split_names
+    }
 
     # for large datasets it is advised to run the preprocessing on a
     # single machine first with `args.preprocessing_only` since there will mostly likely
     # be a timeout when running the script in distributed mode.
     # In a second step `args.preprocessing_only` can then be set to `False` to load the
-    # cached dataset
+    # preprocessed dataset
     if data_args.preprocessing_only:
-        cache = {k: v.cache_files for k, v in vectorized_datasets.items()}
-        logger.info(f"Data preprocessing finished. Files cached at {cache}.")
+        logger.info(
+            f"Data preprocessing finished. Files stored at {store_dir}."
+        )
         return
 
     logger.info("8. Loading WER Metric")
@@ -9,6 +9,8 @@ class ModalAppConfig:
     dataset = "mozilla-foundation/common_voice_11_0"
     cache_dir = "/cache"
     model_dir = "/models"
+    # Precomputed features, on the same persistent network file system as models.
+    feature_store_dir = "/models/feature-store"
 
 
 app_config = ModalAppConfig()
@@ -118,6 +120,12 @@ class DataTrainingArguments:
             "help": "The name of the dataset to use (via the datasets library)."
         },
     )
+    dataset_revision: str = field(
+        default="main",
+        metadata={
+            "help": "The dataset version to use (can be a branch name, tag name or commit id)."
+        },
+    )
     dataset_config_name: Optional[str] = field(
         default=None,
         metadata={
@@ -0,0 +1,389 @@
+"""
+A store of precomputed log-mel input features and label token ids, so that training
+runs don't recompute them from the audio every time.
+
+Each dataset split is written in shards of `.npy` arrays, which training runs read
+memory-mapped:
+
+```
+<store_dir>/<key>/<split>/index.json
+<store_dir>/<key>/<split>/shard-00000/input_features.npy  # (examples, mels, frames)
+<store_dir>/<key>/<split>/shard-00000/input_length.npy    # audio samples per example
+<store_dir>/<key>/<split>/shard-00000/labels.npy          # all examples' token ids
+<store_dir>/<key>/<split>/shard-00000/label_offsets.npy   # where each example's labels start
+```
+
+The key changes with the dataset revision and the feature extractor and tokenizer
+configuration, so a store is never read with features it wasn't written with.
+
+To compare the time to load an epoch of features from the store against computing
+them from audio, on synthetic clips:
+
+```
+python3 -m train.feature_store -n 512
+```
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import time
+import types
+from typing import Any, Optional
+
+import numpy as np
+
+from .logs import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_FILENAME = "index.json"
+
+
+def store_key(
+    dataset_revision: str,
+    feature_extractor_config: dict,
+    **preprocessing: Any,
+) -> str:
+    """
+    The key of the features of a dataset at `dataset_revision`, a commit hash,
+    extracted with a feature extractor configured by `feature_extractor_config`.
+    Everything else that changes the stored features or labels, such as the tokenizer
+    and the examples selected, goes in `preprocessing`.
+    """
+    config = {
+        name: value
+        for name, value in feature_extractor_config.items()
+        # Derived from the rest of the configuration, and large.
+        if name not in ("mel_filters", "window")
+    }
+    parts = {
+        "dataset_revision": dataset_revision,
+        "feature_extractor": config,
+        **preprocessing,
+    }
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+
+
+def is_complete(split_dir: pathlib.Path) -> bool:
+    return (split_dir / INDEX_FILENAME).exists()
+
+
+def _write_shard(
+    dataset,
+    start: int,
+    stop: int,
+    shard_dir: pathlib.Path,
+    feature_extractor,
+    tokenizer,
+    audio_column_name: str,
+    text_column_name: str,
+    do_lower_case: bool,
+    forward_attention_mask: bool,
+) -> int:
+    """
+    Writes the features and labels of examples `start` to `stop` of `dataset` to
+    `shard_dir`, through a temporary directory so that it only ever holds a complete
+    shard. Returns the number of examples written.
+    """
+    model_input_name = feature_extractor.model_input_names[0]
+    tmp_dir = shard_dir.with_name(f"{shard_dir.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    num_examples = stop - start
+    features = np.lib.format.open_memmap(
+        tmp_dir / f"{model_input_name}.npy",
+        mode="w+",
+        dtype=np.float32,
+        shape=(
+            num_examples,
+            feature_extractor.feature_size,
+            feature_extractor.nb_max_frames,
+        ),
+    )
+    attention_mask = (
+        np.lib.format.open_memmap(
+            tmp_dir / "attention_mask.npy",
+            mode="w+",
+            dtype=np.int8,
+            shape=(num_examples, feature_extractor.nb_max_frames),
+        )
+        if forward_attention_mask
+        else None
+    )
+    input_length = np.empty(num_examples, dtype=np.int64)
+    labels: list[int] = []
+    label_offsets = np.zeros(num_examples + 1, dtype=np.int64)
+
+    for row, i in enumerate(range(start, stop)):
+        example = dataset[i]
+        sample = example[audio_column_name]
+        inputs = feature_extractor(
+            sample["array"],
+            sampling_rate=sample["sampling_rate"],
+            return_attention_mask=forward_attention_mask,
+        )
+        features[row] = inputs.get(model_input_name)[0]
+        if attention_mask is not None:
+            attention_mask[row] = inputs.get("attention_mask")[0]
+        input_length[row] = len(sample["array"])
+
+        text = example[text_column_name]
+        labels.extend(
+            tokenizer(text.lower() if do_lower_case else text).input_ids
+        )
+        label_offsets[row + 1] = len(labels)
+
+    features.flush()
+    if attention_mask is not None:
+        attention_mask.flush()
+    del features, attention_mask
+    np.save(tmp_dir / "input_length.npy", input_length)
+    np.save(tmp_dir / "labels.npy", np.asarray(labels, dtype=np.int32))
+    np.save(tmp_dir / "label_offsets.npy", label_offsets)
+    os.replace(tmp_dir, shard_dir)
+    return num_examples
+
+
+def write_split(
+    dataset,
+    split_dir: pathlib.Path,
+    feature_extractor,
+    tokenizer,
+    audio_column_name: str = "audio",
+    text_column_name: str = "sentence",
+    do_lower_case: bool = True,
+    forward_attention_mask: bool = False,
+    shard_size: int = 256,
+    num_workers: Optional[int] = None,
+) -> None:
+    """
+    Writes the features and labels of every example of `dataset`, anything indexable
+    that returns examples as `datasets.Dataset` does, to `split_dir`. Shards are
+    written in parallel by `num_workers` processes. Shards written by an earlier,
+    interrupted run are kept, and the index marking the split complete is written
+    last.
+    """
+    split_dir.mkdir(parents=True, exist_ok=True)
+    shards = [
+        (start, min(start + shard_size, len(dataset)))
+        for start in range(0, len(dataset), shard_size)
+    ]
+    shard_dirs = [split_dir / f"shard-{i:05d}" for i in range(len(shards))]
+    t0 = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+        futures = [
+            executor.submit(
+                _write_shard,
+                dataset,
+                start,
+                stop,
+                shard_dir,
+                feature_extractor,
+                tokenizer,
+                audio_column_name,
+                text_column_name,
+                do_lower_case,
+                forward_attention_mask,
+            )
+            for (start, stop), shard_dir in zip(shards, shard_dirs)
+            if not shard_dir.exists()
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+    tmp_index = split_dir / f"{INDEX_FILENAME}.tmp"
+    tmp_index.write_text(
+        json.dumps(
+            {
+                "model_input_name": feature_extractor.model_input_names[0],
+                "shards": [
+                    {"name": shard_dir.name, "num_examples": stop - start}
+                    for (start, stop), shard_dir in zip(shards, shard_dirs)
+                ],
+            }
+        )
+    )
+    os.replace(tmp_index, split_dir / INDEX_FILENAME)
+    logger.info(
+        f"Wrote {len(dataset)} examples in {len(shards)} shards to {split_dir} "
+        f"in {time.perf_counter() - t0:.2f}s."
+    )
+
+
+class StoredSplit:
+    """
+    The examples of a split written by `write_split`, read memory-mapped, with audio
+    of `min_input_length` to `max_input_length` samples. Examples are dicts of the
+    feature extractor's input, "labels" and "input_length", which
+    `DataCollatorSpeechSeq2SeqWithPadding` collates.
+    """
+
+    def __init__(
+        self,
+        split_dir: pathlib.Path,
+        min_input_length: float = 0,
+        max_input_length: float = float("inf"),
+    ):
+        index = json.loads((split_dir / INDEX_FILENAME).read_text())
+        self.model_input_name = index["model_input_name"]
+        self._shards: list[dict[str, np.ndarray]] = []
+        # (shard number, row in shard) of each example.
+        rows: list[tuple[int, int]] = []
+        for shard_number, shard in enumerate(index["shards"]):
+            shard_dir = split_dir / shard["name"]
+            arrays = {
+                path.stem: np.load(path, mmap_mode="r")
+                for path in shard_dir.glob("*.npy")
+            }
+            self._shards.append(arrays)
+            lengths = arrays["input_length"]
+            # Only the examples in range, as `train` filters them.
+            in_range = np.flatnonzero(
+                (lengths > min_input_length) & (lengths < max_input_length)
+            )
+            rows.extend((shard_number, int(row)) for row in in_range)
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, i: int) -> dict:
+        shard_number, row = self._rows[i]
+        arrays = self._shards[shard_number]
+        offsets = arrays["label_offsets"]
+        example = {
+            self.model_input_name: arrays[self.model_input_name][row],
+            "input_length": int(arrays["input_length"][row]),
+            "labels": arrays["labels"][
+                offsets[row] : offsets[row + 1]
+            ].tolist(),
+        }
+        if "attention_mask" in arrays:
+            example["attention_mask"] = arrays["attention_mask"][row]
+        return example
+
+
+class _WordTokenizer:
+    """Tokenizes `_SyntheticClips`' sentences, without downloading a tokenizer."""
+
+    def __call__(self, text: str):
+        return types.SimpleNamespace(
+            input_ids=[int(word[4:]) for word in text.split()]
+        )
+
+
+class _SyntheticClips:
+    """Clips of noise with sentences, indexable like a `datasets.Dataset`."""
+
+    def __init__(
+        self, n: int, seconds: float = 5.0, sampling_rate: int = 16_000
+    ):
+        self.n = n
+        self.seconds = seconds
+        self.sampling_rate = sampling_rate
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, i: int) -> dict:
+        rng = np.random.default_rng(i)
+        array = rng.normal(
+            scale=0.1, size=int(self.seconds * self.sampling_rate)
+        ).astype(np.float32)
+        return {
+            "audio": {"array": array, "sampling_rate": self.sampling_rate},
+            "sentence": " ".join(
+                f"word{w}" for w in rng.integers(1000, size=12)
+            ),
+        }
+
+
+def benchmark(
+    n: int, epochs: int = 2, num_workers: Optional[int] = None
+) -> None:
+    """
+    Times an epoch of loading the features and labels of `n` synthetic clips, by
+    computing them from audio as `prepare_dataset` does, and by reading them from a
+    feature store.
+    """
+    import tempfile
+
+    from transformers import WhisperFeatureExtractor
+
+    feature_extractor = WhisperFeatureExtractor()
+    tokenizer = _WordTokenizer()
+    clips = _SyntheticClips(n)
+
+    def timed_epochs(load_example) -> list[float]:
+        durations = []
+        order = np.random.default_rng(0).permutation(n)
+        for _ in range(epochs):
+            t0 = time.perf_counter()
+            for i in order:
+                load_example(int(i))
+            durations.append(time.perf_counter() - t0)
+        return durations
+
+    def compute(i: int) -> dict:
+        example = clips[i]
+        inputs = feature_extractor(
+            example["audio"]["array"], sampling_rate=16_000
+        )
+        return {
+            "input_features": inputs.get("input_features")[0],
+            "labels": tokenizer(example["sentence"]).input_ids,
+        }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        split_dir = pathlib.Path(tmp_dir, "train")
+        t0 = time.perf_counter()
+        write_split(
+            clips,
+            split_dir,
+            feature_extractor,
+            tokenizer,
+            num_workers=num_workers,
+        )
+        preprocessing = time.perf_counter() - t0
+        split = StoredSplit(split_dir)
+
+        def read(i: int) -> dict:
+            example = split[i]
+            # Collating copies the features out of the memory-mapped file.
+            example["input_features"] = np.array(example["input_features"])
+            return example
+
+        results = {
+            "computed from audio": timed_epochs(compute),
+            "feature store": timed_epochs(read),
+        }
+
+    print(
+        f"{n} 5s clips, preprocessed into the store in {preprocessing:.2f}s "
+        f"with {num_workers or os.cpu_count()} workers"
+    )
+    for name, durations in results.items():
+        print(
+            f"{name:>20}: "
+            + ", ".join(f"{d:.2f}s" for d in durations)
+            + " per epoch"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading an epoch of features."
+    )
+    parser.add_argument("-n", type=int, default=512, help="number of clips")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    benchmark(args.n, epochs=args.epochs, num_workers=args.workers)
@@ -1,13 +1,15 @@
 import asyncio
 import json
 import time
-from typing import List, NamedTuple
+from typing import List, NamedTuple, Optional
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 
-from . import config
+from . import config, episode_index, segment_log
 from .main import (
     get_episode_metadata_path,
+    get_segment_log_path,
     get_transcript_path,
     populate_podcast_metadata,
     process_episode,
@@ -21,6 +23,9 @@ web_app = FastAPI()
 
 # A transcription taking > 10 minutes should be exceedingly rare.
 MAX_JOB_AGE_SECS = 10 * 60
+# Most episodes listed per page of a podcast, when paging. The frontend doesn't page,
+# so by default every episode is listed.
+MAX_EPISODES_PAGE_SIZE = 500
 
 
 class InProgressJob(NamedTuple):
@@ -39,7 +44,17 @@ async def get_episode(podcast_id: str, episode_guid_hash: str):
         metadata = json.load(f)
 
     if not transcription_path.exists():
-        return dict(metadata=metadata)
+        # Serve what's been transcribed so far of an episode being transcribed.
+        partial = segment_log.read_transcript(
+            get_segment_log_path(episode_guid_hash)
+        )
+        if partial is None:
+            return dict(metadata=metadata)
+        return dict(
+            metadata=metadata,
+            segments=coalesce_short_transcript_segments(partial["segments"]),
+            partial=True,
+        )
 
     with open(transcription_path, "r") as f:
         data = json.load(f)
@@ -51,41 +66,69 @@ async def get_episode(podcast_id: str, episode_guid_hash: str):
 
 
 @web_app.get("/api/podcast/{podcast_id}")
-async def get_podcast(podcast_id: str):
-    pod_metadata_path = (
-        config.PODCAST_METADATA_DIR / podcast_id / "metadata.json"
-    )
-    previously_stored = True
-    if not pod_metadata_path.exists():
-        previously_stored = False
-        # Don't run this Modal function in a separate container in the cloud, because then
-        # we'd be exposed to a race condition with the NFS if we don't wait for the write
-        # to propogate.
-        raw_populate_podcast_metadata = populate_podcast_metadata.get_raw_f()
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(
-            None, raw_populate_podcast_metadata, podcast_id
+async def get_podcast(
+    podcast_id: str,
+    request: Request,
+    page: int = 0,
+    page_size: Optional[int] = None,
+):
+    loop = asyncio.get_running_loop()
+    cached = episode_index.load_index(podcast_id)
+    if cached is None:
+        pod_metadata_path = (
+            config.PODCAST_METADATA_DIR / podcast_id / "metadata.json"
         )
-
-    with open(pod_metadata_path, "r") as f:
-        pod_metadata = json.load(f)
-
-    episodes = []
-    for file in (config.PODCAST_METADATA_DIR / podcast_id).iterdir():
-        if file == pod_metadata_path:
-            continue
-
-        with open(file, "r") as f:
-            ep = json.load(f)
-            ep["transcribed"] = get_transcript_path(ep["guid_hash"]).exists()
-            episodes.append(ep)
-
-    episodes.sort(key=lambda ep: ep.get("publish_date"), reverse=True)
-
-    # Refresh possibly stale data asynchronously.
-    if previously_stored:
+        if pod_metadata_path.exists():
+            # Stored before podcasts had episode indexes.
+            await loop.run_in_executor(
+                None,
+                episode_index.rebuild_index,
+                podcast_id,
+                lambda guid_hash: get_transcript_path(guid_hash).exists(),
+            )
+        else:
+            # Don't run this Modal function in a separate container in the cloud, because then
+            # we'd be exposed to a race condition with the NFS if we don't wait for the write
+            # to propogate.
+            raw_populate_podcast_metadata = (
+                populate_podcast_metadata.get_raw_f()
+            )
+            await loop.run_in_executor(
+                None, raw_populate_podcast_metadata, podcast_id
+            )
+        cached = episode_index.load_index(podcast_id, ttl=0)
+        assert cached is not None
+    elif (
+        time.time() - cached.mtime_ns / 1e9
+        > config.PODCAST_METADATA_MAX_AGE_SECS
+    ):
+        # Refresh possibly stale data asynchronously.
         populate_podcast_metadata.spawn(podcast_id)
-    return dict(pod_metadata=pod_metadata, episodes=episodes)
+
+    episodes = cached.data["episodes"]
+    if page_size is None:
+        page = 0
+    else:
+        page = max(page, 0)
+        page_size = min(max(page_size, 1), MAX_EPISODES_PAGE_SIZE)
+        episodes = episodes[page * page_size : (page + 1) * page_size]
+    headers = {
+        "ETag": f'"{cached.digest}-{page}-{page_size}"',
+        "Cache-Control": "no-cache",
+    }
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(
+        dict(
+            pod_metadata=cached.data["pod_metadata"],
+            episodes=episodes,
+            page=page,
+            page_size=page_size,
+            total_episodes=len(cached.data["episodes"]),
+        ),
+        headers=headers,
+    )
 
 
 @web_app.post("/api/podcasts")
@@ -152,17 +195,19 @@ async def poll_status(call_id: str):
 
     assert map_root.function_name == "transcribe_episode"
 
+    # Each map input is a batch of up to `SEGMENTS_PER_TRANSCRIBE_CALL` segments.
     leaves = map_root.children
     tasks = len(set([leaf.task_id for leaf in leaves]))
-    done_segments = len(
+    done_batches = len(
         [leaf for leaf in leaves if leaf.status == InputStatus.SUCCESS]
     )
-    total_segments = len(leaves)
+    total_batches = len(leaves)
     finished = map_root.status == InputStatus.SUCCESS
 
     return dict(
         finished=finished,
-        total_segments=total_segments,
+        total_batches=total_batches,
         tasks=tasks,
-        done_segments=done_segments,
+        done_batches=done_batches,
+        segments_per_batch=config.SEGMENTS_PER_TRANSCRIBE_CALL,
     )
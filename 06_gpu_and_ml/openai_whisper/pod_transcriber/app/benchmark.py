@@ -0,0 +1,846 @@
+"""
+Local benchmarks for the search and indexing pipeline, run on synthetic episodes.
+
+Usage, from the `pod_transcriber` directory:
+
+```
+python3 -m app.benchmark [BENCHMARK] -n [EPISODES]
+```
+"""
+import argparse
+import json
+import pathlib
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable, Optional
+
+from . import search
+
+# A Zipf-ish vocabulary, so that a few terms are very common and most are rare.
+VOCAB = [f"term{i}" for i in range(50_000)]
+VOCAB_WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCAB))]
+
+
+def synthetic_records(
+    n: int,
+    words_per_episode: int = 200,
+    episodes_per_topic: int = 50,
+    words_per_topic: int = 40,
+    seed: int = 0,
+) -> list[search.SearchRecord]:
+    """
+    Episodes each about one of `n / episodes_per_topic` topics. Half of an episode's
+    words are drawn from a small vocabulary specific to its topic, so episodes about
+    the same topic are similar.
+    """
+    rng = random.Random(seed)
+    topics = [
+        rng.sample(VOCAB, words_per_topic)
+        for _ in range(max(1, n // episodes_per_topic))
+    ]
+    records = []
+    for _ in range(n):
+        topic_vocab = rng.choice(topics)
+        words = rng.choices(VOCAB, VOCAB_WEIGHTS, k=words_per_episode // 2)
+        words += rng.choices(topic_vocab, k=words_per_episode // 2)
+        rng.shuffle(words)
+        records.append(
+            search.SearchRecord(
+                title=" ".join(rng.choices(topic_vocab, k=6)),
+                text=" ".join(words),
+            )
+        )
+    return records
+
+
+def synthetic_queries(n: int, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choices(VOCAB[:5_000], k=rng.randint(1, 3)))
+        for _ in range(n)
+    ]
+
+
+def latencies_ms(
+    fn: Callable[[str], object], queries: list[str]
+) -> list[float]:
+    durations = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        durations.append((time.perf_counter() - start) * 1_000)
+    return durations
+
+
+def _legacy_search(search_dict_path: pathlib.Path, query: str) -> list:
+    """The previous query path: parse the whole JSON search dict, then scan it."""
+    query_parts = query.lower().strip().split()
+    with open(search_dict_path) as f:
+        search_dict = json.load(f)
+    n = len(search_dict)
+    scores = []
+    for i, sd in enumerate(search_dict):
+        score = sum(sd.get(q, 0) for q in query_parts)
+        if score == 0:
+            continue
+        scores.append((score + 1.0 * (n - i) / n, i))
+    scores.sort(reverse=True, key=lambda x: x[0])
+    return scores
+
+
+def bench_search(n: int) -> None:
+    records = synthetic_records(n)
+    queries = synthetic_queries(200)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        index = search.build_search_index(records)
+        build_seconds = time.perf_counter() - start
+        index_path = pathlib.Path(tmp_dir) / "search_index"
+        index.save(index_path)
+        items = list(range(n))
+
+        start = time.perf_counter()
+        search.load_search_index(index_path)
+        load_seconds = time.perf_counter() - start
+        results = {
+            "inverted index": latencies_ms(
+                lambda q: search.search_transcripts(index_path, q, items),  # type: ignore
+                queries,
+            )
+        }
+
+        # Equivalent of the old per-episode JSON dicts, scanned on every query.
+        legacy_path = pathlib.Path(tmp_dir) / "search.json"
+        with open(legacy_path, "w") as f:
+            json.dump(
+                [
+                    {
+                        w: 1.0
+                        for w in search.search_terms(r.title + " " + r.text)
+                    }
+                    for r in records
+                ],
+                f,
+            )
+        results["json scan"] = latencies_ms(
+            lambda q: _legacy_search(legacy_path, q), queries[:20]
+        )
+
+    print(
+        f"{n:,} episodes: index built in {build_seconds:.2f}s, "
+        f"loaded in {load_seconds * 1_000:.1f}ms"
+    )
+    for name, durations in results.items():
+        durations.sort()
+        print(
+            f"{name:>16}: p50 {statistics.median(durations):.3f}ms, "
+            f"p99 {durations[int(0.99 * (len(durations) - 1))]:.3f}ms"
+        )
+
+
+def recall_at_k(
+    results: list[list[int]], baseline: list[list[int]], k: int
+) -> float:
+    """Mean fraction of each row's top `k` baseline neighbours found in `results`."""
+    return statistics.mean(
+        len(set(r[:k]) & set(b[:k])) / len(b[:k])
+        for r, b in zip(results, baseline)
+    )
+
+
+def bench_similarity(n: int) -> None:
+    X, _ = search.calculate_tfidf_features(synthetic_records(n))
+    results = {}
+    seconds = {}
+    for backend in ["svm", "dot", "lsh", "lsh-svm"]:
+        start = time.perf_counter()
+        results[backend] = search.calculate_similarity(X, backend, ntake=40)
+        seconds[backend] = time.perf_counter() - start
+
+    print(f"{n:,} episodes, recall@40 against the exemplar SVM baseline")
+    for backend, result in results.items():
+        print(
+            f"{backend:>8}: {seconds[backend]:.2f}s, "
+            f"recall@40 {recall_at_k(result, results['svm'], 40):.3f}"
+        )
+
+
+def _refresh_peak_rss(n: int, dense: bool) -> tuple[float, float, float]:
+    """
+    Run the feature, similarity and search index steps of `refresh_index` on `n`
+    synthetic episodes. Returns seconds taken, and peak RSS before and after, in MiB.
+    """
+    import resource
+
+    import numpy as np
+
+    records = synthetic_records(n)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    X, v = search.calculate_tfidf_features(records)
+    if dense:
+        # As features were handled before they were kept sparse.
+        X = np.asarray(X.todense())
+    search.calculate_similarity(X, "lsh")
+    search.build_search_index(records)
+    if not dense:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            search.save_tfidf_features(X, v, pathlib.Path(tmp_dir))
+    seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return seconds, rss_before, rss_after
+
+
+def bench_refresh_memory(n: int) -> None:
+    import concurrent.futures
+    import multiprocessing
+
+    print(f"refresh_index steps on {n:,} synthetic episodes")
+    for name, dense in [("dense features", True), ("sparse features", False)]:
+        # Each in a fresh process, so that peak RSS isn't shared between them.
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            seconds, rss_before, rss_after = pool.submit(
+                _refresh_peak_rss, n, dense
+            ).result()
+        print(
+            f"{name:>16}: {seconds:.2f}s, peak RSS {rss_after:.0f}MiB "
+            f"({rss_after - rss_before:+.0f}MiB over the loaded corpus)"
+        )
+
+
+def write_synthetic_episodes(
+    root: pathlib.Path, records: list[search.SearchRecord], start: int = 0
+) -> None:
+    """Write episode metadata and transcripts as `populate_podcast_metadata` and
+    `transcribe_episode` do, under `root`."""
+    import dataclasses
+
+    from .podcast import EpisodeMetadata
+
+    pod_dir = root / "podcast_metadata" / "synthetic"
+    pod_dir.mkdir(parents=True, exist_ok=True)
+    transcriptions_dir = root / "transcriptions"
+    transcriptions_dir.mkdir(parents=True, exist_ok=True)
+    for i, record in enumerate(records, start=start):
+        guid_hash = f"{i:032x}"
+        episode = EpisodeMetadata(
+            podcast_id="synthetic",
+            podcast_title="Synthetic",
+            title=record.title,
+            publish_date="2023-01-01",
+            description="",
+            html_description="",
+            guid=str(i),
+            guid_hash=guid_hash,
+            episode_url=None,
+            original_download_link="",
+        )
+        with open(pod_dir / f"{guid_hash}.json", "w") as f:
+            json.dump(dataclasses.asdict(episode), f)
+        with open(transcriptions_dir / f"{guid_hash}.json", "w") as f:
+            json.dump({"text": record.text, "segments": []}, f)
+
+
+def bench_refresh(n: int) -> None:
+    from . import indexing
+
+    new_episodes = max(1, n // 100)
+    records = synthetic_records(n + new_episodes)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = pathlib.Path(tmp_dir)
+        write_synthetic_episodes(root, records[:n])
+
+        def refresh(incremental: bool) -> float:
+            start = time.perf_counter()
+            indexing.refresh(
+                metadata_dir=root / "podcast_metadata",
+                transcriptions_dir=root / "transcriptions",
+                search_dir=root / "search",
+                similarity_backend="lsh",
+                incremental=incremental,
+            )
+            return time.perf_counter() - start
+
+        results = {
+            "full rebuild": refresh(incremental=False),
+            "no changes": refresh(incremental=True),
+        }
+        write_synthetic_episodes(root, records[n:], start=n)
+        results[f"{new_episodes:,} new episodes"] = refresh(incremental=True)
+
+    print(f"refresh_index over {n:,} synthetic episodes")
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds:.2f}s")
+
+
+def serve_episode(
+    data: bytes, drop_every: Optional[int] = None, send_body: bool = True
+):
+    """
+    Starts a local HTTP server for `data`, supporting Range requests, which drops the
+    connection after every `drop_every` bytes of a response if given, or before any
+    of it if not `send_body`. Returns the server, its URL and a Counter of the
+    connections and requests it handled.
+    "/redirect" redirects to the episode, like podcast hosts' analytics links.
+    """
+    import http.server
+    import threading
+    from collections import Counter
+
+    stats: Counter = Counter()
+    etag = '"synthetic-episode"'
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            stats["connections"] += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            stats["requests"] += 1
+            if self.path == "/redirect":
+                self.send_response(302)
+                self.send_header("Location", "/episode.mp3")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            start = 0
+            range_header = self.headers.get("Range")
+            if range_header and self.headers.get("If-Range", etag) == etag:
+                start = int(range_header.removeprefix("bytes=").split("-")[0])
+            if start >= len(data) > 0:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if start:
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range",
+                    f"bytes {start}-{len(data) - 1}/{len(data)}",
+                )
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(len(data) - start))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            body = memoryview(data)[start:]
+            if not send_body:
+                self.close_connection = True
+            elif drop_every and len(body) > drop_every:
+                self.wfile.write(body[:drop_every])
+                self.close_connection = True
+            else:
+                self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", stats
+
+
+def bench_download(n: int) -> None:
+    import hashlib
+    import http.client
+    import tracemalloc
+    import urllib.request
+
+    from . import podcast
+
+    data = random.Random(0).randbytes(n * 2**20)
+    expected_sha256 = hashlib.sha256(data).hexdigest()
+
+    def read_into_memory(url: str, dest: pathlib.Path) -> None:
+        # How episodes used to be downloaded.
+        request = urllib.request.Request(
+            url, headers={"User-Agent": podcast.USER_AGENT}
+        )
+        with urllib.request.urlopen(request) as response:
+            contents = response.read()
+        dest.write_bytes(contents)
+        assert hashlib.sha256(contents).hexdigest() == expected_sha256
+
+    def stream(url: str, dest: pathlib.Path) -> None:
+        result = podcast.download_podcast_file(
+            url, dest, pool=podcast.HTTPConnectionPool(), retry_wait=0.0
+        )
+        assert result.sha256 == expected_sha256
+
+    scenarios = {
+        "read into memory": (read_into_memory, None),
+        "streamed": (stream, None),
+        "streamed, drops every 8MiB": (stream, 8 * 2**20),
+    }
+    print(f"Downloading a {n}MiB episode from a local server")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dest = pathlib.Path(tmp_dir, "episode.mp3")
+        for name, (download, drop_every) in scenarios.items():
+            server, url, stats = serve_episode(data, drop_every=drop_every)
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            download(f"{url}/episode.mp3", dest)
+            duration = time.perf_counter() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            server.shutdown()
+            assert dest.read_bytes() == data
+            dest.unlink()
+            print(
+                f"{name:>28}: {duration:.2f}s, {peak / 2**20:.1f}MiB peak "
+                f"allocations, {stats['requests']} requests"
+            )
+
+        # A ".part" file left by an earlier attempt is resumed, not restarted.
+        server, url, stats = serve_episode(data)
+        dest.with_name(f"{dest.name}.part").write_bytes(data[: len(data) // 2])
+        stream(f"{url}/episode.mp3", dest)
+        server.shutdown()
+        dest.unlink()
+        print(f"{'resumed .part file':>28}: {stats['requests']} request")
+
+        # Responses cut off before any of the body count towards `max_retries`.
+        server, url, stats = serve_episode(data, send_body=False)
+        t0 = time.perf_counter()
+        try:
+            podcast.download_podcast_file(
+                f"{url}/episode.mp3",
+                dest,
+                pool=podcast.HTTPConnectionPool(),
+                retry_wait=0.01,
+            )
+        except http.client.IncompleteRead:
+            pass
+        else:
+            raise AssertionError("download of a cut off response succeeded")
+        server.shutdown()
+        dest.with_name(f"{dest.name}.part").unlink()
+        print(
+            f"{'no body, gave up':>28}: {stats['requests']} requests in "
+            f"{time.perf_counter() - t0:.2f}s"
+        )
+
+        # Downloading several episodes, behind redirects, with one pool.
+        server, url, stats = serve_episode(data[: 2**20])
+        pool = podcast.HTTPConnectionPool()
+        for i in range(10):
+            result = podcast.download_podcast_file(
+                f"{url}/redirect", pathlib.Path(tmp_dir, f"{i}.mp3"), pool=pool
+            )
+            assert result.size == 2**20
+        pool.close()
+        server.shutdown()
+        print(
+            f"{'10 downloads, pooled':>28}: {stats['requests']} requests "
+            f"over {stats['connections']} connection(s)"
+        )
+
+
+def bench_podcast_page(n: int) -> None:
+    from . import config, episode_index
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = pathlib.Path(tmp_dir)
+        config.PODCAST_METADATA_DIR = root / "podcast_metadata"
+        config.TRANSCRIPTIONS_DIR = root / "transcriptions"
+        config.EPISODE_INDEX_DIR = root / "episode_index"
+        write_synthetic_episodes(root, synthetic_records(n), start=0)
+        pod_dir = config.PODCAST_METADATA_DIR / "synthetic"
+        (pod_dir / "metadata.json").write_text(json.dumps({"id": "synthetic"}))
+
+        def is_transcribed(guid_hash: str) -> bool:
+            return (config.TRANSCRIPTIONS_DIR / f"{guid_hash}.json").exists()
+
+        def list_directory(_: str) -> None:
+            # How get_podcast used to list episodes.
+            episodes = []
+            for file in pod_dir.iterdir():
+                if file.name == "metadata.json":
+                    continue
+                with open(file, "r") as f:
+                    ep = json.load(f)
+                    ep["transcribed"] = is_transcribed(ep["guid_hash"])
+                    episodes.append(ep)
+            episodes.sort(key=lambda ep: ep.get("publish_date"), reverse=True)
+
+        def read_index(podcast_id: str) -> None:
+            episode_index._loaded_indexes.clear()
+            episode_index.load_index(podcast_id)
+
+        episode_index.rebuild_index("synthetic", is_transcribed)
+        requests = ["synthetic"] * 20
+        results = {
+            "list directory": latencies_ms(list_directory, requests),
+            "read index": latencies_ms(read_index, requests),
+            "revalidate index": latencies_ms(
+                lambda podcast_id: episode_index.load_index(podcast_id, ttl=0),
+                requests,
+            ),
+            "cached index": latencies_ms(episode_index.load_index, requests),
+        }
+    print(f"Listing a podcast with {n:,} episodes, median of 20 requests")
+    for name, durations in results.items():
+        print(f"{name:>20}: {statistics.median(durations):.3f}ms")
+
+
+def tiny_en_checkpoint(tmp_dir: pathlib.Path) -> tuple[str, bool]:
+    """
+    Path to the tiny.en Whisper checkpoint if it's been downloaded, otherwise to a
+    randomly initialized model of the same dimensions, and whether it is the former.
+    Model loading and decoding speed are much the same either way, though a random
+    model decodes gibberish.
+    """
+    import dataclasses
+
+    import torch
+    import whisper
+    from whisper.model import ModelDimensions
+
+    from . import config
+
+    for root in [config.MODEL_DIR, pathlib.Path.home() / ".cache" / "whisper"]:
+        if (root / "tiny.en.pt").exists():
+            return str(root / "tiny.en.pt"), True
+
+    dims = ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=384,
+        n_audio_head=6,
+        n_audio_layer=4,
+        n_vocab=51864,
+        n_text_ctx=448,
+        n_text_state=384,
+        n_text_head=6,
+        n_text_layer=4,
+    )
+    path = tmp_dir / "tiny.en-random.pt"
+    torch.manual_seed(0)
+    torch.save(
+        {
+            "dims": dataclasses.asdict(dims),
+            "model_state_dict": whisper.model.Whisper(dims).state_dict(),
+        },
+        path,
+    )
+    return str(path), False
+
+
+def synthetic_audio(seconds: float, seed: int = 0):
+    """A 16kHz float32 waveform of a few tones over background noise."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * 16_000)) / 16_000
+    tones = sum(
+        np.sin(2 * np.pi * f * t) * (0.1 + 0.1 * np.sin(2 * np.pi * t / 3))
+        for f in rng.uniform(100, 1_000, size=3)
+    )
+    noise = rng.normal(scale=0.01, size=t.shape)
+    return (tones + noise).astype(np.float32)
+
+
+def bench_transcriber(n: int) -> None:
+    import torch
+
+    from . import config, transcription
+
+    torch.manual_seed(0)
+    segments = [synthetic_audio(10.0, seed=i) for i in range(n)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpoint, pretrained = tiny_en_checkpoint(pathlib.Path(tmp_dir))
+        model = config.ModelSpec(
+            name=checkpoint, params="39M", relative_speed=32
+        )
+
+        def transcribe_all(reload: bool) -> transcription.SegmentStats:
+            total = transcription.SegmentStats()
+            for audio in segments:
+                if reload:
+                    transcription._models.clear()
+                stats = transcription.SegmentStats()
+                whisper_model, stats.model_load = transcription.load_model(
+                    model, device="cpu"
+                )
+                t0 = time.perf_counter()
+                # Without temperature fallback, a random model's gibberish takes
+                # a predictable amount of decoding.
+                transcription.decode(whisper_model, audio, temperature=0.0)
+                stats.decode = time.perf_counter() - t0
+                total += stats
+            return total
+
+        results = {
+            "model load per segment": transcribe_all(reload=True),
+            "container model cache": transcribe_all(reload=False),
+        }
+        transcription._models.clear()
+
+    weights = "tiny.en" if pretrained else "randomly initialized tiny.en-sized"
+    print(
+        f"{n} 10s segments with {weights} Whisper on CPU, "
+        f"{torch.get_num_threads()} threads"
+    )
+    for name, stats in results.items():
+        total = stats.model_load + stats.decode
+        print(
+            f"{name:>24}: {total:.2f}s total, {stats.model_load:.2f}s loading, "
+            f"{stats.decode:.2f}s decoding"
+        )
+
+
+def bench_transcriber_batch(n: int) -> None:
+    import torch
+    import whisper
+
+    from . import transcription
+
+    torch.manual_seed(0)
+    segments = [synthetic_audio(30.0, seed=i) for i in range(n)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        checkpoint, pretrained = tiny_en_checkpoint(pathlib.Path(tmp_dir))
+        whisper_model = whisper.load_model(checkpoint, device="cpu")
+
+    weights = "tiny.en" if pretrained else "randomly initialized tiny.en-sized"
+    print(
+        f"{n} 30s segments with {weights} Whisper on CPU, "
+        f"{torch.get_num_threads()} threads"
+    )
+    for batch_size in [1, 4, 8, 16]:
+        t0 = time.perf_counter()
+        # A random model's gibberish runs on to the sample length, so it's capped at
+        # about the number of tokens in 30 seconds of speech.
+        transcription.decode_batch(
+            whisper_model, segments, batch_size=batch_size, sample_len=100
+        )
+        elapsed = time.perf_counter() - t0
+        print(
+            f"batch size {batch_size:>2}: {elapsed:.2f}s, "
+            f"{n / elapsed:.2f} segments/s"
+        )
+
+
+def _run_ffmpeg_piped(stream, path: pathlib.Path) -> int:
+    """
+    Runs an ffmpeg command reading from "pipe:", feeding it the file at `path`, and
+    returns roughly how many bytes of the file ffmpeg read before it finished.
+    """
+    import subprocess
+
+    process = subprocess.Popen(
+        stream.compile(),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    assert process.stdin
+    bytes_written = 0
+    with open(path, "rb") as f:
+        try:
+            while chunk := f.read(2**16):
+                process.stdin.write(chunk)
+                bytes_written += len(chunk)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass  # ffmpeg has all the input it needs.
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed reading {path}")
+    return bytes_written
+
+
+def synthetic_mp3(dest: pathlib.Path, seconds: float) -> None:
+    import wave
+
+    import ffmpeg
+    import numpy as np
+
+    wav_path = dest.with_suffix(".wav")
+    pcm = (synthetic_audio(seconds) * 32767).astype(np.int16)
+    with wave.open(str(wav_path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16_000)
+        f.writeframes(pcm.tobytes())
+    ffmpeg.input(str(wav_path)).output(str(dest), audio_bitrate="128k").run(
+        quiet=True
+    )
+    wav_path.unlink()
+
+
+def bench_audio_slicing(n: int) -> None:
+    import shutil
+
+    import ffmpeg
+    import whisper
+
+    from . import transcription
+
+    if shutil.which("ffmpeg") is None:
+        raise SystemExit("The audio-slicing benchmark needs ffmpeg installed.")
+
+    segment_seconds = 30.0
+    segments = [
+        (i * segment_seconds, (i + 1) * segment_seconds) for i in range(n)
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mp3_path = pathlib.Path(tmp_dir, "episode.mp3")
+        synthetic_mp3(mp3_path, seconds=n * segment_seconds)
+
+        def trim_per_segment() -> tuple[float, float, int]:
+            # Each segment is trimmed out of the episode into an mp3, which Whisper
+            # then decodes again.
+            t0, cpu0 = time.perf_counter(), transcription.children_cpu_seconds()
+            bytes_read = 0
+            trimmed_path = pathlib.Path(tmp_dir, "segment.mp3")
+            for start, end in segments:
+                trim = (
+                    ffmpeg.input("pipe:")
+                    .filter("atrim", start=start, end=end)
+                    .output(str(trimmed_path))
+                    .overwrite_output()
+                )
+                bytes_read += _run_ffmpeg_piped(trim, mp3_path)
+                whisper.load_audio(str(trimmed_path))
+                bytes_read += trimmed_path.stat().st_size
+            return (
+                time.perf_counter() - t0,
+                transcription.children_cpu_seconds() - cpu0,
+                bytes_read,
+            )
+
+        def decode_once() -> tuple[float, float, int]:
+            t0 = time.perf_counter()
+            pcm_path = pathlib.Path(tmp_dir, "episode.s16le")
+            decode_stats = transcription.decode_audio(mp3_path, pcm_path)
+            bytes_read = decode_stats.bytes_read
+            for start, end in segments:
+                audio = transcription.load_audio_segment(pcm_path, start, end)
+                bytes_read += audio.size * transcription.PCM_SAMPLE_WIDTH
+            pcm_path.unlink()
+            return (
+                time.perf_counter() - t0,
+                decode_stats.ffmpeg_cpu,
+                bytes_read,
+            )
+
+        results = {
+            "ffmpeg trim per segment": trim_per_segment(),
+            "decode once, mmap slices": decode_once(),
+        }
+        episode_size = mp3_path.stat().st_size
+
+    print(
+        f"{n} {segment_seconds:.0f}s segments of a {episode_size / 2**20:.1f}MiB "
+        "synthetic mp3 episode"
+    )
+    for name, (seconds, ffmpeg_cpu, bytes_read) in results.items():
+        print(
+            f"{name:>24}: {seconds:.2f}s, {ffmpeg_cpu:.2f}s ffmpeg CPU, "
+            f"{bytes_read / 2**20:.1f}MiB read"
+        )
+
+
+def synthetic_speech(seconds: float, seed: int = 0):
+    """
+    16kHz 16-bit PCM audio of tone bursts separated by pauses of background noise,
+    and the (start, end) in seconds of the pauses. Pauses are either well under or
+    well over a second long, so where to split the audio on silences is unambiguous.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    num_samples = int(seconds * 16_000)
+    audio = rng.normal(scale=0.001, size=num_samples)
+    pauses = []
+    position = 0
+    while position < num_samples:
+        burst = int(rng.uniform(2.0, 20.0) * 16_000)
+        t = np.arange(min(burst, num_samples - position)) / 16_000
+        frequency = rng.uniform(100, 400)
+        audio[position : position + len(t)] += 0.5 * np.sin(
+            2 * np.pi * frequency * t
+        )
+        position += len(t)
+        pause = int(
+            rng.choice([rng.uniform(0.1, 0.6), rng.uniform(1.5, 3.0)]) * 16_000
+        )
+        if position + pause < num_samples:
+            pauses.append((position / 16_000, (position + pause) / 16_000))
+        position += pause
+    return (audio * 32767).astype(np.int16), pauses
+
+
+def bench_silences(n: int) -> None:
+    import tracemalloc
+
+    from . import transcription
+
+    seconds = n * 60.0
+    pcm, pauses = synthetic_speech(seconds)
+    # Pauses long enough to split at, at least 30 seconds apart, as split_silences
+    # should choose.
+    expected = []
+    cur_start = 0.0
+    for start, end in pauses:
+        split_at = (start + end) / 2
+        if end - start >= 1.0 and split_at - cur_start >= 30.0:
+            expected.append(split_at)
+            cur_start = split_at
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pcm_path = pathlib.Path(tmp_dir, "episode.s16le")
+        pcm.tofile(pcm_path)
+        del pcm
+
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        segments = list(transcription.split_silences(pcm_path))
+        duration = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    cuts = [end for _, end in segments if end < seconds]
+    errors = [abs(cut - split_at) for cut, split_at in zip(cuts, expected)]
+    print(f"split_silences over {n} minutes of synthetic 16kHz PCM audio")
+    print(
+        f"{len(segments)} segments in {duration:.3f}s "
+        f"({seconds / duration:,.0f}x real time), "
+        f"{peak / 2**20:.1f}MiB peak allocations"
+    )
+    print(
+        f"{len(cuts)} cuts for {len(expected)} expected, "
+        f"max error {max(errors, default=0.0) * 1000:.0f}ms"
+    )
+
+
+BENCHMARKS = {
+    "audio-slicing": bench_audio_slicing,
+    "download": bench_download,
+    "podcast-page": bench_podcast_page,
+    "refresh": bench_refresh,
+    "refresh-memory": bench_refresh_memory,
+    "search": bench_search,
+    "silences": bench_silences,
+    "similarity": bench_similarity,
+    "transcriber": bench_transcriber,
+    "transcriber-batch": bench_transcriber_batch,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument(
+        "-n", type=int, default=1_000, help="number of episodes"
+    )
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.n)
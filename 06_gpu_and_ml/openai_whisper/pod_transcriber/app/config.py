@@ -25,11 +25,19 @@ CACHE_DIR = "/cache"
 # Where downloaded podcasts are stored, by guid hash.
 # Mostly .mp3 files 50-100MiB.
 RAW_AUDIO_DIR = pathlib.Path(CACHE_DIR, "raw_audio")
+# Episodes' audio decoded to raw 16kHz mono 16-bit PCM while they're transcribed,
+# by guid hash. Around 110MiB per hour of audio.
+PCM_AUDIO_DIR = pathlib.Path(CACHE_DIR, "pcm_audio")
 # Stores metadata of individual podcast episodes as JSON.
 PODCAST_METADATA_DIR = pathlib.Path(CACHE_DIR, "podcast_metadata")
 # Completed episode transcriptions. Stored as flat files with
 # files structured as '{guid_hash}-{model_slug}.json'.
 TRANSCRIPTIONS_DIR = pathlib.Path(CACHE_DIR, "transcriptions")
+# Indexes of each podcast's episodes, for listing them, stored as '{podcast_id}.json'.
+EPISODE_INDEX_DIR = pathlib.Path(CACHE_DIR, "episode_index")
+# Logs of episodes' transcribed segments, appended to as they're transcribed and
+# compacted into transcriptions when done. Stored as '{guid_hash}.jsonl'.
+SEGMENT_LOGS_DIR = pathlib.Path(CACHE_DIR, "segment_logs")
 # Searching indexing files, refreshed by scheduled functions.
 SEARCH_DIR = pathlib.Path(CACHE_DIR, "search")
 # Location of modal checkpoint.
@@ -38,6 +46,28 @@ MODEL_DIR = pathlib.Path(CACHE_DIR, "model")
 ASSETS_PATH = pathlib.Path(__file__).parent / "frontend" / "dist"
 
 transcripts_per_podcast_limit = 2
+# How long the API serves a podcast's episode index before checking it for changes.
+EPISODE_INDEX_TTL_SECS = 10.0
+# How old a podcast's episode index gets before the API refreshes its metadata.
+PODCAST_METADATA_MAX_AGE_SECS = 10 * 60
+# Number of an episode's segments transcribed in one call to a transcriber container.
+SEGMENTS_PER_TRANSCRIBE_CALL = 8
+# Maximum number of 30 second windows of audio Whisper decodes in one batch.
+TRANSCRIBE_BATCH_SIZE = 8
+
+# How `refresh_index` finds similar episodes, one of `search.SIMILARITY_BACKENDS`.
+# "lsh-svm" ranks LSH candidates with exemplar SVMs, closely matching "svm", which
+# trains an SVM per episode against every other episode, at a fraction of the cost.
+SIMILARITY_BACKEND = "lsh-svm"
+# Whether `refresh_index` saves the tfidf features and vectorizer alongside the
+# search index, as .npz files. Incremental refreshes rely on them.
+PERSIST_TFIDF_FEATURES = True
+# Whether `refresh_index` only indexes new or changed episodes, when it can.
+INCREMENTAL_INDEX_REFRESH = True
+# New episodes are indexed with the vocabulary of the last full rebuild. Once the
+# fraction of new transcripts' words it covers drops by more than this, compared to
+# the transcripts it was fitted on, the index is rebuilt from scratch.
+MAX_VOCABULARY_DRIFT = 0.05
 
 supported_whisper_models = {
     "tiny.en": ModelSpec(name="tiny.en", params="39M", relative_speed=32),
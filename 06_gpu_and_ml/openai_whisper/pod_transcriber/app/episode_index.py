@@ -0,0 +1,143 @@
+"""
+Per-podcast indexes of episodes, so that listing a podcast's episodes reads one
+file, rather than every episode's metadata file and a transcript path per episode.
+
+`populate_podcast_metadata` writes a podcast's index and `process_episode` marks
+episodes transcribed in it.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import time
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from . import config
+
+logger = config.get_logger(__name__)
+
+# Episode metadata fields kept in the index, those the podcast page shows.
+EPISODE_FIELDS = ("guid_hash", "title", "publish_date")
+
+
+def get_index_path(podcast_id: str) -> pathlib.Path:
+    return config.EPISODE_INDEX_DIR / f"{podcast_id}.json"
+
+
+def _write(podcast_id: str, index: dict) -> None:
+    path = get_index_path(podcast_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(index, separators=(",", ":")))
+    os.replace(tmp_path, path)
+
+
+def _read(podcast_id: str) -> Optional[dict]:
+    try:
+        return json.loads(get_index_path(podcast_id).read_bytes())
+    except FileNotFoundError:
+        return None
+
+
+def write_index(
+    podcast_id: str,
+    pod_metadata: dict,
+    episodes: Iterable[dict],
+    is_transcribed: Callable[[str], bool],
+) -> None:
+    """
+    Writes the index of a podcast's episodes, most recent first. Episodes already
+    in the index but missing from `episodes` are kept.
+    """
+    previous = _read(podcast_id)
+    entries = {
+        ep["guid_hash"]: ep for ep in (previous or {}).get("episodes", [])
+    }
+    for ep in episodes:
+        entries[ep["guid_hash"]] = {
+            field: ep[field] for field in EPISODE_FIELDS
+        }
+    for guid_hash, entry in entries.items():
+        entry["transcribed"] = is_transcribed(guid_hash)
+    _write(
+        podcast_id,
+        {
+            "pod_metadata": pod_metadata,
+            "episodes": sorted(
+                entries.values(),
+                key=lambda ep: ep.get("publish_date") or "",
+                reverse=True,
+            ),
+        },
+    )
+    logger.info(f"Indexed {len(entries)} episodes of podcast {podcast_id}")
+
+
+def rebuild_index(
+    podcast_id: str, is_transcribed: Callable[[str], bool]
+) -> None:
+    """Writes a podcast's index from its metadata files."""
+    metadata_dir = config.PODCAST_METADATA_DIR / podcast_id
+    pod_metadata = json.loads((metadata_dir / "metadata.json").read_bytes())
+    episodes = [
+        json.loads(path.read_bytes())
+        for path in metadata_dir.iterdir()
+        if path.name != "metadata.json" and path.suffix == ".json"
+    ]
+    write_index(podcast_id, pod_metadata, episodes, is_transcribed)
+
+
+def mark_transcribed(podcast_id: str, guid_hash: str) -> None:
+    index = _read(podcast_id)
+    if index is None:
+        return
+    for entry in index["episodes"]:
+        if entry["guid_hash"] == guid_hash and not entry["transcribed"]:
+            entry["transcribed"] = True
+            _write(podcast_id, index)
+            return
+
+
+class CachedIndex(NamedTuple):
+    # When the index file was last checked for changes, by `time.monotonic()`.
+    checked_at: float
+    mtime_ns: int
+    # Changes whenever the index does, for HTTP ETags.
+    digest: str
+    data: dict
+
+
+_loaded_indexes: dict[str, CachedIndex] = {}
+
+
+def load_index(
+    podcast_id: str, ttl: float = config.EPISODE_INDEX_TTL_SECS
+) -> Optional[CachedIndex]:
+    """
+    Loads a podcast's index once per container, or returns None if it has none. The
+    index file is only checked for changes once it has been cached for `ttl`
+    seconds, and only read again if it has changed.
+    """
+    now = time.monotonic()
+    cached = _loaded_indexes.get(podcast_id)
+    if cached is not None and now - cached.checked_at < ttl:
+        return cached
+
+    path = get_index_path(podcast_id)
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        _loaded_indexes.pop(podcast_id, None)
+        return None
+    if cached is not None and cached.mtime_ns == mtime_ns:
+        cached = cached._replace(checked_at=now)
+    else:
+        content = path.read_bytes()
+        cached = CachedIndex(
+            checked_at=now,
+            mtime_ns=mtime_ns,
+            digest=hashlib.sha1(content).hexdigest(),
+            data=json.loads(content),
+        )
+    _loaded_indexes[podcast_id] = cached
+    return cached
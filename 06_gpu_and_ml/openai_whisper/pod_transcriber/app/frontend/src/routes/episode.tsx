@@ -126,8 +126,9 @@ function ErrorCallout({ msg }: { msg: string }) {
 }
 
 interface Status {
-  done_segments: number;
-  total_segments: number;
+  done_batches: number;
+  total_batches: number;
+  segments_per_batch: number;
   tasks: number;
 }
 
@@ -171,7 +172,8 @@ function TranscribeProgress({
       }
 
       setStatus(body);
-      onProgress(body.done_segments ?? 0);
+      // Batches hold up to `segments_per_batch` segments, the last one fewer.
+      onProgress((body.done_batches ?? 0) * (body.segments_per_batch ?? 1));
       if (body.finished) {
         setFinished(true);
         onFinished();
@@ -201,8 +203,8 @@ function TranscribeProgress({
         </span>
       </div>
       <ProgressBar
-        completed={status?.done_segments ?? 0}
-        total={status?.total_segments ?? 1}
+        completed={status?.done_batches ?? 0}
+        total={status?.total_batches ?? 1}
       />
     </div>
   );
@@ -323,6 +325,13 @@ export default function Podcast() {
     fetchData
   );
 
+  // Fetch the partial transcript as segments finish.
+  useEffect(() => {
+    if (numFinishedSegments > 0) {
+      mutate(`/api/episode/${params.podcastId}/${params.episodeId}`);
+    }
+  }, [numFinishedSegments]);
+
   if (!data) {
     return (
       <div className="absolute m-auto left-0 right-0 w-fit top-0 bottom-0 h-fit">
@@ -347,7 +356,7 @@ export default function Podcast() {
           <div className="break-words text-gray-700 sm:text-sm py-4">
             {data.metadata.description}
           </div>
-          {!data.segments && (
+          {(!data.segments || data.partial) && (
             <TranscribeNow
               podcastId={params.podcastId!}
               episodeId={params.episodeId!}
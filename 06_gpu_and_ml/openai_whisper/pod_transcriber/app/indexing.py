@@ -0,0 +1,434 @@
+"""
+Builds the search artifacts served from the search directory, either from scratch
+or incrementally.
+
+A manifest records which episode metadata and transcript files were indexed, by
+modification time, size and content hash. An incremental refresh only parses and
+tokenizes new or changed files, and only computes tfidf features and similar
+episodes for those episodes and their neighbours. The stored artifacts are still
+rewritten whole, and the BM25 search index is recomputed from the stored term
+counts of every episode, as its term weights depend on the whole collection.
+New episodes are transformed with the vocabulary fitted in the last full rebuild,
+so once the vocabulary covers new transcripts noticeably worse than it covered the
+indexed ones, a full rebuild is done instead.
+"""
+import dataclasses
+import hashlib
+import json
+import pathlib
+import random
+from typing import NamedTuple, Optional
+
+from . import config, podcast, search
+
+logger = config.get_logger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+TERM_COUNTS_FILENAME = "search_term_counts.npz"
+INDEXED_EPISODES_FILENAME = "all.json"
+SEARCH_INDEX_DIRNAME = "search_index"
+
+
+class FileState(NamedTuple):
+    mtime_ns: int
+    size: int
+    sha256: str
+
+
+class ManifestEntry(NamedTuple):
+    # Row of the episode in the search artifacts.
+    doc: int
+    metadata: FileState
+    transcript: FileState
+
+
+@dataclasses.dataclass
+class Manifest:
+    # Similarity backend used in the last full rebuild.
+    similarity_backend: str
+    # Fraction of tokens covered by the tfidf vocabulary in the last full rebuild.
+    baseline_coverage: float
+    episodes: dict[str, ManifestEntry] = dataclasses.field(default_factory=dict)
+    # Tokens, and those covered by the vocabulary, indexed incrementally since.
+    added_tokens: int = 0
+    added_covered_tokens: int = 0
+
+    def vocabulary_drift(self) -> float:
+        if self.added_tokens == 0:
+            return 0.0
+        coverage = self.added_covered_tokens / self.added_tokens
+        return self.baseline_coverage - coverage
+
+
+def load_manifest(search_dir: pathlib.Path) -> Optional[Manifest]:
+    try:
+        with open(search_dir / MANIFEST_FILENAME) as f:
+            data = json.load(f)
+        # Entries are stored as flat lists, which are much faster to (de)serialize
+        # than nested objects for large numbers of episodes.
+        data["episodes"] = {
+            guid_hash: ManifestEntry(
+                doc, FileState(*entry[1:4]), FileState(*entry[4:7])
+            )
+            for guid_hash, entry in data["episodes"].items()
+            for doc in entry[:1]
+        }
+        return Manifest(**data)
+    except (FileNotFoundError, json.decoder.JSONDecodeError, TypeError):
+        return None
+
+
+def write_manifest(manifest: Manifest, search_dir: pathlib.Path) -> None:
+    data = {
+        **dataclasses.asdict(dataclasses.replace(manifest, episodes={})),
+        "episodes": {
+            guid_hash: [entry.doc, *entry.metadata, *entry.transcript]
+            for guid_hash, entry in manifest.episodes.items()
+        },
+    }
+    tmp_path = search_dir / f"{MANIFEST_FILENAME}.tmp"
+    tmp_path.write_text(json.dumps(data))
+    tmp_path.rename(search_dir / MANIFEST_FILENAME)
+
+
+def file_state(
+    path: pathlib.Path, previous: Optional[FileState] = None
+) -> tuple[FileState, Optional[bytes]]:
+    """
+    Returns the state of the file at `path`, and its contents if they had to be
+    read. Files with the same modification time and size as `previous` aren't read.
+    """
+    stat = path.stat()
+    if (
+        previous is not None
+        and previous.mtime_ns == stat.st_mtime_ns
+        and previous.size == stat.st_size
+    ):
+        return previous, None
+    content = path.read_bytes()
+    state = FileState(
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        sha256=hashlib.sha256(content).hexdigest(),
+    )
+    return state, content
+
+
+def vocabulary_coverage(v, texts: list[str]) -> tuple[int, int]:
+    """Returns the number of tokens in `texts`, and those in the vocabulary of `v`."""
+    analyze = v.build_analyzer()
+    total = covered = 0
+    for text in texts:
+        tokens = analyze(text)
+        total += len(tokens)
+        covered += sum(1 for t in tokens if t in v.vocabulary_)
+    return total, covered
+
+
+def _episode_metadata_paths(
+    metadata_dir: pathlib.Path,
+) -> dict[str, pathlib.Path]:
+    """Paths of episode metadata files by guid hash, found without reading them."""
+    paths: dict[str, pathlib.Path] = {}
+    if not metadata_dir.exists():
+        return paths
+    for pod_dir in metadata_dir.iterdir():
+        if not pod_dir.is_dir():
+            continue
+        for filepath in pod_dir.iterdir():
+            if filepath.name != "metadata.json" and filepath.suffix == ".json":
+                paths[filepath.stem] = filepath
+    return paths
+
+
+def _transcript_paths(
+    transcriptions_dir: pathlib.Path,
+) -> dict[str, pathlib.Path]:
+    if not transcriptions_dir.exists():
+        return {}
+    return {
+        file.stem.split("-")[0]: file for file in transcriptions_dir.iterdir()
+    }
+
+
+def _parse_episode(content: bytes) -> podcast.EpisodeMetadata:
+    import dacite
+
+    return dacite.from_dict(
+        data_class=podcast.EpisodeMetadata, data=json.loads(content)
+    )
+
+
+def _search_record(
+    episode: podcast.EpisodeMetadata, transcript_content: bytes
+) -> search.SearchRecord:
+    return search.SearchRecord(
+        title=episode.title, text=json.loads(transcript_content)["text"]
+    )
+
+
+def _write_similarity(
+    sim: list[list[int]], search_dir: pathlib.Path, backend: str
+):
+    filepath = search_dir / f"sim_tfidf_{backend}.json"
+    logger.info(f"writing {filepath}")
+    filepath.write_text(json.dumps(sim))
+
+
+def _write_indexed_episodes(episodes: list[dict], search_dir: pathlib.Path):
+    filepath = search_dir / INDEXED_EPISODES_FILENAME
+    logger.info(f"writing {filepath}")
+    filepath.write_text(json.dumps(episodes))
+
+
+def full_refresh(
+    *,
+    metadata_dir: pathlib.Path,
+    transcriptions_dir: pathlib.Path,
+    search_dir: pathlib.Path,
+    similarity_backend: str,
+    persist_features: bool = True,
+) -> None:
+    """Rebuild all search artifacts from every episode's metadata and transcript."""
+    search_dir.mkdir(parents=True, exist_ok=True)
+    # Removed first, so that an interrupted rebuild is followed by another.
+    (search_dir / MANIFEST_FILENAME).unlink(missing_ok=True)
+
+    episodes: dict[str, tuple[podcast.EpisodeMetadata, FileState]] = {}
+    for guid_hash, filepath in _episode_metadata_paths(metadata_dir).items():
+        state, content = file_state(filepath)
+        try:
+            episodes[guid_hash] = (_parse_episode(content), state)
+        except json.decoder.JSONDecodeError:
+            logger.warning(f"Removing corrupt JSON metadata file: {filepath}.")
+            filepath.unlink()
+    logger.info(f"Loaded {len(episodes)} podcast episodes.")
+
+    # Important: These have to be the same length and have same episode order.
+    # i-th element of indexed_episodes is the episode indexed by the i-th element
+    # of search_records
+    indexed_episodes = []
+    search_records: list[search.SearchRecord] = []
+    manifest_entries = {}
+    for guid_hash, filepath in _transcript_paths(transcriptions_dir).items():
+        if guid_hash not in episodes:
+            continue
+        episode, metadata_state = episodes[guid_hash]
+        transcript_state, content = file_state(filepath)
+        manifest_entries[guid_hash] = ManifestEntry(
+            doc=len(search_records),
+            metadata=metadata_state,
+            transcript=transcript_state,
+        )
+        search_records.append(_search_record(episode, content))
+        # Prepare records for JSON serialization
+        indexed_episodes.append(dataclasses.asdict(episode))
+    logger.info(
+        f"Matched {len(search_records)} transcripts to episode records."
+    )
+    _write_indexed_episodes(indexed_episodes, search_dir)
+
+    logger.info(
+        "calc feature vectors for all transcripts, keeping track of similar podcasts"
+    )
+    X, v = search.calculate_tfidf_features(search_records)
+    if persist_features:
+        logger.info(f"writing tfidf features to {search_dir}")
+        search.save_tfidf_features(X, v, search_dir)
+    sample = random.Random(0).sample(
+        search_records, min(len(search_records), 1_000)
+    )
+    total, covered = vocabulary_coverage(v, [r.text for r in sample])
+
+    logger.info(
+        f"finding similar episodes with the '{similarity_backend}' backend"
+    )
+    sim = search.calculate_similarity(X, similarity_backend)
+    _write_similarity(sim, search_dir, similarity_backend)
+
+    logger.info("calculate the search index to support search")
+    term_counts = search.SearchTermCounts.empty().upsert(
+        search_records, range(len(search_records))
+    )
+    term_counts.save(search_dir / TERM_COUNTS_FILENAME)
+    search.build_search_index(term_counts).save(
+        search_dir / SEARCH_INDEX_DIRNAME
+    )
+
+    if not persist_features:
+        # Incremental refreshes need the features, so the next refresh is a full one.
+        (search_dir / MANIFEST_FILENAME).unlink(missing_ok=True)
+        return
+    # Written last, so that an interrupted refresh is followed by a full rebuild.
+    manifest = Manifest(
+        similarity_backend=similarity_backend,
+        baseline_coverage=covered / total if total else 1.0,
+        episodes=manifest_entries,
+    )
+    write_manifest(manifest, search_dir)
+
+
+def incremental_refresh(
+    *,
+    metadata_dir: pathlib.Path,
+    transcriptions_dir: pathlib.Path,
+    search_dir: pathlib.Path,
+    manifest: Manifest,
+    max_vocabulary_drift: float,
+) -> bool:
+    """
+    Update the search artifacts with the new or changed episodes, without parsing
+    or tokenizing the others again. The feature matrix, episode list and similar
+    episodes are rewritten whole, and the search index is rebuilt from the stored
+    term counts. Returns False, having changed nothing, if a full rebuild is
+    needed instead.
+    """
+    import numpy as np
+
+    metadata_paths = _episode_metadata_paths(metadata_dir)
+    transcript_paths = _transcript_paths(transcriptions_dir)
+    removed = [
+        guid_hash
+        for guid_hash in manifest.episodes
+        if guid_hash not in metadata_paths or guid_hash not in transcript_paths
+    ]
+    if removed:
+        logger.info(f"{len(removed)} indexed episodes were removed.")
+        return False
+
+    next_doc = len(manifest.episodes)
+    changed: dict[str, ManifestEntry] = {}
+    records: list[search.SearchRecord] = []
+    episodes: list[podcast.EpisodeMetadata] = []
+    for guid_hash, transcript_path in transcript_paths.items():
+        metadata_path = metadata_paths.get(guid_hash)
+        if metadata_path is None:
+            continue
+        entry = manifest.episodes.get(guid_hash)
+        metadata_state, metadata = file_state(
+            metadata_path, entry.metadata if entry else None
+        )
+        transcript_state, transcript = file_state(
+            transcript_path, entry.transcript if entry else None
+        )
+        if entry is not None:
+            if (
+                metadata_state.sha256 == entry.metadata.sha256
+                and transcript_state.sha256 == entry.transcript.sha256
+            ):
+                # Files may have been rewritten with the same contents.
+                manifest.episodes[guid_hash] = entry._replace(
+                    metadata=metadata_state, transcript=transcript_state
+                )
+                continue
+        try:
+            episode = _parse_episode(metadata or metadata_path.read_bytes())
+        except json.decoder.JSONDecodeError:
+            logger.warning(
+                f"Skipping corrupt JSON metadata file: {metadata_path}."
+            )
+            continue
+        if entry is None:
+            doc, next_doc = next_doc, next_doc + 1
+        else:
+            doc = entry.doc
+        changed[guid_hash] = ManifestEntry(
+            doc=doc, metadata=metadata_state, transcript=transcript_state
+        )
+        episodes.append(episode)
+        records.append(
+            _search_record(episode, transcript or transcript_path.read_bytes())
+        )
+
+    logger.info(f"{len(changed)} new or changed episodes to index.")
+    if not changed:
+        write_manifest(manifest, search_dir)
+        return True
+
+    X, v = search.load_tfidf_features(search_dir)
+    total, covered = vocabulary_coverage(v, [r.text for r in records])
+    manifest.added_tokens += total
+    manifest.added_covered_tokens += covered
+    drift = manifest.vocabulary_drift()
+    logger.info(f"Vocabulary drift since the last full rebuild is {drift:.3f}.")
+    if drift > max_vocabulary_drift:
+        return False
+
+    # Removed while the artifacts are updated, so that an interrupted refresh is
+    # followed by a full rebuild.
+    (search_dir / MANIFEST_FILENAME).unlink()
+    docs = np.array([entry.doc for entry in changed.values()])
+    n = next_doc
+    X = search.upsert_rows(
+        X,
+        docs,
+        v.transform([r.title + ". " + r.text for r in records]),
+        (n, X.shape[1]),
+    )
+    search.save_tfidf_features(X, v, search_dir)
+
+    with open(search_dir / INDEXED_EPISODES_FILENAME) as f:
+        indexed_episodes = json.load(f)
+    indexed_episodes.extend([{}] * (n - len(indexed_episodes)))
+    for doc, episode in zip(docs, episodes):
+        indexed_episodes[doc] = dataclasses.asdict(episode)
+    _write_indexed_episodes(indexed_episodes, search_dir)
+
+    backend = manifest.similarity_backend
+    with open(search_dir / f"sim_tfidf_{backend}.json") as f:
+        sim = json.load(f)
+    sim = search.update_similarity(X, sim, docs)
+    _write_similarity(sim, search_dir, backend)
+
+    term_counts = search.SearchTermCounts.load(
+        search_dir / TERM_COUNTS_FILENAME
+    )
+    term_counts = term_counts.upsert(records, docs)
+    term_counts.save(search_dir / TERM_COUNTS_FILENAME)
+    search.build_search_index(term_counts).save(
+        search_dir / SEARCH_INDEX_DIRNAME
+    )
+
+    manifest.episodes.update(changed)
+    write_manifest(manifest, search_dir)
+    return True
+
+
+def refresh(
+    *,
+    metadata_dir: pathlib.Path,
+    transcriptions_dir: pathlib.Path,
+    search_dir: pathlib.Path,
+    similarity_backend: str,
+    incremental: bool = True,
+    persist_features: bool = True,
+    max_vocabulary_drift: float = 0.05,
+) -> None:
+    """
+    Refresh the search artifacts incrementally if possible, otherwise rebuild them.
+    Incremental refreshes rely on the tfidf features persisted by full rebuilds.
+    """
+    manifest = None
+    if incremental and persist_features:
+        manifest = load_manifest(search_dir)
+    if (
+        manifest is not None
+        and manifest.similarity_backend == similarity_backend
+    ):
+        logger.info("Refreshing the search index incrementally.")
+        if incremental_refresh(
+            metadata_dir=metadata_dir,
+            transcriptions_dir=transcriptions_dir,
+            search_dir=search_dir,
+            manifest=manifest,
+            max_vocabulary_drift=max_vocabulary_drift,
+        ):
+            return
+    logger.info("Rebuilding the search index from scratch.")
+    full_refresh(
+        metadata_dir=metadata_dir,
+        transcriptions_dir=transcriptions_dir,
+        search_dir=search_dir,
+        similarity_backend=similarity_backend,
+        persist_features=persist_features,
+    )
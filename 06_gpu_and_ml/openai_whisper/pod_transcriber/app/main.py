@@ -4,9 +4,10 @@ of podcasts.
 """
 import dataclasses
 import datetime
+import itertools
 import json
 import pathlib
-from typing import Iterator, Tuple
+from typing import Iterable, Iterator, Tuple, TypeVar
 
 from modal import (
     Dict,
@@ -17,11 +18,20 @@ from modal import (
     Secret,
     Stub,
     asgi_app,
+    method,
 )
 
-from . import config, podcast, search
+from . import (
+    config,
+    episode_index,
+    indexing,
+    podcast,
+    segment_log,
+    transcription,
+)
 
 logger = config.get_logger(__name__)
+T = TypeVar("T")
 volume = NetworkFileSystem.persisted("dataset-cache-vol")
 
 app_image = (
@@ -68,6 +78,10 @@ def get_transcript_path(guid_hash: str) -> pathlib.Path:
     return config.TRANSCRIPTIONS_DIR / f"{guid_hash}.json"
 
 
+def get_segment_log_path(guid_hash: str) -> pathlib.Path:
+    return config.SEGMENT_LOGS_DIR / f"{guid_hash}.jsonl"
+
+
 @stub.function(network_file_systems={config.CACHE_DIR: volume})
 def populate_podcast_metadata(podcast_id: str):
     from gql import gql
@@ -92,6 +106,15 @@ def populate_podcast_metadata(podcast_id: str):
         with open(metadata_path, "w") as f:
             json.dump(dataclasses.asdict(ep), f)
 
+    episode_index.write_index(
+        podcast_id,
+        pod_metadata=dataclasses.asdict(pod_metadata),
+        episodes=(dataclasses.asdict(ep) for ep in episodes),
+        is_transcribed=lambda guid_hash: get_transcript_path(
+            guid_hash
+        ).exists(),
+    )
+
     logger.info(f"Populated metadata for {pod_metadata.title}")
 
 
@@ -145,188 +168,51 @@ def search_podcast(name):
     timeout=(400 * 60),
 )
 def refresh_index():
-    import dataclasses
-    from collections import defaultdict
-
-    import dacite
+    import resource
 
     logger.info(f"Running scheduled index refresh at {utc_now()}")
-    config.SEARCH_DIR.mkdir(parents=True, exist_ok=True)
-
-    episodes = defaultdict(list)
-    guid_hash_to_episodes = {}
-
-    for pod_dir in config.PODCAST_METADATA_DIR.iterdir():
-        if not pod_dir.is_dir():
-            continue
-
-        for filepath in pod_dir.iterdir():
-            if filepath.name == "metadata.json":
-                continue
-
-            try:
-                with open(filepath, "r") as f:
-                    data = json.load(f)
-            except json.decoder.JSONDecodeError:
-                logger.warning(
-                    f"Removing corrupt JSON metadata file: {filepath}."
-                )
-                filepath.unlink()
-
-            ep = dacite.from_dict(data_class=podcast.EpisodeMetadata, data=data)
-            episodes[ep.podcast_title].append(ep)
-            guid_hash_to_episodes[ep.guid_hash] = ep
-
-    logger.info(f"Loaded {len(guid_hash_to_episodes)} podcast episodes.")
-
-    transcripts = {}
-    if config.TRANSCRIPTIONS_DIR.exists():
-        for file in config.TRANSCRIPTIONS_DIR.iterdir():
-            with open(file, "r") as f:
-                data = json.load(f)
-                guid_hash = file.stem.split("-")[0]
-                transcripts[guid_hash] = data
-
-    # Important: These have to be the same length and have same episode order.
-    # i-th element of indexed_episodes is the episode indexed by the i-th element
-    # of search_records
-    indexed_episodes = []
-    search_records = []
-    for key, value in transcripts.items():
-        idxd_episode = guid_hash_to_episodes.get(key)
-        if idxd_episode:
-            search_records.append(
-                search.SearchRecord(
-                    title=idxd_episode.title,
-                    text=value["text"],
-                )
-            )
-            # Prepare records for JSON serialization
-            indexed_episodes.append(dataclasses.asdict(idxd_episode))
-
-    logger.info(
-        f"Matched {len(search_records)} transcripts to episode records."
+    indexing.refresh(
+        metadata_dir=config.PODCAST_METADATA_DIR,
+        transcriptions_dir=config.TRANSCRIPTIONS_DIR,
+        search_dir=config.SEARCH_DIR,
+        similarity_backend=config.SIMILARITY_BACKEND,
+        incremental=config.INCREMENTAL_INDEX_REFRESH,
+        persist_features=config.PERSIST_TFIDF_FEATURES,
+        max_vocabulary_drift=config.MAX_VOCABULARY_DRIFT,
     )
 
-    filepath = config.SEARCH_DIR / "all.json"
-    logger.info(f"writing {filepath}")
-    with open(filepath, "w") as f:
-        json.dump(indexed_episodes, f)
-
-    logger.info(
-        "calc feature vectors for all transcripts, keeping track of similar podcasts"
-    )
-    X, v = search.calculate_tfidf_features(search_records)
-    sim_svm = search.calculate_similarity_with_svm(X)
-    filepath = config.SEARCH_DIR / "sim_tfidf_svm.json"
-    logger.info(f"writing {filepath}")
-    with open(filepath, "w") as f:
-        json.dump(sim_svm, f)
-
-    logger.info("calculate the search index to support search")
-    search_dict = search.build_search_index(search_records, v)
-    filepath = config.SEARCH_DIR / "search.json"
-    logger.info(f"writing {filepath}")
-    with open(filepath, "w") as f:
-        json.dump(search_dict, f)
-
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    logger.info(f"Index refresh finished, peak RSS {peak_rss / 1024:.1f} MiB")
 
-def split_silences(
-    path: str, min_segment_length: float = 30.0, min_silence_length: float = 1.0
-) -> Iterator[Tuple[float, float]]:
-    """Split audio file into contiguous chunks using the ffmpeg `silencedetect` filter.
-    Yields tuples (start, end) of each chunk in seconds."""
 
-    import re
-
-    import ffmpeg
-
-    silence_end_re = re.compile(
-        r" silence_end: (?P<end>[0-9]+(\.?[0-9]*)) \| silence_duration: (?P<dur>[0-9]+(\.?[0-9]*))"
-    )
-
-    metadata = ffmpeg.probe(path)
-    duration = float(metadata["format"]["duration"])
-
-    reader = (
-        ffmpeg.input(str(path))
-        .filter("silencedetect", n="-10dB", d=min_silence_length)
-        .output("pipe:", format="null")
-        .run_async(pipe_stderr=True)
-    )
+def batched(iterable: Iterable[T], n: int) -> Iterator[list[T]]:
+    it = iter(iterable)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
 
-    cur_start = 0.0
-    num_segments = 0
 
-    while True:
-        line = reader.stderr.readline().decode("utf-8")
-        if not line:
-            break
-        match = silence_end_re.search(line)
-        if match:
-            silence_end, silence_dur = match.group("end"), match.group("dur")
-            split_at = float(silence_end) - (float(silence_dur) / 2)
-
-            if (split_at - cur_start) < min_segment_length:
-                continue
-
-            yield cur_start, split_at
-            cur_start = split_at
-            num_segments += 1
-
-    # silencedetect can place the silence end *after* the end of the full audio segment.
-    # Such segments definitions are negative length and invalid.
-    if duration > cur_start and (duration - cur_start) > min_segment_length:
-        yield cur_start, duration
-        num_segments += 1
-    logger.info(f"Split {path} into {num_segments} segments")
-
-
-@stub.function(
+@stub.cls(
     image=app_image,
     network_file_systems={config.CACHE_DIR: volume},
     cpu=2,
 )
-def transcribe_segment(
-    start: float,
-    end: float,
-    audio_filepath: pathlib.Path,
-    model: config.ModelSpec,
-):
-    import tempfile
-    import time
-
-    import ffmpeg
-    import torch
-    import whisper
-
-    t0 = time.time()
-    with tempfile.NamedTemporaryFile(suffix=".mp3") as f:
-        (
-            ffmpeg.input(str(audio_filepath))
-            .filter("atrim", start=start, end=end)
-            .output(f.name)
-            .overwrite_output()
-            .run(quiet=True)
-        )
-
-        use_gpu = torch.cuda.is_available()
-        device = "cuda" if use_gpu else "cpu"
-        model = whisper.load_model(
-            model.name, device=device, download_root=config.MODEL_DIR
+class SegmentTranscriber:
+    def __enter__(self):
+        # Load the default model once when the container starts, rather than for
+        # every segment.
+        transcription.load_model(config.DEFAULT_MODEL)
+
+    @method()
+    def transcribe_segments(
+        self,
+        segments: list[Tuple[float, float]],
+        pcm_filepath: pathlib.Path,
+        model: config.ModelSpec,
+    ) -> list[dict]:
+        # The segments are decoded together, in batches of windows.
+        return transcription.transcribe_segments(
+            segments, pcm_filepath=pcm_filepath, model=model
         )
-        result = model.transcribe(f.name, language="en", fp16=use_gpu)  # type: ignore
-
-    logger.info(
-        f"Transcribed segment {start:.2f} to {end:.2f} ({end - start:.2f}s duration) in {time.time() - t0:.2f} seconds."
-    )
-
-    # Add back offsets.
-    for segment in result["segments"]:
-        segment["start"] += start
-        segment["end"] += start
-
-    return result
 
 
 @stub.function(
@@ -339,25 +225,50 @@ def transcribe_episode(
     result_path: pathlib.Path,
     model: config.ModelSpec,
 ):
-    segment_gen = split_silences(str(audio_filepath))
-
-    output_text = ""
-    output_segments = []
-    for result in transcribe_segment.starmap(
-        segment_gen, kwargs=dict(audio_filepath=audio_filepath, model=model)
-    ):
-        output_text += result["text"]
-        output_segments += result["segments"]
-
-    result = {
-        "text": output_text,
-        "segments": output_segments,
-        "language": "en",
-    }
+    # Decode the episode once, for it to be split on silences and every segment
+    # to be sliced out of.
+    config.PCM_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+    pcm_filepath = config.PCM_AUDIO_DIR / f"{audio_filepath.name}.s16le"
+    decode_stats = transcription.decode_audio(audio_filepath, pcm_filepath)
+
+    config.SEGMENT_LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    log_path = get_segment_log_path(result_path.stem)
+    stats = transcription.SegmentStats()
+    try:
+        with segment_log.SegmentLog(log_path, model.name) as log:
+            # Segments transcribed by an earlier, interrupted run are skipped.
+            segment_gen = (
+                segment
+                for segment in transcription.split_silences(pcm_filepath)
+                if segment not in log.done
+            )
+            # Each call transcribes a few segments, so containers spend less of
+            # their time starting up relative to transcribing.
+            segment_batches = (
+                (batch,)
+                for batch in batched(
+                    segment_gen, config.SEGMENTS_PER_TRANSCRIBE_CALL
+                )
+            )
+            for results in SegmentTranscriber().transcribe_segments.starmap(
+                segment_batches,
+                kwargs=dict(pcm_filepath=pcm_filepath, model=model),
+                order_outputs=False,
+            ):
+                for result in results:
+                    log.append(result["start"], result["end"], result)
+                    stats += transcription.SegmentStats(**result["stats"])
+    finally:
+        pcm_filepath.unlink(missing_ok=True)
+    logger.info(
+        f"Decoding {audio_filepath} used {decode_stats.ffmpeg_cpu:.2f}s of ffmpeg "
+        f"CPU time and read {decode_stats.bytes_read / 2**20:.1f}MiB of it. "
+        f"Transcribing its segments read {stats.audio_bytes_read / 2**20:.1f}MiB "
+        f"of PCM audio, with total segment stats {stats}."
+    )
 
     logger.info(f"Writing openai/whisper transcription to {result_path}")
-    with open(result_path, "w") as f:
-        json.dump(result, f, indent=4)
+    segment_log.compact(log_path, result_path)
 
 
 @stub.function(
@@ -408,6 +319,7 @@ def process_episode(podcast_id: str, episode_id: str):
                 result_path=transcription_path,
                 model=model,
             )
+        episode_index.mark_transcribed(podcast_id, episode.guid_hash)
     finally:
         del stub.in_progress[episode_id]
 
@@ -1,14 +1,24 @@
+import contextlib
 import dataclasses
+import hashlib
+import http.client
 import os
 import pathlib
-import urllib.request
-from typing import NamedTuple, Optional, TypedDict, Union
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+from typing import Iterator, NamedTuple, Optional, TypedDict, Union
 
 from . import config
 
 logger = config.get_logger(__name__)
 Segment = TypedDict("Segment", {"text": str, "start": float, "end": float})
 
+# Set a user agent to avoid 403 response from some podcast audio servers.
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36"
+
 
 @dataclasses.dataclass
 class EpisodeMetadata:
@@ -49,25 +59,248 @@ class PodcastMetadata:
 
 
 class DownloadResult(NamedTuple):
-    data: bytes
+    # Size of the downloaded file in bytes.
+    size: int
+    # Hex SHA-256 digest of the downloaded file.
+    sha256: str
     # Helpful to store and transmit when uploading to cloud bucket.
     content_type: str
 
 
-def download_podcast_file(url: str) -> DownloadResult:
-    req = urllib.request.Request(
-        url,
-        data=None,
-        # Set a user agent to avoid 403 response from some podcast audio servers.
-        headers={
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.47 Safari/537.36"
-        },
+class HTTPConnectionPool:
+    """
+    Keeps HTTP(S) connections open once responses on them are done with, so that
+    downloading several files from the same host, or resuming an interrupted
+    download, reuses a connection rather than opening a new one every time.
+    """
+
+    def __init__(self, timeout: float = 60.0, max_redirects: int = 10):
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.connections_opened = 0
+        self._idle: dict[tuple[str, str], list[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def _connection(
+        self, scheme: str, netloc: str
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+            self.connections_opened += 1
+        if scheme == "https":
+            return (
+                http.client.HTTPSConnection(netloc, timeout=self.timeout),
+                False,
+            )
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release(
+        self,
+        scheme: str,
+        netloc: str,
+        connection: http.client.HTTPConnection,
+        response: http.client.HTTPResponse,
+    ) -> None:
+        # A connection can only be reused once its last response has been read.
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                self._idle.setdefault((scheme, netloc), []).append(connection)
+        else:
+            connection.close()
+
+    @contextlib.contextmanager
+    def get(
+        self, url: str, headers: Optional[dict[str, str]] = None
+    ) -> Iterator[http.client.HTTPResponse]:
+        """GET `url`, following redirects, with the response open for reading."""
+        for _ in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                raise ValueError(f"Unsupported URL scheme in {url}")
+            path = parts.path or "/"
+            if parts.query:
+                path += f"?{parts.query}"
+
+            while True:
+                connection, reused = self._connection(
+                    parts.scheme, parts.netloc
+                )
+                try:
+                    connection.request(
+                        "GET",
+                        path,
+                        headers={"User-Agent": USER_AGENT, **(headers or {})},
+                    )
+                    response = connection.getresponse()
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    connection.close()
+                    # The server closed the idle connection. Try a new one.
+                    if not reused:
+                        raise
+
+            location = response.headers.get("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                response.read()
+                self._release(parts.scheme, parts.netloc, connection, response)
+                url = urllib.parse.urljoin(url, location)
+                continue
+
+            try:
+                yield response
+            except BaseException:
+                connection.close()
+                raise
+            self._release(parts.scheme, parts.netloc, connection, response)
+            return
+        raise http.client.HTTPException(f"Too many redirects from {url}")
+
+    def close(self) -> None:
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+# Shared by downloads in this container, so consecutive episodes from the same host
+# reuse a connection.
+default_pool = HTTPConnectionPool()
+
+_content_range_re = re.compile(r"bytes (?:(\d+)-\d+|\*)/(\d+|\*)")
+
+
+def _parse_content_range(
+    header: Optional[str],
+) -> tuple[Optional[int], Optional[int]]:
+    """The first byte position and complete length from a Content-Range header."""
+    match = _content_range_re.fullmatch((header or "").strip())
+    if not match:
+        return None, None
+    start, length = match.groups()
+    return (
+        int(start) if start is not None else None,
+        int(length) if length != "*" else None,
+    )
+
+
+def download_podcast_file(
+    url: str,
+    destination: pathlib.Path,
+    pool: Optional[HTTPConnectionPool] = None,
+    chunk_size: int = 2**20,
+    max_retries: int = 5,
+    retry_wait: float = 1.0,
+) -> DownloadResult:
+    """
+    Stream the file at `url` to `destination`, hashing it along the way. It's written
+    to a ".part" file alongside `destination` and renamed into place once complete, so
+    `destination` only ever holds a whole file.
+
+    When the connection drops, the download is resumed from where it left off with an
+    HTTP Range request, as is a ".part" file left behind by an earlier attempt. It
+    gives up after `max_retries` failures in a row without any progress.
+    """
+    pool = pool or default_pool
+    part_path = destination.with_name(f"{destination.name}.part")
+    sha256 = hashlib.sha256()
+    content_type = ""
+    # ETag or Last-Modified of the file, so it's not resumed if it has changed.
+    validator = None
+    length: Optional[int] = None
+    failures = 0
+    with open(part_path, "ab+") as f:
+        f.seek(0)
+        while chunk := f.read(chunk_size):
+            sha256.update(chunk)
+        offset = f.tell()
+        if offset:
+            logger.info(f"Resuming download of {url} from {offset} bytes.")
+
+        while length is None or offset < length:
+            headers = {}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                if validator:
+                    headers["If-Range"] = validator
+            progress = offset
+            try:
+                with pool.get(url, headers) as response:
+                    start, complete_length = _parse_content_range(
+                        response.headers.get("Content-Range")
+                    )
+                    if response.status == 416 and complete_length == offset:
+                        # The ".part" file was already complete.
+                        length = offset
+                        break
+                    if response.status not in (200, 206):
+                        raise urllib.error.HTTPError(
+                            url,
+                            response.status,
+                            response.reason,
+                            response.headers,
+                            None,
+                        )
+                    if response.status == 200 or start != offset:
+                        if offset:
+                            logger.info(
+                                f"Server didn't resume {url}, restarting download."
+                            )
+                        f.truncate(0)
+                        sha256 = hashlib.sha256()
+                        # Restarting only counts as progress once the download
+                        # gets further than it had.
+                        offset = 0
+                    if response.status == 206 and start != offset:
+                        # The response doesn't start where the download left off,
+                        # so download the whole file again, counting a failure.
+                        raise http.client.HTTPException(
+                            f"Range response started at byte {start}."
+                        )
+                    if response.status == 200:
+                        content_length = response.headers.get("Content-Length")
+                        length = int(content_length) if content_length else None
+                    else:
+                        length = complete_length
+                    validator = response.headers.get(
+                        "ETag", response.headers.get("Last-Modified")
+                    )
+                    content_type = response.headers.get(
+                        "Content-Type", content_type
+                    )
+
+                    while chunk := response.read(chunk_size):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        offset += len(chunk)
+                    if length is not None and offset < length:
+                        # The connection was closed before the end of the file.
+                        raise http.client.IncompleteRead(b"", length - offset)
+                    if length is None:
+                        # Without a length, the download is done once the server
+                        # has finished its response.
+                        length = offset
+            except (
+                http.client.HTTPException,
+                ConnectionError,
+                TimeoutError,
+            ) as exc:
+                failures = 0 if offset > progress else failures + 1
+                if failures > max_retries:
+                    raise
+                logger.info(
+                    f"Download of {url} interrupted after {offset} bytes "
+                    f"({exc!r}), resuming."
+                )
+                time.sleep(retry_wait * failures)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(part_path, destination)
+    return DownloadResult(
+        size=offset, sha256=sha256.hexdigest(), content_type=content_type
     )
-    with urllib.request.urlopen(req) as response:
-        return DownloadResult(
-            data=response.read(),
-            content_type=response.headers["content-type"],
-        )
 
 
 def create_podchaser_client():
@@ -277,11 +510,14 @@ def store_original_audio(
             )
             return
 
-    podcast_download_result = download_podcast_file(url=url)
-    humanized_bytes_str = sizeof_fmt(num=len(podcast_download_result.data))
-    logger.info(f"Downloaded {humanized_bytes_str} episode from URL.")
-    with open(destination, "wb") as f:
-        f.write(podcast_download_result.data)
+    podcast_download_result = download_podcast_file(
+        url=url, destination=destination
+    )
+    humanized_bytes_str = sizeof_fmt(num=podcast_download_result.size)
+    logger.info(
+        f"Downloaded {humanized_bytes_str} episode from URL, "
+        f"with SHA-256 {podcast_download_result.sha256}."
+    )
     logger.info(f"Stored audio episode at {destination}.")
 
 
@@ -1,7 +1,11 @@
+import bisect
 import dataclasses
 import json
 import pathlib
-from typing import Any
+import shutil
+import uuid
+from collections import Counter
+from typing import Callable, Iterable, Optional, Sequence, Union
 
 from . import podcast
 
@@ -12,44 +16,168 @@ class SearchRecord:
     text: str
 
 
+# Punctuation stripped from search terms. Hyphens are kept, as in `string.punctuation`
+# minus '-'.
+PUNCTUATION = "'!\"#$%&'()*+,./:;<=>?@[\\]^_`{|}~'"
+_TRANS_TABLE = {ord(c): None for c in PUNCTUATION}
+
+
+def search_terms(s: str) -> list[str]:
+    return [w for w in s.lower().translate(_TRANS_TABLE).split() if len(w) > 1]
+
+
+class _Terms(Sequence[bytes]):
+    """Sorted UTF-8 terms, stored as one blob plus offsets, for binary search."""
+
+    def __init__(self, blob, offsets) -> None:
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):  # type: ignore[override]
+        return self.blob[self.offsets[i] : self.offsets[i + 1]].tobytes()
+
+
+class InvertedIndex:
+    """
+    Term to postings index over episode transcripts, scored with BM25.
+
+    Postings of the i-th (sorted) term are `docs[postings_offsets[i]:postings_offsets[i + 1]]`,
+    with the precomputed score contributions of the term to each of those episodes in
+    `weights`. All arrays are stored as .npy files in one directory, and memory-mapped
+    when loaded, so loading doesn't depend on the size of the index.
+    """
+
+    _ARRAYS = ("terms", "term_offsets", "postings_offsets", "docs", "weights")
+
+    def __init__(
+        self,
+        *,
+        terms,
+        term_offsets,
+        postings_offsets,
+        docs,
+        weights,
+        num_docs: int,
+    ) -> None:
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.postings_offsets = postings_offsets
+        self.docs = docs
+        self.weights = weights
+        self.num_docs = num_docs
+        self._sorted_terms = _Terms(terms, term_offsets)
+
+    def lookup(self, term: str) -> Optional[int]:
+        key = term.encode()
+        i = bisect.bisect_left(self._sorted_terms, key)
+        if i < len(self._sorted_terms) and self._sorted_terms[i] == key:
+            return i
+        return None
+
+    def search(
+        self, query: str, k: Optional[int] = None
+    ) -> list[tuple[float, int]]:
+        """
+        Returns the (score, episode index) pairs of every matching episode, or of only
+        the best `k`, best scores first. Only the postings of the query's terms are
+        touched.
+        """
+        import numpy as np
+
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(search_terms(query)):
+            i = self.lookup(term)
+            if i is None:
+                continue
+            start, end = self.postings_offsets[i], self.postings_offsets[i + 1]
+            # A term's postings list each episode at most once.
+            scores[self.docs[start:end]] += self.weights[start:end]
+        (matches,) = np.nonzero(scores)
+        if len(matches) == 0:
+            return []
+        # Give a small boost to more recent episodes (low index).
+        n = self.num_docs
+        match_scores = scores[matches] + (n - matches) / n
+        if k is not None and len(matches) > k:
+            top = np.argpartition(match_scores, -k)[-k:]
+            matches, match_scores = matches[top], match_scores[top]
+        order = np.argsort(match_scores, kind="stable")[::-1]
+        return [
+            (float(score), int(doc))
+            for score, doc in zip(match_scores[order], matches[order])
+        ]
+
+    def save(self, dest: pathlib.Path) -> None:
+        """Writes the index to the `dest` directory, replacing any existing index."""
+        import numpy as np
+
+        tmp = dest.with_name(f"{dest.name}.tmp-{uuid.uuid4().hex}")
+        tmp.mkdir(parents=True)
+        for name in self._ARRAYS:
+            np.save(tmp / f"{name}.npy", getattr(self, name))
+        with open(tmp / "meta.json", "w") as f:
+            json.dump({"num_docs": self.num_docs}, f)
+
+        if dest.exists():
+            # Other containers may still have the current index memory-mapped, and
+            # deleted files on a network file system don't stay readable for them, so
+            # it's kept as the previous index until the next save replaces it. By then,
+            # `load_search_index` has seen the new index and reloaded.
+            previous = dest.with_name(f"{dest.name}.previous")
+            shutil.rmtree(previous, ignore_errors=True)
+            dest.rename(previous)
+        tmp.rename(dest)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "InvertedIndex":
+        import numpy as np
+
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in cls._ARRAYS
+        }
+        return cls(**arrays, num_docs=meta["num_docs"])
+
+
+# Loaded indexes by path, along with the modification time of the loaded version.
+_loaded_indexes: dict[pathlib.Path, tuple[int, InvertedIndex]] = {}
+
+
+def load_search_index(path: pathlib.Path) -> InvertedIndex:
+    """
+    Loads the index at `path` once per container, reloading only when
+    `refresh_index` has replaced it since.
+    """
+    mtime = (path / "meta.json").stat().st_mtime_ns
+    cached = _loaded_indexes.get(path)
+    if cached is None or cached[0] != mtime:
+        print(f"loading search index from {path}")
+        cached = _loaded_indexes[path] = (mtime, InvertedIndex.load(path))
+    return cached[1]
+
+
 def search_transcripts(
-    search_dict_path: pathlib.Path,
+    search_index_path: pathlib.Path,
     query: str,
     items: list[podcast.EpisodeMetadata],
+    k: Optional[int] = None,
 ):
-    query_parts = query.lower().strip().split()
-    print(f"loading search dictionary from {search_dict_path}")
-    with open(search_dict_path, "r") as f:
-        search_dict = json.load(f)
-
-    n = len(items)
-    scores = []
-    for i, sd in enumerate(search_dict):
-        score = sum(sd.get(q, 0) for q in query_parts)
-        if score == 0:
-            continue  # no match whatsoever, don't include
-        score += (
-            1.0 * (n - i) / n
-        )  # give a small boost to more recent episodes (low index)
-        scores.append((score, items[i]))
-    # Sort descending, best scores first.
-    scores.sort(reverse=True, key=lambda x: x[0])
-    return scores
+    index = load_search_index(search_index_path)
+    return [(score, items[i]) for score, i in index.search(query, k=k)]
 
 
-def calculate_tfidf_features(
-    records: list[SearchRecord],
-    max_features: int = 5000,
-    max_df: float = 1.0,
-    min_df: int = 3,
+def tfidf_vectorizer(
+    max_features: int = 5000, max_df: float = 1.0, min_df: int = 3
 ):
-    """
-    Compute tfidf features with scikit learn.
-    """
     import numpy as np
     from sklearn.feature_extraction.text import TfidfVectorizer
 
-    v = TfidfVectorizer(
+    return TfidfVectorizer(
         input="content",
         encoding="utf-8",
         decode_error="replace",
@@ -66,100 +194,510 @@ def calculate_tfidf_features(
         sublinear_tf=True,
         max_df=max_df,
         min_df=min_df,
+        dtype=np.float32,
+    )
+
+
+def calculate_tfidf_features(
+    records: list[SearchRecord],
+    max_features: int = 5000,
+    max_df: float = 1.0,
+    min_df: int = 3,
+):
+    """
+    Compute tfidf features with scikit learn. Features are returned as a sparse
+    (N,D) CSR matrix, as most episodes use only a small part of the vocabulary.
+    """
+    v = tfidf_vectorizer(
+        max_features=max_features, max_df=max_df, min_df=min_df
     )
     corpus = [(a.title + ". " + a.text) for a in records]
-    X = v.fit_transform(corpus)
-    X = np.asarray(X.astype(np.float32).todense())
-    print("tfidf calculated array of shape ", X.shape)
+    X = v.fit_transform(corpus).tocsr()
+    print(
+        f"tfidf calculated sparse matrix of shape {X.shape} with {X.nnz} non-zeros"
+    )
     return X, v
 
 
-def calculate_sim_dot_product(X, ntake=40):
+def save_tfidf_features(X, v, dest: pathlib.Path) -> None:
+    """
+    Persist the tfidf feature matrix, and the fitted vectorizer's vocabulary and idf
+    weights, as uncompressed .npz files in the `dest` directory.
+    """
+    import numpy as np
+    import scipy.sparse
+
+    dest.mkdir(parents=True, exist_ok=True)
+    scipy.sparse.save_npz(dest / "tfidf_features.npz", X, compressed=False)
+    np.savez(
+        dest / "tfidf_vectorizer.npz",
+        terms=v.get_feature_names_out().astype(str),
+        idf=v.idf_,
+    )
+
+
+def load_tfidf_features(src: pathlib.Path):
+    """Load the feature matrix and fitted vectorizer saved by `save_tfidf_features`."""
+    import numpy as np
+    import scipy.sparse
+
+    X = scipy.sparse.load_npz(src / "tfidf_features.npz").tocsr()
+    with np.load(src / "tfidf_vectorizer.npz") as data:
+        terms, idf = data["terms"], data["idf"]
+    v = tfidf_vectorizer()
+    v.vocabulary_ = {term: i for i, term in enumerate(terms.tolist())}
+    v.idf_ = idf
+    return X, v
+
+
+def _dense(a):
+    """Dense NumPy array of `a`, which may be a SciPy sparse matrix."""
+    import numpy as np
+
+    return a.toarray() if hasattr(a, "toarray") else np.asarray(a)
+
+
+def _top_k(scores, k: int):
+    """Indices of the `k` largest `scores` along the last axis, largest first."""
+    import numpy as np
+
+    k = min(k, scores.shape[-1])
+    top = np.argpartition(scores, -k, axis=-1)[..., -k:]
+    order = np.argsort(
+        np.take_along_axis(scores, top, -1), axis=-1, kind="stable"
+    )
+    return np.take_along_axis(top, order[..., ::-1], -1)
+
+
+def calculate_sim_dot_product(X, ntake=40, max_block_size=2**24):
     """
     Take `X` (N,D) features and for each index return closest `ntake` indices via dot product.
+
+    Similarities are computed for a block of rows at a time, so that at most around
+    `max_block_size` similarity scores are held in memory at once.
     """
-    from numpy import np
+    n = X.shape[0]
+    batch_size = max(1, max_block_size // max(n, 1))
+    IX = []
+    for start in range(0, n, batch_size):
+        S = _dense(X[start : start + batch_size] @ X.T)
+        IX.extend(_top_k(S, ntake).tolist())
+    return IX
 
-    S = np.dot(X, X.T)
-    IX = np.argsort(S, axis=1)[
-        :, : -ntake - 1 : -1
-    ]  # take last ntake sorted backwards
-    return IX.tolist()
 
+def _lsh_buckets(X, num_tables: int, num_bits: int, seed: int):
+    """
+    Hash rows of `X` with random hyperplane projections, `num_tables` times. Rows
+    whose projections fall on the same side of all `num_bits` hyperplanes of a table
+    share a bucket in that table, and are likely to have a high cosine similarity.
 
-def calculate_similarity_with_svm(X, ntake=40):
+    Yields, per table, a list of buckets, each an array of row indices.
     """
-    Take X (N,D) features and for each index return closest `ntake` indices using exemplar SVM.
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    d = X.shape[1]
+    powers = 1 << np.arange(num_bits, dtype=np.int64)
+    for _ in range(num_tables):
+        planes = rng.standard_normal((d, num_bits)).astype(np.float32)
+        codes = (_dense(X @ planes) > 0) @ powers
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        yield np.split(order, boundaries)
+
+
+def _merge_top_k(ids, scores, new_ids, new_scores, k: int):
+    """Merge two sets of per-row (id, score) neighbours, dropping duplicate ids."""
+    import numpy as np
+
+    ids = np.concatenate([ids, new_ids], axis=1)
+    scores = np.concatenate([scores, new_scores], axis=1)
+    order = np.argsort(ids, axis=1, kind="stable")
+    ids = np.take_along_axis(ids, order, 1)
+    scores = np.take_along_axis(scores, order, 1)
+    duplicate = np.zeros(ids.shape, dtype=bool)
+    duplicate[:, 1:] = (ids[:, 1:] == ids[:, :-1]) & (ids[:, 1:] >= 0)
+    scores[duplicate] = -np.inf
+    top = _top_k(scores, k)
+    return np.take_along_axis(ids, top, 1), np.take_along_axis(scores, top, 1)
+
+
+def calculate_sim_lsh(
+    X, ntake=40, num_tables=16, num_bits=None, max_block_size=2**24, seed=0
+):
     """
+    Take `X` (N,D) features and for each index return approximately the closest `ntake`
+    indices by dot product, using random projection locality sensitive hashing.
+
+    Rows are only compared against rows sharing one of their LSH buckets. Rows which
+    end up with fewer than `ntake` candidates fall back to an exact search.
+    """
+    import math
+
+    import numpy as np
+
+    n = X.shape[0]
+    ntake = min(ntake, n)
+    if num_bits is None:
+        # Aim for buckets of a few times `ntake` rows.
+        num_bits = max(1, int(math.log2(max(n / (4 * ntake), 1))))
+    best_ids = np.full((n, ntake), -1, dtype=np.int64)
+    best_scores = np.full((n, ntake), -np.inf, dtype=np.float32)
+    for buckets in _lsh_buckets(X, num_tables, num_bits, seed):
+        for members in buckets:
+            X_members = X[members]
+            block_size = max(1, max_block_size // len(members))
+            for start in range(0, len(members), block_size):
+                rows = members[start : start + block_size]
+                S = _dense(X_members[start : start + block_size] @ X_members.T)
+                top = _top_k(S, ntake)
+                best_ids[rows], best_scores[rows] = _merge_top_k(
+                    best_ids[rows],
+                    best_scores[rows],
+                    members[top],
+                    np.take_along_axis(S, top, 1).astype(np.float32),
+                    ntake,
+                )
+
+    IX = best_ids.tolist()
+    missing = np.flatnonzero((best_ids < 0).any(axis=1))
+    batch_size = max(1, max_block_size // max(n, 1))
+    for start in range(0, len(missing), batch_size):
+        rows = missing[start : start + batch_size]
+        for i, ix in zip(rows, _top_k(_dense(X[rows] @ X.T), ntake)):
+            IX[i] = ix.tolist()
+    return IX
+
+
+# Feature matrix shared with process pool workers, set by `_init_svm_worker`.
+_svm_features = None
+
+
+def _init_svm_worker(X) -> None:
+    global _svm_features
+    _svm_features = X
+
+
+def _svm_rank(args) -> list[int]:
+    """Rank `rows` by the decision function of an exemplar SVM for row `i`."""
     import numpy as np
     import sklearn.svm
-    from tqdm import tqdm
 
-    n, d = X.shape
-    ntake = min(ntake, n)  # Cannot take more than is available
-    IX = np.zeros((n, ntake), dtype=np.int64)
+    i, rows, ntake = args
+    if rows is None:
+        X = _svm_features
+        rows = np.arange(X.shape[0])
+    else:
+        X = _svm_features[rows]
+    # set all examples as negative except this one
+    y = (rows == i).astype(np.float32)
+    # train an SVM
+    clf = sklearn.svm.LinearSVC(
+        class_weight="balanced",
+        verbose=False,
+        max_iter=10000,
+        tol=1e-4,
+        C=0.1,
+    )
+    clf.fit(X, y)
+    s = clf.decision_function(X)
+    return rows[_top_k(s, ntake)].tolist()
+
+
+def calculate_similarity_with_svm(
+    X, ntake=40, candidates=None, num_workers=None
+):
+    """
+    Take X (N,D) features and for each index return closest `ntake` indices using exemplar SVM.
+
+    By default each row's SVM is trained against every other row. If `candidates` is
+    given, the i-th row's SVM is trained on, and only re-ranks, `candidates[i]`.
+    SVMs are trained in parallel over a process pool of `num_workers` processes.
+    """
+    import concurrent.futures
+
+    import numpy as np
+
+    n = X.shape[0]
+
+    def tasks():
+        for i in range(n):
+            rows = None
+            if candidates is not None:
+                rows = np.union1d(candidates[i], [i])
+            yield i, rows, ntake
+
     print(f"training {n} svms for each paper...")
-    for i in tqdm(range(n)):
-        # set all examples as negative except this one
-        y = np.zeros(X.shape[0], dtype=np.float32)
-        y[i] = 1
-        # train an SVM
-        clf = sklearn.svm.LinearSVC(
-            class_weight="balanced",
-            verbose=False,
-            max_iter=10000,
-            tol=1e-4,
-            C=0.1,
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=_init_svm_worker,
+        initargs=(X,),
+    ) as pool:
+        return list(pool.map(_svm_rank, tasks(), chunksize=16))
+
+
+def calculate_sim_lsh_svm(X, ntake=40, num_candidates=200, num_workers=None):
+    """
+    Exemplar SVM similarity, with each row's SVM trained on, and re-ranking, only the
+    `num_candidates` approximate nearest neighbours found by LSH.
+    """
+    candidates = calculate_sim_lsh(X, ntake=num_candidates)
+    return calculate_similarity_with_svm(
+        X, ntake=ntake, candidates=candidates, num_workers=num_workers
+    )
+
+
+# Backends for finding similar episodes, by name. Each takes (N,D) features and
+# returns the indices of each row's `ntake` most similar rows, most similar first.
+SIMILARITY_BACKENDS: dict[str, Callable[..., list[list[int]]]] = {
+    "dot": calculate_sim_dot_product,
+    "lsh": calculate_sim_lsh,
+    "svm": calculate_similarity_with_svm,
+    "lsh-svm": calculate_sim_lsh_svm,
+}
+
+
+def calculate_similarity(X, backend: str, ntake=40) -> list[list[int]]:
+    try:
+        calculate = SIMILARITY_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            f"Unknown similarity backend '{backend}'. Choose from {sorted(SIMILARITY_BACKENDS)}."
         )
-        clf.fit(X, y)
-        s = clf.decision_function(X)
-        ix = np.argsort(s)[
-            : -ntake - 1 : -1
-        ]  # take last ntake sorted backwards
-        IX[i] = ix
-    return IX.tolist()
-
-
-def build_search_index(records: list[SearchRecord], v):
-    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
-
-    # construct a reverse index for supporting search
-    vocab = v.vocabulary_
-    idf = v.idf_
-    punc = "'!\"#$%&'()*+,./:;<=>?@[\\]^_`{|}~'"  # removed hyphen from string.punctuation
-    trans_table = {ord(c): None for c in punc}
-
-    def makedict(s, forceidf=None):
-        words = set(s.lower().translate(trans_table).strip().split())
-        words = set(
-            w for w in words if len(w) > 1 and (w not in ENGLISH_STOP_WORDS)
+    return calculate(X, ntake=ntake)
+
+
+def update_similarity(
+    X, IX: list[list[int]], docs, ntake=40, max_block_size=2**24
+):
+    """
+    Update the closest `ntake` indices of `IX` after rows `docs` of `X` were added or
+    changed, by dot product.
+
+    The added rows are searched exactly. Of the existing rows, only those which the
+    added rows found among their own closest are re-ranked, as they're the ones whose
+    closest rows are likely to now include the added rows.
+    """
+    import numpy as np
+
+    n = X.shape[0]
+    ntake = min(ntake, n)
+    IX = IX + [[] for _ in range(n - len(IX))]
+    docs = np.unique(np.asarray(docs, dtype=np.int64))
+    batch_size = max(1, max_block_size // max(n, 1))
+    neighbours = set()
+    for start in range(0, len(docs), batch_size):
+        rows = docs[start : start + batch_size]
+        for i, ix in zip(rows, _top_k(_dense(X[rows] @ X.T), ntake).tolist()):
+            IX[i] = ix
+            neighbours.update(ix)
+    neighbours.difference_update(docs.tolist())
+
+    X_docs = X[docs]
+    rows = np.array(sorted(neighbours), dtype=np.int64)
+    batch_size = max(1, max_block_size // max(len(docs) + ntake, 1))
+    for start in range(0, len(rows), batch_size):
+        block = rows[start : start + batch_size]
+        # Pad neighbour lists from when there were fewer than `ntake` rows.
+        ids = np.full((len(block), ntake), -1, dtype=np.int64)
+        for j, i in enumerate(block):
+            ids[j, : len(IX[i])] = IX[i]
+        # Row-wise dot products of each row with its current closest rows.
+        pairs = X[np.repeat(block, ntake)].multiply(
+            X[np.maximum(ids, 0).ravel()]
+        )
+        scores = np.asarray(pairs.sum(axis=1)).reshape(ids.shape)
+        scores = np.where(ids >= 0, scores, -np.inf).astype(np.float32)
+        ids, _ = _merge_top_k(
+            ids,
+            scores,
+            np.broadcast_to(docs, (len(block), len(docs))),
+            _dense(X[block] @ X_docs.T).astype(np.float32),
+            ntake,
+        )
+        for i, ix in zip(block, ids.tolist()):
+            IX[i] = [j for j in ix if j >= 0]
+    return IX
+
+
+def upsert_rows(M, rows, new_rows, shape):
+    """
+    Returns sparse matrix `M`, resized to `shape`, with its `rows` replaced by the rows
+    of sparse matrix `new_rows`.
+    """
+    import numpy as np
+    import scipy.sparse
+
+    M = scipy.sparse.csr_matrix(M, copy=True)
+    M.resize(shape)
+    keep = np.ones(shape[0], dtype=M.dtype)
+    keep[rows] = 0
+    scatter = scipy.sparse.csr_matrix(
+        (np.ones(len(rows), dtype=M.dtype), (rows, np.arange(len(rows)))),
+        shape=(shape[0], len(rows)),
+    )
+    new_rows = scipy.sparse.csr_matrix(new_rows, dtype=M.dtype)
+    new_rows.resize((len(rows), shape[1]))
+    return (scipy.sparse.diags(keep) @ M + scatter @ new_rows).tocsr()
+
+
+class SearchTermCounts:
+    """
+    Per-episode counts of search terms in transcripts, and which terms appear in
+    episode titles, as sparse (episodes, terms) matrices. The search index is
+    computed from these, so that they can be updated for just the new or changed
+    episodes without tokenizing every transcript again.
+    """
+
+    def __init__(self, terms: list[str], counts, titles) -> None:
+        self.terms = terms
+        self.counts = counts
+        self.titles = titles
+
+    @classmethod
+    def empty(cls) -> "SearchTermCounts":
+        import numpy as np
+        import scipy.sparse
+
+        return cls(
+            terms=[],
+            counts=scipy.sparse.csr_matrix((0, 0), dtype=np.float32),
+            titles=scipy.sparse.csr_matrix((0, 0), dtype=np.float32),
+        )
+
+    @property
+    def num_docs(self) -> int:
+        return self.counts.shape[0]
+
+    def upsert(
+        self, records: list[SearchRecord], docs: Iterable[int]
+    ) -> "SearchTermCounts":
+        """Returns counts with the i-th record counted as episode `docs[i]`."""
+        import numpy as np
+        import scipy.sparse
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+        terms = list(self.terms)
+        term_ids = {term: i for i, term in enumerate(terms)}
+
+        def count(texts: list[str], unique: bool):
+            data, indices, indptr = [], [], [0]
+            for text in texts:
+                words = (
+                    w for w in search_terms(text) if w not in ENGLISH_STOP_WORDS
+                )
+                for term, c in Counter(words).items():
+                    i = term_ids.get(term)
+                    if i is None:
+                        i = term_ids[term] = len(terms)
+                        terms.append(term)
+                    indices.append(i)
+                    data.append(1 if unique else c)
+                indptr.append(len(indices))
+            return scipy.sparse.csr_matrix(
+                (
+                    np.array(data, dtype=np.float32),
+                    np.array(indices, dtype=np.int64),
+                    np.array(indptr, dtype=np.int64),
+                ),
+                shape=(len(texts), len(terms)),
+            )
+
+        new_counts = count([r.text for r in records], unique=False)
+        new_titles = count([r.title for r in records], unique=True)
+        rows = np.asarray(list(docs), dtype=np.int64)
+        shape = (max(self.num_docs, int(rows.max(initial=-1)) + 1), len(terms))
+        return SearchTermCounts(
+            terms=terms,
+            counts=upsert_rows(self.counts, rows, new_counts, shape),
+            titles=upsert_rows(self.titles, rows, new_titles, shape),
+        )
+
+    def save(self, path: pathlib.Path) -> None:
+        import numpy as np
+
+        np.savez(
+            path,
+            terms=np.array(self.terms, dtype=str),
+            **{
+                f"{name}_{attr}": getattr(getattr(self, name), attr)
+                for name in ("counts", "titles")
+                for attr in ("data", "indices", "indptr")
+            },
+            num_docs=self.num_docs,
+        )
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "SearchTermCounts":
+        import numpy as np
+        import scipy.sparse
+
+        with np.load(path) as data:
+            terms = data["terms"].tolist()
+            shape = (int(data["num_docs"]), len(terms))
+            matrices = {
+                name: scipy.sparse.csr_matrix(
+                    (
+                        data[f"{name}_data"],
+                        data[f"{name}_indices"],
+                        data[f"{name}_indptr"],
+                    ),
+                    shape=shape,
+                )
+                for name in ("counts", "titles")
+            }
+        return cls(terms=terms, **matrices)
+
+
+def build_search_index(
+    records_or_counts: Union[list[SearchRecord], SearchTermCounts],
+    k1: float = 1.2,
+    b: float = 0.75,
+    title_weight: float = 10.0,
+) -> InvertedIndex:
+    """
+    Build a BM25 inverted index of the records' transcripts. Terms appearing in a
+    record's title get a further fixed `title_weight` boost.
+    """
+    import numpy as np
+
+    if isinstance(records_or_counts, SearchTermCounts):
+        term_counts = records_or_counts
+    else:
+        records = records_or_counts
+        term_counts = SearchTermCounts.empty().upsert(
+            records, range(len(records))
         )
-        idfd = {}
-        for w in words:
-            if forceidf is None:
-                if w in vocab:
-                    idfval = idf[vocab[w]]  # we have a computed idf for this
-                else:
-                    idfval = (
-                        1.0  # some word we don't know; assume idf 1.0 (low)
-                    )
-            else:
-                idfval = forceidf
-            idfd[w] = idfval
-        return idfd
-
-    def merge_dicts(dict_list: list[dict]):
-        m: dict[str, Any] = {}
-        for d in dict_list:
-            for key, val in d.items():
-                m[key] = m.get(key, 0) + val
-        return m
-
-    search_dict = []
-    for p in records:
-        dict_title = makedict(p.title, forceidf=10)
-        dict_summary = makedict(p.text)
-        qdict = merge_dicts([dict_title, dict_summary])
-        search_dict.append(qdict)
-
-    return search_dict
+
+    counts = term_counts.counts.tocsr()
+    n = term_counts.num_docs
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    lengths = np.asarray(counts.sum(axis=1)).ravel()
+    avg_length = lengths.mean() if n and lengths.mean() > 0 else 1.0
+    # BM25 weights, computed for each non-zero entry of the counts matrix.
+    docs = np.repeat(np.arange(n), np.diff(counts.indptr))
+    tfs = counts.data
+    norm = k1 * (1 - b + b * lengths[docs] / avg_length)
+    bm25 = counts.copy()
+    bm25.data = (idf[counts.indices] * tfs * (k1 + 1) / (tfs + norm)).astype(
+        np.float32
+    )
+    weights = bm25 + title_weight * term_counts.titles
+
+    # Renumber terms in sorted order, so that they can be binary searched. Columns
+    # of the weights matrix, in CSC format, are then each term's postings.
+    order = np.argsort(np.array(term_counts.terms, dtype=str), kind="stable")
+    postings = weights.tocsc()[:, order]
+    postings.sort_indices()
+    encoded = [term_counts.terms[i].encode() for i in order]
+    return InvertedIndex(
+        terms=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        term_offsets=np.r_[0, np.cumsum([len(t) for t in encoded])].astype(
+            np.int64
+        ),
+        postings_offsets=postings.indptr.astype(np.int64),
+        docs=postings.indices.astype(np.uint32),
+        weights=postings.data.astype(np.float32),
+        num_docs=n,
+    )
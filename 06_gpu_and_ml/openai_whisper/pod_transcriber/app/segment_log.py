@@ -0,0 +1,120 @@
+"""
+Append-only logs of an episode's transcribed segments.
+
+`transcribe_episode` appends each segment's transcription to the episode's log as
+soon as it's done, so progress survives a crash, reruns skip the segments already
+transcribed, and the API can serve partial transcripts. Once every segment is done,
+the log is compacted into the episode's transcript.
+
+Logs are JSON lines: a header line with the model used, then a line per segment.
+"""
+import json
+import os
+import pathlib
+from typing import BinaryIO, Optional
+
+from . import config
+
+logger = config.get_logger(__name__)
+
+
+def _read_lines(path: pathlib.Path) -> tuple[list[dict], int]:
+    """
+    The parsed lines of the log at `path`, and the byte length of them. A line torn
+    by a crash while it was being written is left out.
+    """
+    try:
+        contents = path.read_bytes()
+    except FileNotFoundError:
+        return [], 0
+    complete_length = contents.rfind(b"\n") + 1
+    lines = [
+        json.loads(line) for line in contents[:complete_length].splitlines()
+    ]
+    return lines, complete_length
+
+
+class SegmentLog:
+    def __init__(self, path: pathlib.Path, model_name: str):
+        """
+        Opens the log at `path` for appending, starting a new one if there's none, or
+        if the existing one was written with a different model.
+        """
+        self.path = path
+        self._f: BinaryIO
+        lines, complete_length = _read_lines(path)
+        if lines and lines[0].get("model") == model_name:
+            self._f = open(path, "r+b")
+            self._f.truncate(complete_length)
+            self._f.seek(complete_length)
+            segments = lines[1:]
+        else:
+            self._f = open(path, "wb")
+            self._append({"model": model_name})
+            segments = []
+        # The (start, end) of segments already transcribed.
+        self.done: set[tuple[float, float]] = {
+            (segment["start"], segment["end"]) for segment in segments
+        }
+        if self.done:
+            logger.info(
+                f"Resuming from {len(self.done)} segments transcribed in {path}."
+            )
+
+    def _append(self, line: dict) -> None:
+        self._f.write(json.dumps(line).encode() + b"\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def append(self, start: float, end: float, result: dict) -> None:
+        """Checkpoints the transcription `result` of the `start` to `end` segment."""
+        self._append(
+            {
+                "start": start,
+                "end": end,
+                "text": result["text"],
+                "segments": result["segments"],
+            }
+        )
+        self.done.add((start, end))
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self) -> "SegmentLog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_transcript(path: pathlib.Path) -> Optional[dict]:
+    """
+    The transcript of the segments logged at `path` so far, in the same format as a
+    complete transcript, or None if there's no log.
+    """
+    lines, _ = _read_lines(path)
+    if not lines:
+        return None
+    segments = sorted(lines[1:], key=lambda segment: segment["start"])
+    return {
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": [s for segment in segments for s in segment["segments"]],
+        "language": "en",
+    }
+
+
+def compact(path: pathlib.Path, result_path: pathlib.Path) -> dict:
+    """
+    Writes the transcript of the segments logged at `path` to `result_path`, then
+    removes the log.
+    """
+    result = read_transcript(path)
+    if result is None:
+        raise FileNotFoundError(path)
+    tmp_path = result_path.with_name(f"{result_path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(result, f, indent=4)
+    os.replace(tmp_path, result_path)
+    path.unlink()
+    return result
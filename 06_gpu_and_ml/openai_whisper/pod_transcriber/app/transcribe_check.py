@@ -1,23 +1,23 @@
 import pathlib
+from typing import Iterator, Tuple
 
 from . import config, podcast
 from .main import (
     app_image,
-    split_silences,
     stub,
     transcribe_episode,
-    transcribe_segment,
     volume,
 )
+from .transcription import decode_audio, split_silences, transcribe_segment
 
 logger = config.get_logger(__name__)
 
 
 def _transcribe_serially(
-    audio_path: pathlib.Path, offset: int = 0
+    pcm_path: pathlib.Path, offset: int = 0
 ) -> list[tuple[float, float]]:
     model = config.DEFAULT_MODEL
-    segment_gen = split_silences(str(audio_path))
+    segment_gen = split_silences(pcm_path)
     failed_segments = []
     for i, (start, end) in enumerate(segment_gen):
         if i < offset:
@@ -25,7 +25,7 @@ def _transcribe_serially(
         logger.info(f"Attempting transcription of ({start}, {end})...")
         try:
             transcribe_segment(
-                start=start, end=end, audio_filepath=audio_path, model=model
+                start=start, end=end, pcm_filepath=pcm_path, model=model
             )
         except Exception as exc:
             logger.info(f"Transcription failed for ({start}, {end}).")
@@ -35,6 +35,142 @@ def _transcribe_serially(
     return failed_segments
 
 
+def split_silences_ffmpeg(
+    path: str, min_segment_length: float = 30.0, min_silence_length: float = 1.0
+) -> Iterator[Tuple[float, float]]:
+    """Split audio file into contiguous chunks using the ffmpeg `silencedetect` filter.
+    Yields tuples (start, end) of each chunk in seconds.
+
+    This is how episodes were split before `split_silences`, kept to check it against.
+    """
+
+    import re
+
+    import ffmpeg
+
+    silence_end_re = re.compile(
+        r" silence_end: (?P<end>[0-9]+(\.?[0-9]*)) \| silence_duration: (?P<dur>[0-9]+(\.?[0-9]*))"
+    )
+
+    metadata = ffmpeg.probe(path)
+    duration = float(metadata["format"]["duration"])
+
+    reader = (
+        ffmpeg.input(str(path))
+        .filter("silencedetect", n="-10dB", d=min_silence_length)
+        .output("pipe:", format="null")
+        .run_async(pipe_stderr=True)
+    )
+
+    cur_start = 0.0
+    num_segments = 0
+
+    while True:
+        line = reader.stderr.readline().decode("utf-8")
+        if not line:
+            break
+        match = silence_end_re.search(line)
+        if match:
+            silence_end, silence_dur = match.group("end"), match.group("dur")
+            split_at = float(silence_end) - (float(silence_dur) / 2)
+
+            if (split_at - cur_start) < min_segment_length:
+                continue
+
+            yield cur_start, split_at
+            cur_start = split_at
+            num_segments += 1
+
+    # silencedetect can place the silence end *after* the end of the full audio segment.
+    # Such segments definitions are negative length and invalid.
+    if duration > cur_start and (duration - cur_start) > min_segment_length:
+        yield cur_start, duration
+        num_segments += 1
+    logger.info(f"Split {path} into {num_segments} segments")
+
+
+@stub.function(image=app_image, timeout=600)
+def test_split_silences_matches_ffmpeg():
+    """
+    `split_silences` replaced splitting episodes with the ffmpeg `silencedetect`
+    filter. This checks that it splits synthetic audio at the same points, give or
+    take a frame, and compares their speed.
+    """
+    import tempfile
+    import time
+    import wave
+
+    from .benchmark import synthetic_speech
+
+    pcm, _ = synthetic_speech(seconds=30 * 60)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wav_path = pathlib.Path(tmp_dir, "episode.wav")
+        with wave.open(str(wav_path), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16_000)
+            f.writeframes(pcm.tobytes())
+        pcm_path = pathlib.Path(tmp_dir, "episode.s16le")
+        pcm.tofile(pcm_path)
+
+        t0 = time.perf_counter()
+        expected = list(split_silences_ffmpeg(str(wav_path)))
+        ffmpeg_duration = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        segments = list(split_silences(pcm_path))
+        duration = time.perf_counter() - t0
+
+    logger.info(
+        f"Split 30 minutes of audio in {duration:.3f}s, "
+        f"against {ffmpeg_duration:.3f}s with ffmpeg."
+    )
+    assert len(segments) == len(expected), (segments, expected)
+    for segment, expected_segment in zip(segments, expected):
+        assert all(
+            abs(t - expected_t) < 0.05
+            for t, expected_t in zip(segment, expected_segment)
+        ), (segment, expected_segment)
+
+
+@stub.function(
+    image=app_image,
+    network_file_systems={config.CACHE_DIR: volume},
+    timeout=600,
+)
+def test_decode_batch_matches_transcribe():
+    """
+    `decode_batch` decodes the windows of several segments at once. With the same
+    greedy decoding, it should transcribe each of them as `model.transcribe` does.
+    """
+    from .benchmark import synthetic_audio
+    from .transcription import decode, decode_batch, load_model
+
+    whisper_model, _ = load_model(config.DEFAULT_MODEL)
+    audios = [
+        synthetic_audio(seconds, seed=i)
+        for i, seconds in enumerate([12.0, 45.0, 31.0, 70.0])
+    ]
+    expected = [
+        decode(
+            whisper_model,
+            audio,
+            temperature=0.0,
+            condition_on_previous_text=False,
+        )
+        for audio in audios
+    ]
+    results = decode_batch(whisper_model, audios, batch_size=3)
+    for result, expected_result in zip(results, expected):
+        assert result["text"] == expected_result["text"], (
+            result["text"],
+            expected_result["text"],
+        )
+        assert [(s["start"], s["end"]) for s in result["segments"]] == [
+            (s["start"], s["end"]) for s in expected_result["segments"]
+        ]
+
+
 @stub.function(
     image=app_image,
     network_file_systems={config.CACHE_DIR: volume},
@@ -94,7 +230,9 @@ def test_transcribe_handles_dangling_segment():
     else:
         return  # Transcription worked fine.
 
-    failed_segments = _transcribe_serially(audio_path, offset=107)
+    pcm_path = audio_path.with_suffix(".s16le")
+    decode_audio(audio_path, pcm_path)
+    failed_segments = _transcribe_serially(pcm_path, offset=107)
     # Checking the 1st is probably sufficient to discover bug.
     problem_segment = failed_segments[0]
     start = problem_segment[0]
@@ -102,7 +240,7 @@ def test_transcribe_handles_dangling_segment():
     logger.info(f"Problem segment time range is ({start}, {end})")
     try:
         transcribe_segment(
-            start=start, end=end, audio_filepath=audio_path, model=model
+            start=start, end=end, pcm_filepath=pcm_path, model=model
         )
     except Exception:
         logger.info(
@@ -126,4 +264,6 @@ def test_transcribe_handles_dangling_segment():
 
 if __name__ == "__main__":
     with stub.run():
+        test_split_silences_matches_ffmpeg.remote()
+        test_decode_batch_matches_transcribe.remote()
         test_transcribe_handles_dangling_segment()
@@ -0,0 +1,507 @@
+"""
+Transcription of podcast audio segments with Whisper.
+
+An episode's audio is decoded once, to 16kHz mono 16-bit PCM on the network file
+system, and each segment is transcribed from a slice of it, memory-mapped, rather
+than from its own ffmpeg decode of the episode.
+
+Loaded Whisper models are cached for the lifetime of the container, so that a
+container transcribing many segments only deserializes the model weights once.
+"""
+import dataclasses
+import pathlib
+import resource
+import time
+from typing import Any, Iterator, Optional
+
+from . import config
+
+logger = config.get_logger(__name__)
+
+# Loaded models by (model name, device).
+_models: dict[tuple[str, str], Any] = {}
+
+
+# Whisper's expected audio sample rate, `whisper.audio.SAMPLE_RATE`.
+SAMPLE_RATE = 16_000
+# Bytes per sample of decoded PCM audio.
+PCM_SAMPLE_WIDTH = 2
+
+
+@dataclasses.dataclass
+class SegmentStats:
+    # Seconds spent loading the model, zero if it was already loaded.
+    model_load: float = 0.0
+    # Seconds spent reading the segment's audio out of the episode's.
+    load_audio: float = 0.0
+    # Seconds spent decoding the segment's audio to text.
+    decode: float = 0.0
+    # Bytes of the episode's audio read to get the segment's.
+    audio_bytes_read: int = 0
+
+    def __add__(self, other: "SegmentStats") -> "SegmentStats":
+        return SegmentStats(
+            model_load=self.model_load + other.model_load,
+            load_audio=self.load_audio + other.load_audio,
+            decode=self.decode + other.decode,
+            audio_bytes_read=self.audio_bytes_read + other.audio_bytes_read,
+        )
+
+
+@dataclasses.dataclass
+class AudioDecodeStats:
+    # Wall-clock seconds spent decoding.
+    seconds: float
+    # CPU seconds used by ffmpeg.
+    ffmpeg_cpu: float
+    # Bytes of the original audio file read.
+    bytes_read: int
+    # Bytes of PCM audio written.
+    bytes_written: int
+
+
+def default_device() -> str:
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_model(
+    model: config.ModelSpec, device: Optional[str] = None
+) -> tuple[Any, float]:
+    """
+    Returns the Whisper model, loading it if this container hasn't yet, along with
+    the seconds spent loading it.
+    """
+    import whisper
+
+    device = device or default_device()
+    key = (model.name, device)
+    if key in _models:
+        return _models[key], 0.0
+    t0 = time.perf_counter()
+    _models[key] = whisper.load_model(
+        model.name, device=device, download_root=config.MODEL_DIR
+    )
+    elapsed = time.perf_counter() - t0
+    logger.info(f"Loaded {model.name} model on {device} in {elapsed:.2f}s.")
+    return _models[key], elapsed
+
+
+def children_cpu_seconds() -> float:
+    """CPU seconds used by this process's finished child processes, such as ffmpeg."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def decode_audio(
+    audio_filepath: pathlib.Path, dest: pathlib.Path
+) -> AudioDecodeStats:
+    """
+    Decode an episode's audio to raw 16kHz mono 16-bit PCM at `dest`, for segments to
+    be read from with `load_audio_segment`. It's written to a temporary file first,
+    so `dest` only ever holds the complete audio.
+    """
+    import ffmpeg
+
+    t0, cpu0 = time.perf_counter(), children_cpu_seconds()
+    tmp_dest = dest.with_name(f"{dest.name}.tmp")
+    (
+        ffmpeg.input(str(audio_filepath))
+        .output(
+            str(tmp_dest),
+            format="s16le",
+            acodec="pcm_s16le",
+            ac=1,
+            ar=SAMPLE_RATE,
+        )
+        .overwrite_output()
+        .run(quiet=True)
+    )
+    tmp_dest.rename(dest)
+    stats = AudioDecodeStats(
+        seconds=time.perf_counter() - t0,
+        ffmpeg_cpu=children_cpu_seconds() - cpu0,
+        bytes_read=audio_filepath.stat().st_size,
+        bytes_written=dest.stat().st_size,
+    )
+    logger.info(f"Decoded {audio_filepath} to {dest}: {stats}.")
+    return stats
+
+
+def load_audio_segment(pcm_filepath: pathlib.Path, start: float, end: float):
+    """
+    The `start` to `end` seconds of decoded PCM audio, as a float32 array in the
+    format Whisper expects. Only the segment's pages of the file are read.
+    """
+    import numpy as np
+
+    pcm = np.memmap(pcm_filepath, dtype=np.int16, mode="r")
+    samples = pcm[int(start * SAMPLE_RATE) : int(end * SAMPLE_RATE)]
+    return samples.astype(np.float32) / 32768.0
+
+
+def silences(
+    pcm_filepath: pathlib.Path,
+    threshold_db: float,
+    hysteresis_db: float,
+    frame_length: float,
+    chunk_length: float,
+) -> Iterator[tuple[float, float]]:
+    """
+    Yields the (start, end) in seconds of each silence in decoded PCM audio.
+
+    Frames of `frame_length` seconds become silent when their peak level drops below
+    `threshold_db` dBFS, as samples are compared against the noise tolerance of
+    ffmpeg's `silencedetect` filter, and stay silent until it rises back above
+    `threshold_db + hysteresis_db`. The audio is read `chunk_length` seconds at a
+    time.
+    """
+    import numpy as np
+
+    pcm = np.memmap(pcm_filepath, dtype=np.int16, mode="r")
+    frame_size = max(1, int(frame_length * SAMPLE_RATE))
+    chunk_size = frame_size * max(1, int(chunk_length / frame_length))
+    # Absolute sample values, in int16 units, of the thresholds.
+    silent_below = 10 ** (threshold_db / 20) * 32768
+    loud_above = 10 ** ((threshold_db + hysteresis_db) / 20) * 32768
+
+    silent = False
+    silence_start = 0
+    for chunk_start in range(0, len(pcm), chunk_size):
+        chunk = np.asarray(
+            pcm[chunk_start : chunk_start + chunk_size], dtype=np.float32
+        )
+        frame_starts = np.arange(0, len(chunk), frame_size)
+        peaks = np.maximum.reduceat(np.abs(chunk), frame_starts)
+
+        # A frame between the thresholds takes the state of the last frame that
+        # wasn't, or the previous chunk's last frame if none was.
+        decided = (peaks < silent_below) | (peaks > loud_above)
+        last_decided = np.where(decided, np.arange(len(decided)), -1)
+        np.maximum.accumulate(last_decided, out=last_decided)
+        states = np.where(
+            last_decided >= 0, peaks[last_decided] < silent_below, silent
+        )
+
+        changes = np.flatnonzero(np.diff(states, prepend=silent))
+        for frame in changes:
+            sample = chunk_start + int(frame_starts[frame])
+            if states[frame]:
+                silence_start = sample
+            else:
+                yield silence_start / SAMPLE_RATE, sample / SAMPLE_RATE
+        silent = bool(states[-1])
+    if silent:
+        yield silence_start / SAMPLE_RATE, len(pcm) / SAMPLE_RATE
+
+
+def split_silences(
+    pcm_filepath: pathlib.Path,
+    min_segment_length: float = 30.0,
+    min_silence_length: float = 1.0,
+    # The `silencedetect` noise tolerance episodes were previously split with.
+    threshold_db: float = -10.0,
+    hysteresis_db: float = 0.0,
+    frame_length: float = 0.02,
+    chunk_length: float = 60.0,
+) -> Iterator[tuple[float, float]]:
+    """
+    Split audio decoded by `decode_audio` into contiguous segments, in the middle of
+    silences at least `min_silence_length` long, once segments are at least
+    `min_segment_length` long. Yields the (start, end) of each segment in seconds.
+
+    See `silences` for the other parameters. Memory use is bounded by `chunk_length`,
+    however long the audio is.
+    """
+    duration = pcm_filepath.stat().st_size / PCM_SAMPLE_WIDTH / SAMPLE_RATE
+    cur_start = 0.0
+    num_segments = 0
+    for silence_start, silence_end in silences(
+        pcm_filepath,
+        threshold_db=threshold_db,
+        hysteresis_db=hysteresis_db,
+        frame_length=frame_length,
+        chunk_length=chunk_length,
+    ):
+        if silence_end - silence_start < min_silence_length:
+            continue
+        split_at = (silence_start + silence_end) / 2
+        if (split_at - cur_start) < min_segment_length:
+            continue
+
+        yield cur_start, split_at
+        cur_start = split_at
+        num_segments += 1
+
+    if (duration - cur_start) > min_segment_length:
+        yield cur_start, duration
+        num_segments += 1
+    logger.info(f"Split {pcm_filepath} into {num_segments} segments")
+
+
+def decode(whisper_model, audio, **decode_options) -> dict:
+    """Transcribe `audio`, either a path or a 16kHz float32 array, to English text."""
+    return whisper_model.transcribe(
+        audio,
+        language="en",
+        fp16=whisper_model.device.type == "cuda",
+        **decode_options,
+    )
+
+
+def _window_segments(
+    tokens: list[int], tokenizer, time_offset: float, window_size: int
+) -> tuple[list[dict], int]:
+    """
+    Split the tokens decoded from a window of audio starting at `time_offset` seconds
+    into segments at pairs of timestamp tokens, as `model.transcribe` does. Returns
+    the segments and how many mel frames to advance to the next window: to the last
+    complete segment's end, or past the window if the last segment is complete.
+    """
+    from whisper.audio import HOP_LENGTH, N_FRAMES
+
+    # Mel frames per output token, and seconds per timestamp token.
+    input_stride = 2
+    time_precision = input_stride * HOP_LENGTH / SAMPLE_RATE
+    is_timestamp = [token >= tokenizer.timestamp_begin for token in tokens]
+    single_timestamp_ending = is_timestamp[-2:] == [False, True]
+
+    def segment(start: float, end: float, tokens: list[int]) -> dict:
+        return {
+            "start": start,
+            "end": end,
+            "text": tokenizer.decode(
+                [token for token in tokens if token < tokenizer.eot]
+            ),
+            "tokens": tokens,
+        }
+
+    slices = [
+        i
+        for i in range(1, len(tokens))
+        if is_timestamp[i - 1] and is_timestamp[i]
+    ]
+    if not slices:
+        duration = window_size * HOP_LENGTH / SAMPLE_RATE
+        timestamps = [t for t, ts in zip(tokens, is_timestamp) if ts]
+        if timestamps and timestamps[-1] != tokenizer.timestamp_begin:
+            # No complete segment, but it has a timestamp; use the last one.
+            duration = (
+                timestamps[-1] - tokenizer.timestamp_begin
+            ) * time_precision
+        return [
+            segment(time_offset, time_offset + duration, tokens)
+        ], window_size
+
+    if single_timestamp_ending:
+        slices.append(len(tokens))
+    segments = []
+    last_slice = 0
+    for current_slice in slices:
+        sliced = tokens[last_slice:current_slice]
+        segments.append(
+            segment(
+                time_offset
+                + (sliced[0] - tokenizer.timestamp_begin) * time_precision,
+                time_offset
+                + (sliced[-1] - tokenizer.timestamp_begin) * time_precision,
+                sliced,
+            )
+        )
+        last_slice = current_slice
+    if single_timestamp_ending:
+        # No speech after the last timestamp.
+        return segments, window_size
+    # Otherwise, seek to the start of the unfinished last segment, if that moves on.
+    last_timestamp = tokens[last_slice - 1] - tokenizer.timestamp_begin
+    return segments, min(last_timestamp * input_stride, N_FRAMES) or window_size
+
+
+def decode_batch(
+    whisper_model,
+    audios: list,
+    batch_size: int = config.TRANSCRIBE_BATCH_SIZE,
+    no_speech_threshold: float = 0.6,
+    logprob_threshold: float = -1.0,
+    **decode_options,
+) -> list[dict]:
+    """
+    Transcribe several 16kHz float32 arrays to English text, decoding them in batches.
+
+    Like `model.transcribe`, each audio is transcribed a 30 second window at a time,
+    each window starting where the last one's complete segments ended. But each step
+    pads the current window of up to `batch_size` audios into one batch of log-mel
+    spectrograms, which is encoded and greedily decoded at once. Windows aren't
+    conditioned on the text before them, and there's no temperature fallback, since
+    both would need per-window decoding options. Windows that are probably silent, by
+    `no_speech_threshold` and `logprob_threshold`, are skipped as `model.transcribe`
+    does. Other keyword arguments are passed on to `whisper.DecodingOptions`.
+
+    Returns a result per audio, in the format of `model.transcribe`'s.
+    """
+    import torch
+    import whisper
+    from whisper.audio import HOP_LENGTH, N_FRAMES, N_SAMPLES
+    from whisper.tokenizer import get_tokenizer
+
+    fp16 = whisper_model.device.type == "cuda"
+    dtype = torch.float16 if fp16 else torch.float32
+    options = whisper.DecodingOptions(
+        language="en", temperature=0.0, fp16=fp16, **decode_options
+    )
+    tokenizer = get_tokenizer(
+        whisper_model.is_multilingual,
+        num_languages=whisper_model.num_languages,
+        language="en",
+        task="transcribe",
+    )
+
+    # Padded with 30 seconds of silence, for every window to be a full one.
+    mels = [
+        whisper.log_mel_spectrogram(
+            audio, whisper_model.dims.n_mels, padding=N_SAMPLES
+        )
+        for audio in audios
+    ]
+    num_frames = [mel.shape[-1] - N_FRAMES for mel in mels]
+    seeks = [0] * len(audios)
+    segments: list[list[dict]] = [[] for _ in audios]
+    while active := [i for i, seek in enumerate(seeks) if seek < num_frames[i]]:
+        for batch_start in range(0, len(active), batch_size):
+            batch = active[batch_start : batch_start + batch_size]
+            window_sizes = [
+                min(N_FRAMES, num_frames[i] - seeks[i]) for i in batch
+            ]
+            mel_batch = torch.stack(
+                [
+                    whisper.pad_or_trim(
+                        mels[i][:, seeks[i] : seeks[i] + size], N_FRAMES
+                    )
+                    for i, size in zip(batch, window_sizes)
+                ]
+            ).to(whisper_model.device, dtype)
+            results = whisper_model.decode(mel_batch, options)
+
+            for i, size, result in zip(batch, window_sizes, results):
+                time_offset = seeks[i] * HOP_LENGTH / SAMPLE_RATE
+                if (
+                    result.no_speech_prob > no_speech_threshold
+                    and result.avg_logprob < logprob_threshold
+                ):
+                    seeks[i] += size
+                    continue
+                window_segments, advance = _window_segments(
+                    result.tokens, tokenizer, time_offset, size
+                )
+                for segment in window_segments:
+                    if (
+                        segment["start"] == segment["end"]
+                        or not segment["text"].strip()
+                    ):
+                        continue
+                    segments[i].append(
+                        {
+                            "id": len(segments[i]),
+                            "seek": seeks[i],
+                            **segment,
+                            "temperature": result.temperature,
+                            "avg_logprob": result.avg_logprob,
+                            "compression_ratio": result.compression_ratio,
+                            "no_speech_prob": result.no_speech_prob,
+                        }
+                    )
+                seeks[i] += advance
+
+    return [
+        {
+            "text": "".join(segment["text"] for segment in audio_segments),
+            "segments": audio_segments,
+            "language": "en",
+        }
+        for audio_segments in segments
+    ]
+
+
+def transcribe_segment(
+    start: float,
+    end: float,
+    pcm_filepath: pathlib.Path,
+    model: config.ModelSpec,
+) -> dict:
+    """
+    Transcribe the `start` to `end` seconds of an episode's audio, decoded by
+    `decode_audio` to `pcm_filepath`. Segment timestamps are offset to be relative to
+    the start of the episode. The result includes the segment's "start" and "end",
+    and a breakdown of where time was spent under "stats".
+    """
+    stats = SegmentStats()
+    whisper_model, stats.model_load = load_model(model)
+
+    t0 = time.perf_counter()
+    audio = load_audio_segment(pcm_filepath, start, end)
+    stats.load_audio = time.perf_counter() - t0
+    stats.audio_bytes_read = audio.size * PCM_SAMPLE_WIDTH
+
+    t0 = time.perf_counter()
+    result = decode(whisper_model, audio)
+    stats.decode = time.perf_counter() - t0
+
+    logger.info(
+        f"Transcribed segment {start:.2f} to {end:.2f} ({end - start:.2f}s duration) "
+        f"with stats {stats}."
+    )
+
+    # Add back offsets.
+    for segment in result["segments"]:
+        segment["start"] += start
+        segment["end"] += start
+
+    result["start"], result["end"] = start, end
+    result["stats"] = dataclasses.asdict(stats)
+    return result
+
+
+def transcribe_segments(
+    segments: list[tuple[float, float]],
+    pcm_filepath: pathlib.Path,
+    model: config.ModelSpec,
+) -> list[dict]:
+    """
+    Transcribe several (start, end) segments of an episode's audio together, with
+    `decode_batch`. Results are in the format `transcribe_segment` returns, the time
+    spent decoding split evenly between them.
+    """
+    whisper_model, model_load = load_model(model)
+
+    t0 = time.perf_counter()
+    audios = [
+        load_audio_segment(pcm_filepath, start, end) for start, end in segments
+    ]
+    load_audio = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    results = decode_batch(whisper_model, audios)
+    decode_time = time.perf_counter() - t0
+
+    for i, ((start, end), audio, result) in enumerate(
+        zip(segments, audios, results)
+    ):
+        stats = SegmentStats(
+            model_load=model_load if i == 0 else 0.0,
+            load_audio=load_audio / len(segments),
+            decode=decode_time / len(segments),
+            audio_bytes_read=audio.size * PCM_SAMPLE_WIDTH,
+        )
+        # Add back offsets.
+        for segment in result["segments"]:
+            segment["start"] += start
+            segment["end"] += start
+        result["start"], result["end"] = start, end
+        result["stats"] = dataclasses.asdict(stats)
+    logger.info(
+        f"Transcribed {len(segments)} segments "
+        f"({sum(end - start for start, end in segments):.2f}s duration) "
+        f"in {decode_time:.2f}s."
+    )
+    return results
@@ -1,14 +1,20 @@
 # ---
 # runtimes: ["runc", "gvisor"]
 # ---
+import abc
 import asyncio
+import hashlib
 import io
+import json
 import logging
 import pathlib
 import re
+import sqlite3
 import tempfile
+import threading
 import time
-from typing import Iterator
+import uuid
+from typing import Any, AsyncIterator, Iterator, Optional
 
 import modal
 from fastapi import FastAPI, HTTPException
@@ -30,104 +36,208 @@ CHARLIE_CHAPLIN_DICTATOR_SPEECH_URL = (
 )
 
 
-def load_audio(data: bytes, start=None, end=None, sr: int = 16000):
+# Decoded audio, shared by the web endpoint and segment workers. Files are named by
+# the SHA-256 of the original audio, so each distinct audio is only decoded once.
+AUDIO_DIR = pathlib.Path("/audio")
+volume = modal.NetworkFileSystem.persisted("example-whisper-streaming-audio")
+# Decoded audio kept at most, beyond which the least recently used is removed.
+AUDIO_MAX_BYTES = 10 * 1024**3
+
+# Transcripts of segments, shared by web endpoint containers.
+CACHE_DIR = pathlib.Path("/transcripts")
+transcripts_volume = modal.NetworkFileSystem.persisted(
+    "example-whisper-streaming-transcripts"
+)
+# "disk", a file per segment, or "sqlite", a database of them. SQLite's locking isn't
+# reliable on network file systems, so it's best kept to a single container.
+TRANSCRIPT_CACHE_BACKEND = "disk"
+TRANSCRIPT_CACHE_MAX_BYTES = 1024**3
+# Parameters that decide how audio is split into segments, part of segments' keys.
+SEGMENTATION = {"min_segment_length": 30.0, "min_silence_length": 0.8}
+# Options segments are transcribed with by `model.transcribe`, also part of their keys.
+DECODE_OPTIONS = {"language": "en"}
+
+
+def audio_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def decode_audio(
+    data: bytes,
+    dest: pathlib.Path,
+    min_silence_length: float = 0.8,
+    sr: int = 16000,
+) -> list[tuple[float, float]]:
+    """
+    Decode audio to raw 16-bit mono PCM at `dest`, down-mixing and resampling as
+    necessary, and return the (end, duration) in seconds of each silence in it at
+    least `min_silence_length` long.
+
+    Silences are found with the ffmpeg `silencedetect` filter in the same ffmpeg
+    process, so the audio is only decoded once. `dest` is written through a temporary
+    file, so it only ever holds complete audio.
+    """
     import ffmpeg
-    import numpy as np
 
-    try:
-        fp = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
+    silence_end_re = re.compile(
+        r" silence_end: (?P<end>[0-9]+(\.?[0-9]*)) \| silence_duration: (?P<dur>[0-9]+(\.?[0-9]*))"
+    )
+
+    tmp_dest = dest.with_name(f"{dest.name}.{uuid.uuid4().hex}.tmp")
+    with tempfile.NamedTemporaryFile() as fp:
         fp.write(data)
-        fp.close()
-        # This launches a subprocess to decode audio while down-mixing and resampling as necessary.
-        # Requires the ffmpeg CLI and `ffmpeg-python` package to be installed.
-        if start is None and end is None:
-            out, _ = (
-                ffmpeg.input(fp.name, threads=0)
-                .output("-", format="s16le", acodec="pcm_s16le", ac=1, ar=sr)
-                .run(
-                    cmd=["ffmpeg", "-nostdin"],
-                    capture_stdout=True,
-                    capture_stderr=True,
-                )
-            )
-        else:
-            out, _ = (
+        fp.flush()
+        try:
+            # Requires the ffmpeg CLI and `ffmpeg-python` package to be installed.
+            _, err = (
                 ffmpeg.input(fp.name, threads=0)
-                .filter("atrim", start=start, end=end)
-                .output("-", format="s16le", acodec="pcm_s16le", ac=1, ar=sr)
-                .run(
-                    cmd=["ffmpeg", "-nostdin"],
-                    capture_stdout=True,
-                    capture_stderr=True,
+                .filter("silencedetect", n="-10dB", d=min_silence_length)
+                .output(
+                    str(tmp_dest),
+                    format="s16le",
+                    acodec="pcm_s16le",
+                    ac=1,
+                    ar=sr,
                 )
+                .run(cmd=["ffmpeg", "-nostdin"], capture_stderr=True)
             )
-    except ffmpeg.Error as e:
-        raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
+        except ffmpeg.Error as e:
+            tmp_dest.unlink(missing_ok=True)
+            raise RuntimeError(
+                f"Failed to load audio: {e.stderr.decode()}"
+            ) from e
+    tmp_dest.rename(dest)
+
+    return [
+        (float(match.group("end")), float(match.group("dur")))
+        for match in silence_end_re.finditer(err.decode("utf-8"))
+    ]
+
+
+def published_silences(key: str) -> Optional[list[tuple[float, float]]]:
+    """
+    The silences of the audio published under `key`, or None if there's none. Marks
+    the audio as used, so it's the last to be evicted.
+    """
+    silences_path = AUDIO_DIR / f"{key}.json"
+    try:
+        silences = json.loads(silences_path.read_text())
+        silences_path.touch()
+    except FileNotFoundError:
+        return None
+    return silences
+
+
+def evict_audio(max_bytes: int = AUDIO_MAX_BYTES) -> int:
+    """
+    Removes the least recently used audio published in `AUDIO_DIR`, until it takes up
+    at most `max_bytes`. Returns how many were removed.
+    """
+    entries = []
+    for silences_path in AUDIO_DIR.glob("*.json"):
+        pcm_path = silences_path.with_suffix(".s16le")
+        try:
+            used_at = silences_path.stat().st_mtime
+            size = pcm_path.stat().st_size
+        except FileNotFoundError:
+            continue
+        entries.append((used_at, size, silences_path, pcm_path))
+
+    excess = sum(size for _, size, _, _ in entries) - max_bytes
+    evicted = 0
+    for _, size, silences_path, pcm_path in sorted(entries):
+        if excess <= 0:
+            break
+        # The silences first, since they mark the decoded audio as complete.
+        silences_path.unlink(missing_ok=True)
+        pcm_path.unlink(missing_ok=True)
+        excess -= size
+        evicted += 1
+    return evicted
+
+
+def publish_audio(data: bytes) -> tuple[str, list[tuple[float, float]], bool]:
+    """
+    Decode audio into `AUDIO_DIR` for segment workers to read, unless the same audio
+    already has been, evicting older audio to make room. Returns its key, its silences
+    as returned by `decode_audio`, and whether it had to be decoded.
+    """
+    key = audio_key(data)
+    silences = published_silences(key)
+    if silences is not None:
+        return key, silences, False
+    silences_path = AUDIO_DIR / f"{key}.json"
+
+    AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+    silences = decode_audio(
+        data,
+        AUDIO_DIR / f"{key}.s16le",
+        min_silence_length=SEGMENTATION["min_silence_length"],
+    )
+    # Written last, since it marks the decoded audio as complete.
+    tmp_path = silences_path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(json.dumps(silences))
+    tmp_path.rename(silences_path)
+    evicted = evict_audio()
+    if evicted:
+        print(f"Evicted {evicted} decoded audio files")
+    return key, silences, True
 
-    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+def load_segment(pcm_path: pathlib.Path, start=None, end=None, sr: int = 16000):
+    """
+    The `start` to `end` seconds of decoded PCM audio, as the float32 array Whisper
+    expects. The slice is a view into the memory-mapped file, so only the segment's
+    pages are read, and the only copy made is the conversion to float32.
+    """
+    import numpy as np
+
+    pcm = np.memmap(pcm_path, dtype=np.int16, mode="r")
+    start_sample = None if start is None else int(start * sr)
+    end_sample = None if end is None else int(end * sr)
+    return pcm[start_sample:end_sample].astype(np.float32) / 32768.0
 
 
 def split_silences(
-    path: str, min_segment_length: float = 30.0, min_silence_length: float = 0.8
+    silences: list[tuple[float, float]],
+    duration: float,
+    min_segment_length: float = 30.0,
 ) -> Iterator[tuple[float, float]]:
     """
-    Split audio file into contiguous chunks using the ffmpeg `silencedetect` filter.
-    Yields tuples (start, end) of each chunk in seconds.
+    Split audio into contiguous chunks in the middle of its silences, as returned by
+    `decode_audio`. Yields tuples (start, end) of each chunk in seconds.
 
     Parameters
     ----------
-    path: str
-        path to the audio file on disk.
+    silences: list[tuple[float, float]]
+        the (end, duration) of each silence in the audio, in seconds.
+    duration: float
+        the length of the audio in seconds.
     min_segment_length : float
         The minimum acceptable length for an audio segment in seconds. Lower values
         allow for more splitting and increased parallelizing, but decrease transcription
         accuracy. Whisper models expect to transcribe in 30 second segments, so this is the
         default minimum.
-    min_silence_length : float
-        Minimum silence to detect and split on, in seconds. Lower values are more likely to split
-        audio in middle of phrases and degrade transcription accuracy.
     """
-    import ffmpeg
-
-    silence_end_re = re.compile(
-        r" silence_end: (?P<end>[0-9]+(\.?[0-9]*)) \| silence_duration: (?P<dur>[0-9]+(\.?[0-9]*))"
-    )
-
-    metadata = ffmpeg.probe(path)
-    duration = float(metadata["format"]["duration"])
-
-    reader = (
-        ffmpeg.input(str(path))
-        .filter("silencedetect", n="-10dB", d=min_silence_length)
-        .output("pipe:", format="null")
-        .run_async(pipe_stderr=True)
-    )
-
     cur_start = 0.0
     num_segments = 0
 
-    while True:
-        line = reader.stderr.readline().decode("utf-8")
-        if not line:
-            break
-        match = silence_end_re.search(line)
-        if match:
-            silence_end, silence_dur = match.group("end"), match.group("dur")
-            split_at = float(silence_end) - (float(silence_dur) / 2)
+    for silence_end, silence_dur in silences:
+        split_at = silence_end - (silence_dur / 2)
 
-            if (split_at - cur_start) < min_segment_length:
-                continue
+        if (split_at - cur_start) < min_segment_length:
+            continue
 
-            yield cur_start, split_at
-            cur_start = split_at
-            num_segments += 1
+        yield cur_start, split_at
+        cur_start = split_at
+        num_segments += 1
 
     # silencedetect can place the silence end *after* the end of the full audio segment.
     # Such segments definitions are negative length and invalid.
     if duration > cur_start and (duration - cur_start) > min_segment_length:
         yield cur_start, duration
         num_segments += 1
-    print(f"Split {path} into {num_segments} segments")
+    print(f"Split {duration:.2f}s of audio into {num_segments} segments")
 
 
 @stub.function()
@@ -143,51 +253,392 @@ def download_mp3_from_youtube(youtube_url: str) -> bytes:
     return buffer.read()
 
 
-@stub.function(cpu=2)
+# Whisper models loaded in this container, by name.
+_models: dict[str, Any] = {}
+
+
+def load_model(name: str):
+    """The Whisper model `name`, loading it if this container hasn't yet."""
+    import torch
+    import whisper
+
+    if name not in _models:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        _models[name] = whisper.load_model(name, device=device)
+    return _models[name]
+
+
+# Segments are transcribed one per call, rather than several per call in batches as
+# the pod transcriber does, so each segment's transcript is streamed as soon as it's
+# done instead of once its whole batch is. Batched decoding also has no temperature
+# fallback or conditioning on previous text, which `model.transcribe` has.
+@stub.function(cpu=2, network_file_systems={str(AUDIO_DIR): volume})
 def transcribe_segment(
     start: float,
     end: float,
-    audio_data: bytes,
+    key: str,
     model: str,
-):
-    import torch
-    import whisper
-
+) -> dict:
+    """
+    Transcribe the `start` to `end` seconds of the audio published under `key` by
+    `publish_audio`. Returns its "text", and the "text", "start" and "end" of each of
+    Whisper's "segments" of it, timed relative to the start of the audio.
+    """
     print(
         f"Transcribing segment {start:.2f} to {end:.2f} ({end - start:.2f}s duration)"
     )
 
     t0 = time.time()
-    use_gpu = torch.cuda.is_available()
-    device = "cuda" if use_gpu else "cpu"
-    model = whisper.load_model(model, device=device)
-    np_array = load_audio(audio_data, start=start, end=end)
-    result = model.transcribe(np_array, language="en", fp16=use_gpu)  # type: ignore
+    whisper_model = load_model(model)
+    use_gpu = whisper_model.device.type == "cuda"
+    np_array = load_segment(AUDIO_DIR / f"{key}.s16le", start, end)
+    result = whisper_model.transcribe(np_array, fp16=use_gpu, **DECODE_OPTIONS)
     print(
-        f"Transcribed segment {start:.2f} to {end:.2f} ({end - start:.2f}s duration) in {time.time() - t0:.2f} seconds."
+        f"Transcribed segment {start:.2f} to {end:.2f} ({end - start:.2f}s duration) in {time.time() - t0:.2f} seconds, "
+        f"reading {np_array.size * 2} bytes of audio."
     )
 
-    # Add back offsets.
-    for segment in result["segments"]:
-        segment["start"] += start
-        segment["end"] += start
+    return {
+        "text": result["text"],
+        # Add back offsets.
+        "segments": [
+            {
+                "text": segment["text"],
+                "start": segment["start"] + start,
+                "end": segment["end"] + start,
+            }
+            for segment in result["segments"]
+        ],
+    }
 
-    return result
 
+def server_sent_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-async def stream_whisper(audio_data: bytes):
-    with tempfile.NamedTemporaryFile(delete=False) as f:
-        f.write(audio_data)
-        f.flush()
-        segment_gen = split_silences(f.name)
 
-    for result in transcribe_segment.starmap(
-        segment_gen, kwargs=dict(audio_data=audio_data, model="base.en")
-    ):
-        # Must cooperatively yeild here otherwise `StreamingResponse` will not iteratively return stream parts.
-        # see: https://github.com/python/asyncio/issues/284
-        await asyncio.sleep(0.5)
-        yield result["text"]
+def segment_cache_key(
+    key: str,
+    model: str,
+    start: float,
+    end: float,
+    segmentation: dict,
+    decode_options: dict,
+) -> str:
+    """
+    The transcript cache key of the `start` to `end` segment of the audio `key`, split
+    with `segmentation` and transcribed by `model` with `decode_options`.
+    """
+    parts = [
+        key,
+        model,
+        segmentation,
+        decode_options,
+        round(start, 3),
+        round(end, 3),
+    ]
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class TranscriptCache(abc.ABC):
+    """
+    A cache of bytes by key, evicting the least recently used entries once they take
+    up more than `max_bytes`. Counts its hits, misses and evictions, in this container.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        self._put(key, value)
+        self.evictions += self._evict()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "bytes": self.size(),
+            "max_bytes": self.max_bytes,
+        }
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abc.abstractmethod
+    def _put(self, key: str, value: bytes) -> None:
+        ...
+
+    @abc.abstractmethod
+    def _evict(self) -> int:
+        """Evicts entries until they fit in `max_bytes`, returning how many were."""
+
+    @abc.abstractmethod
+    def size(self) -> int:
+        ...
+
+
+class DiskTranscriptCache(TranscriptCache):
+    """
+    A file per entry in `root`, their modification times marking their last use.
+
+    The entries' total size is counted once, then kept up to date as this container
+    adds entries, so `root` is only listed again when the count goes over
+    `max_bytes`. Entries added by other containers are counted at that point.
+    """
+
+    def __init__(self, root: pathlib.Path, max_bytes: int):
+        super().__init__(max_bytes)
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Used from worker threads.
+        self._lock = threading.Lock()
+        self._bytes: Optional[int] = None
+
+    def _get(self, key: str) -> Optional[bytes]:
+        path = self.root / key
+        try:
+            value = path.read_bytes()
+            path.touch()
+        except FileNotFoundError:
+            return None
+        return value
+
+    def _put(self, key: str, value: bytes) -> None:
+        path = self.root / key
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        tmp_path = self.root / f"{key}.{uuid.uuid4().hex}.tmp"
+        tmp_path.write_bytes(value)
+        tmp_path.rename(path)
+        with self._lock:
+            self._bytes = self._size() + len(value) - replaced
+
+    def _entries(self) -> list[tuple[float, int, pathlib.Path]]:
+        entries = []
+        for path in self.root.iterdir():
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self) -> int:
+        with self._lock:
+            if self._size() <= self.max_bytes:
+                return 0
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                evicted += 1
+            self._bytes = total
+        return evicted
+
+    def _size(self) -> int:
+        if self._bytes is None:
+            self._bytes = sum(size for _, size, _ in self._entries())
+        return self._bytes
+
+    def size(self) -> int:
+        with self._lock:
+            return self._size()
+
+
+class SQLiteTranscriptCache(TranscriptCache):
+    """Entries in a SQLite database at `path`, with the time of their last use."""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        used_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_by_use ON entries (used_at);
+    """
+
+    def __init__(self, path: pathlib.Path, max_bytes: int):
+        super().__init__(max_bytes)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Used from worker threads, one at a time.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.executescript(self._SCHEMA)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE entries SET used_at = ? WHERE key = ? RETURNING value",
+                (time.time(), key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+
+    def _evict(self) -> int:
+        with self._lock:
+            excess = self._size() - self.max_bytes
+            evicted = []
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY used_at"
+            ).fetchall():
+                if excess <= 0:
+                    break
+                evicted.append((key,))
+                excess -= size
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        return len(evicted)
+
+    def _size(self) -> int:
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def size(self) -> int:
+        with self._lock:
+            return self._size()
+
+
+def cached_audio_key(url: str) -> Optional[str]:
+    """The key of the audio last downloaded from `url`, if any."""
+    try:
+        return (CACHE_DIR / "urls" / _url_hash(url)).read_text()
+    except FileNotFoundError:
+        return None
+
+
+def cache_audio_key(url: str, key: str) -> None:
+    """
+    Records `key` as the audio downloaded from `url`. Kept apart from the transcript
+    cache, so that it doesn't count towards its hits, misses or size.
+    """
+    path = CACHE_DIR / "urls" / _url_hash(url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(key)
+    tmp_path.rename(path)
+
+
+def _url_hash(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+_transcript_cache: Optional[TranscriptCache] = None
+
+
+def get_transcript_cache() -> TranscriptCache:
+    """This container's transcript cache, with `TRANSCRIPT_CACHE_BACKEND`."""
+    global _transcript_cache
+    if _transcript_cache is None:
+        if TRANSCRIPT_CACHE_BACKEND == "sqlite":
+            _transcript_cache = SQLiteTranscriptCache(
+                CACHE_DIR / "transcripts.sqlite3", TRANSCRIPT_CACHE_MAX_BYTES
+            )
+        else:
+            _transcript_cache = DiskTranscriptCache(
+                CACHE_DIR / "segments", TRANSCRIPT_CACHE_MAX_BYTES
+            )
+    return _transcript_cache
+
+
+async def transcribe_segments(
+    segments: list[tuple[float, float]],
+    key: str,
+    model: str,
+    cache: Optional[TranscriptCache] = None,
+) -> AsyncIterator[dict]:
+    """
+    Transcribe all segments at once, yielding their transcripts in order, each as soon
+    as it and the segments before it are done.
+
+    Segments found in `cache` aren't transcribed again, their transcripts are yielded
+    from it, and transcribed segments are added to it.
+    """
+
+    async def transcribe(start: float, end: float):
+        cache_key = segment_cache_key(
+            key, model, start, end, SEGMENTATION, DECODE_OPTIONS
+        )
+        if cache is not None:
+            cached = await asyncio.to_thread(cache.get, cache_key)
+            if cached is not None:
+                return json.loads(cached)
+        result = await transcribe_segment.remote.aio(start, end, key, model)
+        if cache is not None:
+            await asyncio.to_thread(
+                cache.put, cache_key, json.dumps(result).encode()
+            )
+        return result
+
+    tasks = [
+        asyncio.create_task(transcribe(start, end)) for start, end in segments
+    ]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_transcript(
+    key: str, silences: list[tuple[float, float]], model: str = "base.en"
+):
+    """Stream the transcript of the audio published under `key` as server-sent events."""
+    duration = (AUDIO_DIR / f"{key}.s16le").stat().st_size / 2 / 16000
+    segments = list(
+        split_silences(
+            silences,
+            duration,
+            min_segment_length=SEGMENTATION["min_segment_length"],
+        )
+    )
+    cache = get_transcript_cache()
+    async for result in transcribe_segments(segments, key, model, cache=cache):
+        yield server_sent_event("segment", result)
+    print(f"Transcript cache stats: {cache.stats()}")
+    yield server_sent_event("done", {})
+
+
+async def stream_whisper(audio_data: bytes):
+    key, silences, decoded = await asyncio.to_thread(publish_audio, audio_data)
+    # Segment workers are only sent the audio's key, and each reads its own slice.
+    print(
+        f"{'Decoded' if decoded else 'Reusing decoded'} audio {key} "
+        f"({len(audio_data)} bytes), {int(decoded)} ffmpeg runs"
+    )
+    async for event in stream_transcript(key, silences):
+        yield event
 
 
 @web_app.get("/")
@@ -200,7 +651,9 @@ async def transcribe(url: str):
         https://modal-labs--example-whisper-streaming-web.modal.run/transcribe?url=https://www.youtube.com/watch?v=s_LncVnecLA"
     ```
 
-    This endpoint will stream back the Youtube's audio transcription as it makes progress.
+    This endpoint will stream back the Youtube's audio transcription as it makes progress,
+    as a server-sent `segment` event of each silence-split segment's text and
+    timestamps, in order, followed by a `done` event.
 
     Some example Youtube videos for inspiration:
 
@@ -209,6 +662,18 @@ async def transcribe(url: str):
     """
     import pytube.exceptions
 
+    # Audio already downloaded from the URL isn't downloaded again, and segments
+    # already transcribed are streamed from the transcript cache.
+    key = await asyncio.to_thread(cached_audio_key, url)
+    if key is not None:
+        silences = await asyncio.to_thread(published_silences, key)
+        if silences is not None:
+            print(f"streaming cached transcription of {url} audio to client...")
+            return StreamingResponse(
+                stream_transcript(key, silences),
+                media_type="text/event-stream",
+            )
+
     print(f"downloading {url}")
     try:
         audio_data = download_mp3_from_youtube(url)
@@ -216,22 +681,39 @@ async def transcribe(url: str):
         raise HTTPException(
             status_code=422, detail=f"Could not process url {url}"
         )
+    await asyncio.to_thread(cache_audio_key, url, audio_key(audio_data))
     print(f"streaming transcription of {url} audio to client...")
     return StreamingResponse(
         stream_whisper(audio_data), media_type="text/event-stream"
     )
 
 
-@stub.function()
+@web_app.get("/cache")
+async def cache_stats():
+    """Hits, misses and evictions of this container's transcript cache, and its size."""
+    return await asyncio.to_thread(get_transcript_cache().stats)
+
+
+@stub.function(
+    network_file_systems={
+        str(AUDIO_DIR): volume,
+        str(CACHE_DIR): transcripts_volume,
+    }
+)
 @modal.asgi_app()
 def web():
     return web_app
 
 
-@stub.function()
+@stub.function(
+    network_file_systems={
+        str(AUDIO_DIR): volume,
+        str(CACHE_DIR): transcripts_volume,
+    }
+)
 async def transcribe_cli(data: bytes, suffix: str):
-    async for result in stream_whisper(data):
-        print(result)
+    async for event in stream_whisper(data):
+        print(event, end="")
 
 
 @stub.local_entrypoint()
@@ -0,0 +1,152 @@
+"""
+Server-side micro-batching of classification requests.
+
+Concurrent requests are collected for a short window, or until a maximum batch size is
+reached, and dispatched as a single batched call to the model. Each caller awaits
+only its own result. Batching trades a little latency (at most the batching window)
+for far fewer model forward passes under load.
+"""
+import asyncio
+import bisect
+import time
+from typing import Awaitable, Callable, Generic, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BatchDispatcher = Callable[[list[T]], Awaitable[Sequence[R]]]
+
+
+class Histogram:
+    """Counts of observations falling into buckets with the given upper bounds."""
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = list(bounds)
+        # The last bucket counts observations above every bound.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the `q`-th quantile."""
+        if self.total == 0:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def serialize(self) -> dict:
+        buckets = {
+            f"le_{bound:g}": count
+            for bound, count in zip(self.bounds, self.counts)
+        }
+        buckets["gt_max"] = self.counts[-1]
+        return {"total": self.total, "buckets": buckets}
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Collects individually submitted items into batches for `dispatch`.
+
+    A batch is dispatched once `max_batch_size` items are queued, or `max_wait_s`
+    after the first item of the batch arrived, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        dispatch: BatchDispatcher,
+        *,
+        max_batch_size: int = 32,
+        max_wait_s: float = 0.01,
+    ) -> None:
+        self.dispatch = dispatch
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_s
+        self._queue: asyncio.Queue[
+            tuple[T, asyncio.Future, float]
+        ] = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: set[asyncio.Task] = set()
+        self.batch_sizes = Histogram(
+            sorted(
+                {2**i for i in range(max_batch_size.bit_length())}
+                | {max_batch_size}
+            )
+        )
+        self.latencies_ms = Histogram(
+            [1, 2, 5, 10, 20, 50, 100, 200, 500, 1_000, 2_000, 5_000]
+        )
+        self.max_queue_depth = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, item: T) -> R:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch concurrently so the next batch can fill up meanwhile.
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(
+        self, batch: list[tuple[T, asyncio.Future, float]]
+    ) -> None:
+        self.batch_sizes.observe(len(batch))
+        try:
+            results = await self.dispatch([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"dispatch returned {len(results)} results for a batch of {len(batch)}"
+                )
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        now = time.perf_counter()
+        for (_, future, submitted), result in zip(batch, results):
+            self.latencies_ms.observe((now - submitted) * 1_000)
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1_000,
+            "batch_size": self.batch_sizes.serialize(),
+            "latency_ms": {
+                **self.latencies_ms.serialize(),
+                "p50": self.latencies_ms.quantile(0.5),
+                "p99": self.latencies_ms.quantile(0.99),
+            },
+        }
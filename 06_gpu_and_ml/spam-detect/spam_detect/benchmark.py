@@ -0,0 +1,251 @@
+"""
+Local micro-benchmarks for the performance-sensitive parts of the spam-detect app.
+
+These run on a CPU-only machine without network access or a Modal account, using
+synthetic data (and for the LLM, a tiny randomly initialized BERT), so results show
+relative speed-ups rather than production latencies.
+
+Usage:
+
+```
+python3 -m spam_detect.benchmark [BENCHMARK] -n [ITEMS]
+```
+"""
+import argparse
+import json
+import os
+import pathlib
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+WORDS = [f"word{i}" for i in range(2_000)]
+
+
+def synthetic_emails(n: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choices(WORDS, k=rng.randint(5, 400))) for _ in range(n)
+    ]
+
+
+def timed(fn: Callable[[], object], repeats: int = 3) -> float:
+    """Returns the median wall-clock seconds of `repeats` calls to `fn`."""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def tiny_bert_classifier(tmp_dir: pathlib.Path):
+    """Builds an LLMSpamClassifier around a tiny, randomly initialized BERT."""
+    from transformers import (
+        AutoConfig,
+        AutoModelForSequenceClassification,
+        AutoTokenizer,
+    )
+
+    from .models import LLMSpamClassifier
+
+    (tmp_dir / "vocab.txt").write_text(
+        "\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS])
+    )
+    (tmp_dir / "tokenizer_config.json").write_text(
+        json.dumps({"tokenizer_class": "BertTokenizer"})
+    )
+    tokenizer = AutoTokenizer.from_pretrained(tmp_dir)
+    config = AutoConfig.for_model(
+        "bert",
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=512,
+        num_labels=2,
+        id2label={0: "HAM", 1: "SPAM"},
+        label2id={"HAM": 0, "SPAM": 1},
+    )
+    model = AutoModelForSequenceClassification.from_config(config)
+    return LLMSpamClassifier(tokenizer=tokenizer, model=model)
+
+
+def bench_llm(n: int) -> None:
+    import torch
+
+    torch.manual_seed(0)
+    emails = synthetic_emails(n)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        classifier = tiny_bert_classifier(pathlib.Path(tmp_dir))
+        quantized = classifier.quantized()
+        results = {
+            "per-email": timed(lambda: [classifier(e) for e in emails]),
+            "classify_batch": timed(lambda: classifier.classify_batch(emails)),
+            "classify_batch (int8)": timed(
+                lambda: quantized.classify_batch(emails)
+            ),
+        }
+    baseline = results["per-email"]
+    print(f"LLMSpamClassifier on {n} emails, {torch.get_num_threads()} threads")
+    for name, seconds in results.items():
+        print(
+            f"{name:>24}: {seconds:.3f}s ({n / seconds:,.0f} emails/s, "
+            f"{baseline / seconds:.1f}x)"
+        )
+
+
+def store_synthetic_naive_bayes(root: pathlib.Path, n: int) -> str:
+    """Trains a NaiveBayes model on `n` synthetic emails and stores it under `root`."""
+    from .dataset import Example
+    from .models import NaiveBayes
+
+    examples = [
+        Example(email=email, spam=i % 2 == 0)
+        for i, email in enumerate(synthetic_emails(n))
+    ]
+    model = NaiveBayes(decision_boundary=0.5, test_set_size=0.0)
+    classifier, metrics = model.train(examples)
+    return model.save(
+        fn=classifier,
+        metrics=metrics,
+        model_registry_root=root,
+        git_commit_hash="BENCHMARK",
+    )
+
+
+def bench_model_cache(n: int) -> None:
+    from . import models
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = pathlib.Path(tmp_dir)
+        model_id = store_synthetic_naive_bayes(root, n)
+
+        def cold():
+            models.model_cache.clear()
+            models.load_model(model_id, root)
+
+        results = {
+            "load_model (cold)": timed(cold),
+            "load_model (warm)": timed(
+                lambda: models.load_model(model_id, root)
+            ),
+            "load_metadata": timed(
+                lambda: models.load_metadata(model_id, root)
+            ),
+        }
+    print(f"NaiveBayes model trained on {n} synthetic emails")
+    for name, seconds in results.items():
+        print(f"{name:>24}: {seconds * 1_000:.3f}ms")
+
+
+def synthetic_naive_bayes(vocab_size: int):
+    """A NaiveBayesSpamClassifier with `vocab_size` tokens and random weights."""
+    from array import array
+
+    from .models import NaiveBayesSpamClassifier
+
+    rng = random.Random(0)
+
+    def table() -> array:
+        return array("d", (rng.uniform(-10.0, -0.1) for _ in range(vocab_size)))
+
+    return NaiveBayesSpamClassifier(
+        vocab={f"token{i}": i for i in range(vocab_size)},
+        log_p_spam=table(),
+        log_q_spam=table(),
+        log_p_ham=table(),
+        log_q_ham=table(),
+    )
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _measure_load(load: Callable[[], object]) -> tuple[float, int]:
+    # Run in a fresh process, so earlier loads don't skew the RSS measurement.
+    from . import model_storage, models  # noqa: F401
+
+    start_rss = _rss_bytes()
+    start = time.perf_counter()
+    classifier = load()
+    duration = time.perf_counter() - start
+    classifier("token1 token2 token3")  # type: ignore
+    return duration, _rss_bytes() - start_rss
+
+
+def _load_pickle(model_id: str, root: pathlib.Path):
+    from . import model_storage
+
+    return model_storage.load_pickle_serialized_model(
+        sha256_hash=model_id, destination_root=root
+    )
+
+
+def _load_array(model_id: str, root: pathlib.Path):
+    from .models import NaiveBayes
+
+    return NaiveBayes().load(model_id, root)
+
+
+def bench_model_format(n: int) -> None:
+    import concurrent.futures
+    import functools
+    import multiprocessing
+
+    from . import model_storage
+    from .models import NaiveBayes
+
+    classifier = synthetic_naive_bayes(n)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = pathlib.Path(tmp_dir)
+        pickle_id = model_storage.store_pickleable_model(
+            classifier_func=classifier,
+            metrics=None,
+            model_destination_root=root,
+            current_git_commit_hash="BENCHMARK",
+        )
+        array_id = NaiveBayes().save(
+            fn=classifier,
+            metrics=None,  # type: ignore
+            model_registry_root=root,
+            git_commit_hash="BENCHMARK",
+        )
+        loaders = {
+            "pickle": (pickle_id, _load_pickle),
+            "mmap arrays": (array_id, _load_array),
+        }
+        print(f"NaiveBayesSpamClassifier with a {n:,} token vocabulary")
+        for name, (model_id, loader) in loaders.items():
+            load = functools.partial(loader, model_id, root)
+            size = model_storage.model_size_bytes(
+                sha256_hash=model_id, destination_root=root
+            )
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                seconds, rss = pool.submit(_measure_load, load).result()
+            print(
+                f"{name:>24}: {seconds * 1_000:.1f}ms load, "
+                f"{rss / 2**20:.1f}MiB RSS increase, {size / 2**20:.1f}MiB on disk"
+            )
+
+
+BENCHMARKS = {
+    "llm": bench_llm,
+    "model-cache": bench_model_cache,
+    "model-format": bench_model_format,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("-n", type=int, default=500, help="number of items")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.n)
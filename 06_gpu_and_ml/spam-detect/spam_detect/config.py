@@ -1,16 +1,31 @@
 import enum
 import logging
+import os
 import pathlib
 import sys
 
 VOLUME_DIR: str = "/cache"
 MODEL_STORE_DIR = pathlib.Path(VOLUME_DIR, "models")
+MODEL_REGISTRY_DB_FILENAME: str = "registry.sqlite3"
+# Legacy JSON registry, imported into the registry database on first use.
 MODEL_REGISTRY_FILENAME: str = "registry.json"
 DATA_DIR = pathlib.Path(VOLUME_DIR, "data")
 
 SERVING_MODEL_ID: str = (
     "sha256.12E5065BE4C3F7D2F79B7A0FD203380869F6E308DCBB4B8C9579FFAE6F32B837"
 )
+# Classification requests are micro-batched for at most this long, or until
+# this many are queued, before being sent to the model as one batch.
+SERVING_BATCH_WAIT_MS: float = float(
+    os.environ.get("SERVING_BATCH_WAIT_MS", 10)
+)
+SERVING_MAX_BATCH_SIZE: int = int(os.environ.get("SERVING_MAX_BATCH_SIZE", 32))
+# Whether LLM classifiers loaded without a GPU are quantized to int8, which makes
+# CPU inference faster but can change their predictions.
+LLM_INT8_ON_CPU: bool = os.environ.get("LLM_INT8_ON_CPU", "0") == "1"
+# Limits of the in-process cache of loaded models.
+MODEL_CACHE_MAX_ENTRIES: int = 4
+MODEL_CACHE_MAX_BYTES: int = 4 * 1024**3
 
 
 class ModelType(str, enum.Enum):
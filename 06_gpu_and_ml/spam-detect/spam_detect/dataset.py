@@ -1,15 +1,30 @@
 """
 Module for the fetching, pre-processing, and loading of spam classification datasets.
 Currently only provides access to the ENRON email dataset.
+
+Datasets are stored in a columnar on-disk format which is memory-mapped when read,
+so that examples can be accessed lazily and in any order without first loading the
+whole dataset into memory. See `ExampleStore`.
 """
+import collections.abc
 import csv
+import hashlib
+import itertools
 import json
+import mmap
+import os
 import pathlib
+import random
+import re
 import shutil
+import sys
 import tempfile
+import time
 import urllib.request
 import zipfile
-from typing import NamedTuple
+import zlib
+from array import array
+from typing import Iterable, Iterator, NamedTuple, Optional, Sequence, Union
 
 # TODO:
 # This dataset only produces ~50,000 examples.
@@ -28,15 +43,192 @@ CleanEnronDataset = dict[str, Example]
 
 
 def dataset_path(base: pathlib.Path) -> pathlib.Path:
+    return base / "raw" / "enron" / "all"
+
+
+def legacy_json_dataset_path(base: pathlib.Path) -> pathlib.Path:
     return base / "raw" / "enron" / "all.json"
 
 
 def deserialize_dataset(dataset_path: pathlib.Path) -> RawEnronDataset:
+    """Reads the whole of a dataset stored in the legacy JSON format into memory."""
     with open(dataset_path, "r") as f:
         items = json.load(f)
     return [Example(email=item[0], spam=bool(item[1])) for item in items]
 
 
+# Columnar dataset layout. Each is a file in the dataset's directory.
+#
+# * emails.bin: every email's UTF-8 text, concatenated.
+# * offsets.bin: N + 1 native-endian uint64 byte offsets into emails.bin.
+# * labels.bin: N uint8 labels, 1 for spam and 0 for ham.
+EMAILS_FILENAME = "emails.bin"
+OFFSETS_FILENAME = "offsets.bin"
+LABELS_FILENAME = "labels.bin"
+
+
+def _mmap_file(path: pathlib.Path) -> Union[mmap.mmap, bytes]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be memory-mapped.
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ExampleStoreWriter:
+    """
+    Incrementally writes examples to a columnar dataset directory.
+
+    Files are written to a temporary sibling directory and moved into place
+    on `close()`, so readers never observe a partially written dataset.
+    """
+
+    def __init__(self, dest: pathlib.Path) -> None:
+        self.dest = dest
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_dir = pathlib.Path(
+            tempfile.mkdtemp(prefix=f".{dest.name}-", dir=dest.parent)
+        )
+        self._emails_f = open(self._tmp_dir / EMAILS_FILENAME, "wb")
+        self._offsets_f = open(self._tmp_dir / OFFSETS_FILENAME, "wb")
+        self._labels_f = open(self._tmp_dir / LABELS_FILENAME, "wb")
+        self._offset = 0
+        self._offsets_f.write(array("Q", [0]).tobytes())
+        self.count = 0
+
+    def write(self, example: Example) -> None:
+        b = example.email.encode("utf-8")
+        self._emails_f.write(b)
+        self._offset += len(b)
+        self._offsets_f.write(array("Q", [self._offset]).tobytes())
+        self._labels_f.write(b"\x01" if example.spam else b"\x00")
+        self.count += 1
+
+    def close(self) -> None:
+        for f in (self._emails_f, self._offsets_f, self._labels_f):
+            f.close()
+        # Move any previous dataset aside rather than deleting it first, so that
+        # `dest` is only briefly missing, and a crash in between leaves a copy.
+        old_dir = None
+        if self.dest.exists():
+            old_dir = self._tmp_dir.with_name(f"{self._tmp_dir.name}-old")
+            self.dest.rename(old_dir)
+        self._tmp_dir.rename(self.dest)
+        if old_dir is not None:
+            shutil.rmtree(old_dir)
+
+    def abort(self) -> None:
+        for f in (self._emails_f, self._offsets_f, self._labels_f):
+            f.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self) -> "ExampleStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_dataset(examples: Iterable[Example], dest: pathlib.Path) -> int:
+    """Writes examples to a columnar dataset directory, returning the number written."""
+    with ExampleStoreWriter(dest) as writer:
+        for example in examples:
+            writer.write(example)
+    return writer.count
+
+
+class ExampleStore(collections.abc.Sequence):
+    """
+    Lazy, memory-mapped reader of a columnar dataset directory.
+
+    Examples are decoded only when accessed. Shuffling and slicing return
+    views over the same memory-mapped files which hold only an index array,
+    so a shuffled training run reads examples in random order without ever
+    materializing the dataset.
+    """
+
+    def __init__(
+        self, path: pathlib.Path, indices: Optional[Sequence[int]] = None
+    ) -> None:
+        self.path = path
+        self._emails = _mmap_file(path / EMAILS_FILENAME)
+        self._offsets = memoryview(_mmap_file(path / OFFSETS_FILENAME)).cast(
+            "Q"
+        )
+        self._labels = _mmap_file(path / LABELS_FILENAME)
+        self._indices = indices
+
+    def _view(self, indices: Sequence[int]) -> "ExampleStore":
+        view = object.__new__(ExampleStore)
+        view.path = self.path
+        view._emails = self._emails
+        view._offsets = self._offsets
+        view._labels = self._labels
+        view._indices = indices
+        return view
+
+    def _example(self, i: int) -> Example:
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return Example(
+            email=self._emails[start:end].decode("utf-8"),
+            spam=bool(self._labels[i]),
+        )
+
+    def __len__(self) -> int:
+        if self._indices is not None:
+            return len(self._indices)
+        return len(self._labels)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if self._indices is not None:
+                return self._view(self._indices[key])
+            return self._view(range(len(self))[key])
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("ExampleStore index out of range")
+        if self._indices is not None:
+            key = self._indices[key]
+        return self._example(key)
+
+    def __iter__(self) -> Iterator[Example]:
+        for i in (
+            self._indices if self._indices is not None else range(len(self))
+        ):
+            yield self._example(i)
+
+    def shuffled(self, seed: Optional[int] = None) -> "ExampleStore":
+        """Returns a view of the examples in a random order."""
+        indices = array(
+            "Q",
+            self._indices if self._indices is not None else range(len(self)),
+        )
+        random.Random(seed).shuffle(indices)
+        return self._view(indices)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[list[Example]]:
+        """Yields examples in order, `chunk_size` at a time."""
+        for start in range(0, len(self), chunk_size):
+            yield list(self[start : start + chunk_size])
+
+
+def load_dataset(path: pathlib.Path) -> ExampleStore:
+    return ExampleStore(path)
+
+
+def convert_legacy_json_dataset(base: pathlib.Path) -> None:
+    """One-time migration of a dataset stored in the legacy `all.json` format."""
+    n = write_dataset(
+        deserialize_dataset(legacy_json_dataset_path(base)),
+        dest=dataset_path(base),
+    )
+    print(f"converted {n} examples to {dataset_path(base)}", file=sys.stderr)
+
+
 def _download_and_extract_dataset(destination_root_path: pathlib.Path, logger):
     logger.info("Downloading raw enron dataset.")
     destination_path = destination_root_path / "enron.zip"
@@ -65,6 +257,182 @@ def fix_nulls(f):
         yield line.replace("\0", "")
 
 
+class StageStats:
+    """Counts and busy time of one stage of the ingestion pipeline."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.seconds = 0.0
+
+    def throughput(self) -> float:
+        return self.items_in / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        dropped = self.items_in - self.items_out
+        return (
+            f"{self.name}: {self.items_in} in, {self.items_out} out "
+            f"({dropped} dropped), {self.throughput():,.0f} items/s"
+        )
+
+
+def read_enron_csv(
+    csv_path: pathlib.Path, chunk_size: int, stats: StageStats
+) -> Iterator[list[Example]]:
+    """Reads the ENRON CSV file `chunk_size` examples at a time."""
+    with open(csv_path, "r") as csvfile:
+        csv.field_size_limit(100_000_000)
+        reader = csv.DictReader(fix_nulls(csvfile), delimiter=",")
+        while True:
+            start = time.perf_counter()
+            chunk = [
+                Example(
+                    email=row["Subject"] + " " + row["Message"],
+                    spam=row["Spam/Ham"] == "spam",
+                )
+                for row in itertools.islice(reader, chunk_size)
+            ]
+            stats.seconds += time.perf_counter() - start
+            stats.items_in += len(chunk)
+            stats.items_out += len(chunk)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _normalize(email: str) -> str:
+    return " ".join(email.lower().split())
+
+
+class ExactDeduplicator:
+    """Drops emails whose whitespace- and case-normalized text has already been seen."""
+
+    def __init__(self) -> None:
+        self.stats = StageStats("exact-dedup")
+        # Digests are kept instead of texts so memory stays small on large corpora.
+        self._seen: set[bytes] = set()
+
+    def is_duplicate(self, example: Example) -> bool:
+        digest = hashlib.blake2b(
+            _normalize(example.email).encode(), digest_size=16
+        ).digest()
+        if digest in self._seen:
+            return True
+        self._seen.add(digest)
+        return False
+
+
+class NearDeduplicator:
+    """
+    Drops emails which are near-duplicates of an already seen email, using
+    MinHash signatures over word 3-gram shingles and locality-sensitive hashing (LSH).
+
+    Signatures are split into `bands` bands of `num_perm // bands` rows, and an email
+    is a near-duplicate if any band matches a previously seen email. The defaults flag
+    pairs with a Jaccard similarity above roughly 0.9.
+    """
+
+    # Mersenne prime larger than any 32-bit shingle hash.
+    _PRIME = (1 << 61) - 1
+
+    def __init__(
+        self, num_perm: int = 64, bands: int = 4, seed: int = 1
+    ) -> None:
+        import numpy as np
+
+        if num_perm % bands != 0:
+            raise ValueError(f"{num_perm=} must be divisible by {bands=}")
+        self.stats = StageStats("near-dedup")
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        # Kept below 2**31 so that a * x + b can't overflow uint64 for 32-bit x.
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._buckets: list[set[int]] = [set() for _ in range(bands)]
+
+    def signature(self, email: str):
+        import numpy as np
+
+        words = re.findall("[a-z0-9]+", email.lower())
+        if not words:
+            return None
+        shingles = {
+            zlib.crc32(" ".join(words[i : i + 3]).encode())
+            for i in range(max(1, len(words) - 2))
+        }
+        x = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        hashed = (np.outer(x, self._a) + self._b) % self._PRIME
+        return hashed.min(axis=0)
+
+    def is_duplicate(self, example: Example) -> bool:
+        sig = self.signature(example.email)
+        if sig is None:
+            return False
+        keys = [
+            hash(sig[band * self.rows : (band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+        if any(key in bucket for key, bucket in zip(keys, self._buckets)):
+            return True
+        for key, bucket in zip(keys, self._buckets):
+            bucket.add(key)
+        return False
+
+
+def ingest(
+    csv_path: pathlib.Path,
+    dest: pathlib.Path,
+    logger,
+    *,
+    chunk_size: int = 10_000,
+    near_duplicates: bool = True,
+) -> list[StageStats]:
+    """
+    Streams the ENRON CSV file into a columnar dataset at `dest`, dropping exact and
+    (optionally) near-duplicate emails on the way. Only one chunk of rows is held in
+    memory at a time. Progress and throughput of each stage is logged per chunk.
+    """
+    read_stats = StageStats("read-csv")
+    dedups: list[Union[ExactDeduplicator, NearDeduplicator]] = [
+        ExactDeduplicator()
+    ]
+    if near_duplicates:
+        dedups.append(NearDeduplicator())
+    write_stats = StageStats("write")
+    all_stats = [read_stats, *(d.stats for d in dedups), write_stats]
+
+    spam_count = 0
+    with ExampleStoreWriter(dest) as writer:
+        for chunk in read_enron_csv(csv_path, chunk_size, read_stats):
+            for dedup in dedups:
+                start = time.perf_counter()
+                dedup.stats.items_in += len(chunk)
+                chunk = [ex for ex in chunk if not dedup.is_duplicate(ex)]
+                dedup.stats.items_out += len(chunk)
+                dedup.stats.seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for ex in chunk:
+                writer.write(ex)
+                spam_count += ex.spam
+            write_stats.items_in += len(chunk)
+            write_stats.items_out += len(chunk)
+            write_stats.seconds += time.perf_counter() - start
+            logger.info(" | ".join(str(stats) for stats in all_stats))
+
+    spam_percentage = (
+        round((spam_count / writer.count) * 100, ndigits=4)
+        if writer.count
+        else 0.0
+    )
+    logger.info(
+        f"wrote processed dataset to {dest}. dataset contains {writer.count} examples and is {spam_percentage}% spam"
+    )
+    return all_stats
+
+
 def download(logger, base: pathlib.Path) -> None:
     dest = dataset_path(base)
     dest.parent.mkdir(exist_ok=True, parents=True)
@@ -72,24 +440,4 @@ def download(logger, base: pathlib.Path) -> None:
     dataset_csv_path = _download_and_extract_dataset(
         destination_root_path=tmp_path, logger=logger
     )
-    ds: list[Example] = []
-    spam_count = 0
-    with open(dataset_csv_path, "r") as csvfile:
-        csv.field_size_limit(100_000_000)
-        reader = csv.DictReader(fix_nulls(csvfile), delimiter=",")
-        for row in reader:
-            is_spam = row["Spam/Ham"] == "spam"
-            if is_spam:
-                spam_count += 1
-            ex = Example(
-                email=row["Subject"] + " " + row["Message"],
-                spam=is_spam,
-            )
-            ds.append(ex)
-
-    spam_percentage = round((spam_count / len(ds)) * 100, ndigits=4)
-    logger.info(
-        f"writing processed raw dataset to file. dataset contains {len(ds)} examples and is {spam_percentage}% spam"
-    )
-    with open(dest, "w") as f:
-        json.dump(ds, f, indent=4)
+    ingest(dataset_csv_path, dest=dest, logger=logger)
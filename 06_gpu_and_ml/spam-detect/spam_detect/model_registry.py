@@ -2,8 +2,15 @@
 Defines minimal data structures and command-line interface (CLI) commands for a model registry.
 The CLI commands are operationally useful, used to inspect prior trained models and promote the
 most promising models to production serving.
+
+The registry is a SQLite database file stored alongside the models, which gives atomic
+writes, so concurrent training runs can't clobber each other's entries, and indexed
+per-model lookups and queries.
 """
+import datetime
 import json
+import pathlib
+import sqlite3
 from typing import Callable, NamedTuple, Optional
 
 from . import config
@@ -63,14 +70,208 @@ class ModelMetadata(NamedTuple):
         )
 
 
+SAVE_DATE_FORMAT = "%d-%m-%Y %H:%M:%S"
+
+
+class ModelRegistry:
+    """SQLite-backed store of `ModelMetadata`, keyed by model sha256 hash."""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS models (
+        model_id TEXT PRIMARY KEY,
+        impl_name TEXT NOT NULL,
+        save_date TEXT NOT NULL,
+        -- save_date as a UNIX timestamp, so that models can be ordered by age.
+        saved_at REAL NOT NULL,
+        git_commit_hash TEXT NOT NULL,
+        has_metrics INTEGER NOT NULL,
+        dataset_id TEXT,
+        eval_set_size INTEGER,
+        accuracy REAL,
+        precision REAL,
+        recall REAL
+    );
+    CREATE INDEX IF NOT EXISTS models_by_impl_and_age ON models (impl_name, saved_at);
+    CREATE INDEX IF NOT EXISTS models_by_age ON models (saved_at);
+    """
+    _COLUMNS = (
+        "model_id, impl_name, save_date, git_commit_hash, has_metrics, "
+        "dataset_id, eval_set_size, accuracy, precision, recall"
+    )
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        # Writers wait on each other's locks rather than failing immediately.
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.executescript(self._SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    @staticmethod
+    def _from_row(row: tuple) -> tuple[str, ModelMetadata]:
+        (
+            model_id,
+            impl_name,
+            save_date,
+            git_commit_hash,
+            has_metrics,
+            *metrics,
+        ) = row
+        return model_id, ModelMetadata(
+            impl_name=impl_name,
+            save_date=save_date,
+            git_commit_hash=git_commit_hash,
+            metrics=TrainMetrics(*metrics) if has_metrics else None,
+        )
+
+    def get(self, model_id: str) -> Optional[ModelMetadata]:
+        row = self._conn.execute(
+            f"SELECT {self._COLUMNS} FROM models WHERE model_id = ?",
+            (model_id,),
+        ).fetchone()
+        return self._from_row(row)[1] if row else None
+
+    def put(self, model_id: str, metadata: ModelMetadata) -> None:
+        """
+        Atomically adds or updates a model's metadata.
+        Raises if a model with the same hash but a different implementation exists.
+        """
+        metrics = (
+            tuple(metadata.metrics)
+            if metadata.metrics
+            else (None,) * len(TrainMetrics._fields)
+        )
+        saved_at = datetime.datetime.strptime(
+            metadata.save_date, SAVE_DATE_FORMAT
+        ).timestamp()
+        with self._transaction():
+            existing = self.get(model_id)
+            # compare new metadata with old to detect registry corruption or
+            # strange renaming.
+            if (
+                existing is not None
+                and existing.impl_name != metadata.impl_name
+            ):
+                raise RuntimeError(
+                    "Existing classifier with identical sha256 hash to current classifier found "
+                    "with conflicting metadata. "
+                    "Something has gone wrong."
+                )
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO models ({self._COLUMNS}, saved_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    model_id,
+                    metadata.impl_name,
+                    metadata.save_date,
+                    metadata.git_commit_hash,
+                    metadata.metrics is not None,
+                    *metrics,
+                    saved_at,
+                ),
+            )
+
+    def query(
+        self,
+        *,
+        impl_name: Optional[str] = None,
+        min_precision: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> list[tuple[str, ModelMetadata]]:
+        """Returns models matching all given filters, newest first."""
+        clauses: list[str] = []
+        params: list = []
+        if impl_name is not None:
+            clauses.append("impl_name = ?")
+            params.append(impl_name)
+        if min_precision is not None:
+            clauses.append("precision >= ?")
+            params.append(min_precision)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            f"SELECT {self._COLUMNS} FROM models {where} ORDER BY saved_at DESC"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self._from_row(row) for row in self._conn.execute(sql, params)]
+
+    def list_models(self) -> dict[str, ModelMetadata]:
+        return dict(self.query())
+
+    def import_json(self, json_path: pathlib.Path) -> int:
+        """Imports models from a legacy JSON registry file, returning the number imported."""
+        with open(json_path, "r") as f:
+            registry_data = json.load(f)
+        with self._transaction():
+            for model_id, m in registry_data.items():
+                self.put(model_id, ModelMetadata.from_dict(m))
+        return len(registry_data)
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+
+class _Transaction:
+    """Re-entrant, write-locking transaction on a connection in autocommit mode."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.outermost = False
+
+    def __enter__(self) -> None:
+        if not self.conn.in_transaction:
+            self.outermost = True
+            # Take the write lock up front, so read-check-write sequences are atomic.
+            self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.outermost:
+            self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def open_registry(model_registry_root: pathlib.Path) -> ModelRegistry:
+    """
+    Opens the registry database stored under `model_registry_root`, creating it if needed.
+    A legacy JSON registry found there is imported once, when the database is created.
+    """
+    model_registry_root.mkdir(parents=True, exist_ok=True)
+    db_path = model_registry_root / config.MODEL_REGISTRY_DB_FILENAME
+    is_new = not db_path.exists()
+    registry = ModelRegistry(db_path)
+    json_path = model_registry_root / config.MODEL_REGISTRY_FILENAME
+    if is_new and json_path.exists():
+        n = registry.import_json(json_path)
+        print(f"imported {n} models from legacy registry {json_path}")
+    return registry
+
+
 @stub.function(volumes={config.VOLUME_DIR: volume})
-def _list_models() -> dict[str, ModelMetadata]:
-    registry_filepath = config.MODEL_STORE_DIR / config.MODEL_REGISTRY_FILENAME
-    with open(registry_filepath, "r") as f:
-        registry_data = json.load(f)
-    return {
-        m_id: ModelMetadata.from_dict(m) for m_id, m in registry_data.items()
-    }
+def _list_models(
+    impl_name: Optional[str] = None,
+    min_precision: Optional[float] = None,
+    limit: Optional[int] = None,
+) -> list[tuple[str, ModelMetadata]]:
+    registry = open_registry(config.MODEL_STORE_DIR)
+    models = registry.query(
+        impl_name=impl_name, min_precision=min_precision, limit=limit
+    )
+    registry.close()
+    volume.commit()  # Persist a newly created registry.
+    return models
+
+
+@stub.function(volumes={config.VOLUME_DIR: volume})
+def migrate_json_registry() -> None:
+    """(Re-)import the legacy registry.json into the registry database."""
+    registry = open_registry(config.MODEL_STORE_DIR)
+    n = registry.import_json(
+        config.MODEL_STORE_DIR / config.MODEL_REGISTRY_FILENAME
+    )
+    registry.close()
+    volume.commit()
+    print(f"imported {n} models.")
 
 
 @stub.function(volumes={config.VOLUME_DIR: volume})
@@ -85,16 +286,22 @@ def delete_model(
 
 
 @stub.local_entrypoint()
-def list_models() -> None:
-    """Show all models in registry."""
+def list_models(
+    # Only show models with this implementation, eg. 'NaiveBayesSpamClassifier'.
+    impl: str = "",
+    # Only show models evaluated with at least this precision.
+    min_precision: float = -1.0,
+    # Show at most this many models.
+    limit: int = -1,
+) -> None:
+    """Show models in registry, newest first."""
     with stub.run():
-        models = _list_models.remote()
-    newest_to_oldest = sorted(
-        [(key, value) for key, value in models.items()],
-        key=lambda item: item[1].save_date,
-        reverse=True,
-    )
-    for model_id, metadata in newest_to_oldest:
+        models = _list_models.remote(
+            impl_name=impl or None,
+            min_precision=min_precision if min_precision >= 0 else None,
+            limit=limit if limit >= 0 else None,
+        )
+    for model_id, metadata in models:
         print(
             f"\033[96m {model_id} \033[0m{metadata.impl_name}\033[93m {metadata.save_date} \033[0m"
         )
@@ -6,11 +6,14 @@ import datetime
 import hashlib
 import io
 import json
+import mmap
 import pathlib
 import pickle
 import random
 import string
+import struct
 import subprocess
+import sys
 from typing import (
     Any,
     Callable,
@@ -20,7 +23,13 @@ from typing import (
 )
 
 from . import config, dataset
-from .model_registry import ModelMetadata, SpamClassifier, TrainMetrics
+from .model_registry import (
+    SAVE_DATE_FORMAT,
+    ModelMetadata,
+    SpamClassifier,
+    TrainMetrics,
+    open_registry,
+)
 
 logger = config.get_logger()
 
@@ -91,10 +100,6 @@ def store_huggingface_model(
 
     logger.info(f"serialized model's hash is {model_hashtag}")
 
-    model_registry_metadata = load_model_registry_metadata(
-        model_registry_root=model_destination_root,
-    )
-
     model_dest_path = model_destination_root / model_hashtag
     if model_dest_path.is_file():
         logger.warning(
@@ -109,11 +114,10 @@ def store_huggingface_model(
     )
     metadata = ModelMetadata(
         impl_name=model_name,
-        save_date=datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S"),
+        save_date=datetime.datetime.now().strftime(SAVE_DATE_FORMAT),
         git_commit_hash=git_commit_hash,
     )
     store_model_registry_metadata(
-        model_registry_metadata=model_registry_metadata,
         sha256_hash=model_hashtag,
         metadata=metadata,
         destination_root=model_destination_root,
@@ -141,10 +145,6 @@ def store_pickleable_model(
 
     logger.info(f"serialized model's hash is {ser_clssfr_hash}")
 
-    model_registry_metadata = load_model_registry_metadata(
-        model_registry_root=model_destination_root,
-    )
-
     model_dest_path = model_destination_root / ser_clssfr_hash
     if model_dest_path.is_file():
         logger.warning(
@@ -162,12 +162,11 @@ def store_pickleable_model(
     )
     metadata = ModelMetadata(
         impl_name=model_name_from_function(classifier_func),
-        save_date=datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S"),
+        save_date=datetime.datetime.now().strftime(SAVE_DATE_FORMAT),
         git_commit_hash=current_git_commit_hash,
         metrics=metrics,
     )
     store_model_registry_metadata(
-        model_registry_metadata=model_registry_metadata,
         sha256_hash=ser_clssfr_hash,
         metadata=metadata,
         destination_root=model_destination_root,
@@ -176,73 +175,272 @@ def store_pickleable_model(
     return ser_clssfr_hash
 
 
+# Flat-array model format, for models whose state is numeric tables:
+#
+# * 8 bytes: ARRAY_MODEL_MAGIC
+# * 8 bytes: little-endian uint64 length of the header
+# * header: UTF-8 JSON object, padded with spaces to a multiple of 8 bytes
+# * the arrays' raw bytes, each starting at an 8-byte aligned offset (relative
+#   to the end of the header) recorded in the header.
+ARRAY_MODEL_MAGIC = b"SPAMARR1"
+ArrayLike = Any  # Any object supporting the buffer protocol, eg. array.array.
+
+
+class _HashingWriter:
+    """Writes to a file while computing the sha256 hash of everything written."""
+
+    def __init__(self, f) -> None:
+        self.f = f
+        self.dgst = hashlib.sha256()
+        self.position = 0
+
+    def write(self, b) -> None:
+        b = memoryview(b).cast("B")
+        self.f.write(b)
+        self.dgst.update(b)
+        self.position += len(b)
+
+    def hashtag(self) -> str:
+        return f"sha256.{self.dgst.hexdigest().upper()}"
+
+
+def create_hashtag_from_file(
+    path: pathlib.Path, chunk_size: int = 1 << 20
+) -> str:
+    """Hashes a file a chunk at a time, without reading it all into memory."""
+    dgst = hashlib.sha256()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            dgst.update(view[:n])
+    return f"sha256.{dgst.hexdigest().upper()}"
+
+
+def is_array_model(*, sha256_hash: str, destination_root: pathlib.Path) -> bool:
+    with open(destination_root / sha256_hash, "rb") as f:
+        return f.read(len(ARRAY_MODEL_MAGIC)) == ARRAY_MODEL_MAGIC
+
+
+def store_array_model(
+    *,
+    header: dict,
+    arrays: dict[str, ArrayLike],
+    impl_name: str,
+    metrics: TrainMetrics,
+    model_destination_root: pathlib.Path,
+    current_git_commit_hash: str,
+) -> str:
+    """
+    Stores a model made up of flat numeric arrays, plus a small JSON header of
+    scalar state, in registry and persistent filesystem. The model is hashed while
+    it is written, rather than serialized into memory first.
+    """
+    logger.info("storing spam model to model registry as flat arrays.")
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        view = memoryview(arr)
+        layout[name] = {
+            "offset": offset,
+            "format": view.format,
+            "length": len(view),
+        }
+        offset += -(-view.nbytes // 8) * 8
+    header_b = json.dumps(
+        {"byteorder": "little", "header": header, "arrays": layout},
+        sort_keys=True,
+    ).encode()
+    header_b += b" " * (-len(header_b) % 8)
+
+    model_destination_root.mkdir(parents=True, exist_ok=True)
+    tmp_path = model_destination_root / (
+        "tmp-"
+        + "".join(random.choices(string.ascii_uppercase + string.digits, k=20))
+    )
+    with open(tmp_path, "wb") as f:
+        writer = _HashingWriter(f)
+        writer.write(ARRAY_MODEL_MAGIC)
+        writer.write(len(header_b).to_bytes(8, "little"))
+        writer.write(header_b)
+        for arr in arrays.values():
+            view = memoryview(arr).cast("B")
+            writer.write(view)
+            writer.write(b"\0" * (-len(view) % 8))
+    model_hashtag = writer.hashtag()
+    logger.info(f"serialized model's hash is {model_hashtag}")
+
+    model_dest_path = model_destination_root / model_hashtag
+    if model_dest_path.is_file():
+        logger.warning(
+            (
+                f"model {model_hashtag} already exists. No need to save again. "
+                "consider caching model training to save compute cycles."
+            )
+        )
+        tmp_path.unlink()
+    else:
+        logger.info(f"saving model to file at '{model_dest_path}'")
+        tmp_path.rename(model_dest_path)
+
+    metadata = ModelMetadata(
+        impl_name=impl_name,
+        save_date=datetime.datetime.now().strftime(SAVE_DATE_FORMAT),
+        git_commit_hash=current_git_commit_hash,
+        metrics=metrics,
+    )
+    store_model_registry_metadata(
+        sha256_hash=model_hashtag,
+        metadata=metadata,
+        destination_root=model_destination_root,
+    )
+    logger.info("📦 done! Model stored.")
+    return model_hashtag
+
+
+def load_array_model(
+    *,
+    sha256_hash: str,
+    destination_root: pathlib.Path,
+) -> tuple[dict, dict[str, memoryview]]:
+    """
+    Memory-maps a model stored with `store_array_model`. Arrays are returned as
+    read-only views onto the mapped file, so nothing is copied onto the heap.
+    """
+    model_path = destination_root / sha256_hash
+    actual_hash = create_hashtag_from_file(model_path)
+    if actual_hash != sha256_hash:
+        raise ValueError(
+            f"Shasum integrity check failure. Expected '{sha256_hash}' but got '{actual_hash}'"
+        )
+    if sys.byteorder != "little":
+        raise RuntimeError(
+            "array models can only be loaded on little-endian machines."
+        )
+
+    with open(model_path, "rb") as f:
+        buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    magic_len = len(ARRAY_MODEL_MAGIC)
+    if buf[:magic_len] != ARRAY_MODEL_MAGIC:
+        raise ValueError(f"{model_path} is not an array model.")
+    header_len = int.from_bytes(buf[magic_len : magic_len + 8], "little")
+    data_start = magic_len + 8 + header_len
+    meta = json.loads(bytes(buf[magic_len + 8 : data_start]))
+    arrays = {}
+    for name, spec in meta["arrays"].items():
+        start = data_start + spec["offset"]
+        itemsize = struct.calcsize(spec["format"])
+        arrays[name] = buf[start : start + spec["length"] * itemsize].cast(
+            spec["format"]
+        )
+    return meta["header"], arrays
+
+
+def model_artifact_path(
+    *,
+    sha256_hash: str,
+    artifact_name: str,
+    destination_root: pathlib.Path,
+) -> pathlib.Path:
+    return destination_root / f"{sha256_hash}.{artifact_name}"
+
+
+def store_model_artifact(
+    *,
+    sha256_hash: str,
+    artifact_name: str,
+    content: bytes,
+    destination_root: pathlib.Path,
+) -> pathlib.Path:
+    """
+    Stores auxiliary training output (eg. evaluation tables) next to a stored model.
+    Artifacts are not part of the model's content hash.
+    """
+    artifact_path = model_artifact_path(
+        sha256_hash=sha256_hash,
+        artifact_name=artifact_name,
+        destination_root=destination_root,
+    )
+    logger.info(f"saving model artifact to file at '{artifact_path}'")
+    artifact_path.write_bytes(content)
+    return artifact_path
+
+
 def model_name_from_function(model_func: SpamClassifier) -> str:
     # NOTE: This may be buggy, and create name clashes or ambiguity.
-    return model_func.__qualname__
+    if hasattr(model_func, "__qualname__"):
+        return model_func.__qualname__
+    # Class-based classifiers are named after their class.
+    return type(model_func).__qualname__
 
 
 def load_model_registry_metadata(
     *,
     model_registry_root: pathlib.Path,
-):
-    model_registry_metadata_filepath = (
-        model_registry_root / config.MODEL_REGISTRY_FILENAME
-    )
-    if not model_registry_metadata_filepath.exists():
-        # Create registry metadata file on first save of a model.
-        model_registry_metadata_filepath.write_text("{}")
-
-    with open(model_registry_metadata_filepath, "r") as model_registry_f:
-        data = json.load(model_registry_f)
-    model_registry_metadata: ModelRegistryMetadata = {
-        key: ModelMetadata(
-            impl_name=value["impl_name"],
-            save_date=value["save_date"],
-            git_commit_hash=value["git_commit_hash"],
-        )
-        for key, value in data.items()
-    }
-    return model_registry_metadata
+) -> ModelRegistryMetadata:
+    registry = open_registry(model_registry_root)
+    try:
+        return registry.list_models()
+    finally:
+        registry.close()
+
+
+_registry_cache: dict[
+    pathlib.Path, tuple[tuple[int, int], ModelRegistryMetadata]
+] = {}
 
 
-def retrieve_model_registry_metadata(
+def read_model_registry_metadata(
     *,
-    model_registry_metadata: ModelRegistryMetadata,
-    sha256_hash: str,
-) -> Optional[ModelMetadata]:
-    return model_registry_metadata.get(sha256_hash)
+    model_registry_root: pathlib.Path,
+) -> ModelRegistryMetadata:
+    """
+    Reads the full metadata, including metrics, of every model in the registry.
+
+    The parsed registry is cached in-process and only re-read when the registry
+    file's modification time or size changes.
+    """
+    registry_filepath = model_registry_root / config.MODEL_REGISTRY_DB_FILENAME
+    if not registry_filepath.exists():
+        return load_model_registry_metadata(
+            model_registry_root=model_registry_root
+        )
+    stat = registry_filepath.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _registry_cache.get(registry_filepath)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    registry = load_model_registry_metadata(
+        model_registry_root=model_registry_root
+    )
+    _registry_cache[registry_filepath] = (version, registry)
+    return registry
+
+
+def model_size_bytes(
+    *, sha256_hash: str, destination_root: pathlib.Path
+) -> int:
+    """Size on disk of a stored model, which may be a file or a directory."""
+    model_path = destination_root / sha256_hash
+    if model_path.is_dir():
+        return sum(
+            f.stat().st_size for f in model_path.glob("**/*") if f.is_file()
+        )
+    return model_path.stat().st_size
 
 
 def store_model_registry_metadata(
     *,
-    model_registry_metadata: ModelRegistryMetadata,
     sha256_hash: str,
     metadata: ModelMetadata,
     destination_root: pathlib.Path,
 ) -> None:
-    existing_metadata = retrieve_model_registry_metadata(
-        model_registry_metadata=model_registry_metadata,
-        sha256_hash=sha256_hash,
-    )
-    if existing_metadata is not None:
-        logger.debug("classifier with matching hash found in registry.")
-        # compare new metadata with old to detect registry corruption or
-        # strange renaming.
-        if metadata.impl_name != existing_metadata.impl_name:
-            raise RuntimeError(
-                "Existing classifier with identical sha256 hash to current classifier found "
-                "with conflicting metadata. "
-                "Something has gone wrong."
-            )
-    model_registry_metadata_dict = {
-        key: value._asdict() for key, value in model_registry_metadata.items()
-    }
-    # NOTE: Potentially overwrites with new metadata.
-    model_registry_metadata_dict[sha256_hash] = metadata.serialize()
-    with open(
-        destination_root / config.MODEL_REGISTRY_FILENAME, "w"
-    ) as model_registry_f:
-        json.dump(model_registry_metadata_dict, model_registry_f, indent=4)
+    registry = open_registry(destination_root)
+    try:
+        # NOTE: Potentially overwrites with new metadata.
+        registry.put(sha256_hash, metadata)
+    finally:
+        registry.close()
 
 
 def load_pickle_serialized_model(
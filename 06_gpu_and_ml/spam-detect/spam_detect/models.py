@@ -7,16 +7,26 @@ Current model implementations are:
 
 * BadWords (a baseline heuristic classifier)
 * LLM (a fine-tuned BERT language classifier)
-* NaiveBayes
+* NaiveBayes (compiled into a `NaiveBayesSpamClassifier`)
 """
-import json
+import itertools
 import math
+import os
 import pathlib
 import re
-from collections import defaultdict
+import zlib
+from array import array
+from collections import OrderedDict
 from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
     Optional,
     Protocol,
+    Sequence,
+    Union,
     cast,
 )
 
@@ -29,17 +39,80 @@ from .model_registry import (
     TrainMetrics,
 )
 
-Dataset = list[Example]
+Dataset = Sequence[Example]
 
 
-def load_model(model_id: str):
-    registry_filepath = config.MODEL_STORE_DIR / config.MODEL_REGISTRY_FILENAME
-    with open(registry_filepath, "r") as f:
-        registry_data = json.load(f)
-    if model_id not in registry_data:
+def load_metadata(
+    model_id: str, model_registry_root: pathlib.Path = config.MODEL_STORE_DIR
+) -> ModelMetadata:
+    """Looks up a model's registry metadata, without loading the model itself."""
+    registry = model_storage.read_model_registry_metadata(
+        model_registry_root=model_registry_root
+    )
+    if model_id not in registry:
         raise ValueError(f"{model_id} not contained in registry.")
+    return registry[model_id]
+
+
+class ModelCache:
+    """
+    Process-wide cache of loaded classifiers, keyed by model sha256 hash.
+
+    Least-recently used models are evicted once more than `max_entries` are
+    cached, or their combined on-disk size exceeds `max_bytes`. The most recently
+    loaded model is always kept, even if it alone exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[
+            str, tuple[SpamClassifier, ModelMetadata, int]
+        ] = OrderedDict()
+        self.hits = self.misses = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(size for _, _, size in self._entries.values())
+
+    def get(
+        self, model_id: str, model_registry_root: pathlib.Path
+    ) -> tuple[SpamClassifier, ModelMetadata]:
+        # Metadata is cheap to look up, and may have changed since the model was cached.
+        metadata = load_metadata(model_id, model_registry_root)
+        if model_id in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(model_id)
+            classifier, _, size = self._entries[model_id]
+            self._entries[model_id] = (classifier, metadata, size)
+            return classifier, metadata
+
+        self.misses += 1
+        classifier = _load_classifier(model_id, metadata, model_registry_root)
+        size = model_storage.model_size_bytes(
+            sha256_hash=model_id, destination_root=model_registry_root
+        )
+        self._entries[model_id] = (classifier, metadata, size)
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries
+            or self.size_bytes > self.max_bytes
+        ):
+            self._entries.popitem(last=False)
+        return classifier, metadata
 
-    metadata = ModelMetadata.from_dict(registry_data[model_id])
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+model_cache = ModelCache(
+    max_entries=config.MODEL_CACHE_MAX_ENTRIES,
+    max_bytes=config.MODEL_CACHE_MAX_BYTES,
+)
+
+
+def _load_classifier(
+    model_id: str, metadata: ModelMetadata, model_registry_root: pathlib.Path
+) -> SpamClassifier:
     m: SpamModel
     if metadata.impl_name == "bert-base-cased":
         m = LLM()
@@ -48,11 +121,27 @@ def load_model(model_id: str):
     else:
         raise ValueError(f"Loading '{metadata.impl_name}' not yet supported.")
 
-    classifier = m.load(
+    return m.load(
         sha256_digest=model_id,
-        model_registry_root=config.MODEL_STORE_DIR,
+        model_registry_root=model_registry_root,
     )
-    return classifier, metadata
+
+
+def load_model(
+    model_id: str, model_registry_root: pathlib.Path = config.MODEL_STORE_DIR
+) -> tuple[SpamClassifier, ModelMetadata]:
+    return model_cache.get(model_id, model_registry_root)
+
+
+def classify_many(
+    classifier: SpamClassifier, emails: list[str]
+) -> list[Prediction]:
+    """Classifies emails using the classifier's batch API, if it has one."""
+    if hasattr(classifier, "classify_batch"):
+        return classifier.classify_batch(emails)
+    if hasattr(classifier, "predict_many"):
+        return classifier.predict_many(emails)
+    return [classifier(email) for email in emails]
 
 
 def tokenize(text: str) -> set[str]:
@@ -101,23 +190,68 @@ class LLMSpamClassifier:
     def __init__(self, tokenizer, model) -> None:
         self.tokenizer = tokenizer
         self.model = model
-
-    def __call__(self, email: str) -> Prediction:
-        """Ensures this class-based classifier can be used just like a function-based classifer."""
+        self.device = next(model.parameters()).device
+        self.spam_id = model.config.label2id["SPAM"]
+        self.model.eval()
+
+    def quantized(self) -> "LLMSpamClassifier":
+        """
+        Returns a copy of this classifier with int8 dynamically quantized linear layers,
+        for faster inference on CPU-only containers.
+        """
         import torch
 
-        inputs = self.tokenizer(email, return_tensors="pt")
-        with torch.no_grad():
-            logits = self.model(**inputs).logits
+        if self.device.type != "cpu":
+            raise ValueError("dynamic quantization is only supported on CPU.")
+        quantized_model = torch.quantization.quantize_dynamic(
+            self.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        return LLMSpamClassifier(
+            tokenizer=self.tokenizer, model=quantized_model
+        )
 
-        predicted_class_id = logits.argmax().item()
-        spam_id = self.model.config.label2id["SPAM"]
-        spam_score = logits[0][spam_id]
-        predicted_label: str = self.model.config.id2label[predicted_class_id]
-        return Prediction(
-            spam=bool(predicted_label == "SPAM"),
-            score=spam_score,
+    def classify_batch(
+        self, emails: list[str], batch_size: int = 32
+    ) -> list[Prediction]:
+        """
+        Classifies many emails at once.
+
+        Emails are sorted by token length and split into batches which are each padded
+        only to their own longest email, so little compute is spent on padding tokens.
+        """
+        import torch
+
+        encodings = self.tokenizer(emails, truncation=True)
+        order = sorted(
+            range(len(emails)), key=lambda i: len(encodings["input_ids"][i])
         )
+        predictions: list[Optional[Prediction]] = [None] * len(emails)
+        for start in range(0, len(order), batch_size):
+            batch_idxs = order[start : start + batch_size]
+            batch = self.tokenizer.pad(
+                {
+                    key: [encodings[key][i] for i in batch_idxs]
+                    for key in encodings
+                },
+                return_tensors="pt",
+            ).to(self.device)
+            with torch.inference_mode():
+                logits = self.model(**batch).logits
+            predicted_class_ids = logits.argmax(dim=-1).tolist()
+            spam_scores = logits[:, self.spam_id].tolist()
+            for i, class_id, spam_score in zip(
+                batch_idxs, predicted_class_ids, spam_scores
+            ):
+                predicted_label: str = self.model.config.id2label[class_id]
+                predictions[i] = Prediction(
+                    spam=bool(predicted_label == "SPAM"),
+                    score=spam_score,
+                )
+        return cast(list[Prediction], predictions)
+
+    def __call__(self, email: str) -> Prediction:
+        """Ensures this class-based classifier can be used just like a function-based classifer."""
+        return self.classify_batch([email])[0]
 
 
 def train_llm_classifier(
@@ -128,6 +262,7 @@ def train_llm_classifier(
     from transformers import (
         AutoModelForSequenceClassification,
         AutoTokenizer,
+        DataCollatorWithPadding,
         Trainer,
         TrainingArguments,
     )
@@ -141,9 +276,8 @@ def train_llm_classifier(
     tokenizer = AutoTokenizer.from_pretrained("bert-base-cased")
 
     def tokenize_function(examples):
-        return tokenizer(
-            examples["text"], padding="max_length", truncation=True
-        )
+        # Padding is done per batch by the data collator, to each batch's longest example.
+        return tokenizer(examples["text"], truncation=True)
 
     tokenized_datasets = huggingface_dataset.map(
         tokenize_function, batched=True
@@ -180,6 +314,7 @@ def train_llm_classifier(
         args=training_args,
         train_dataset=small_train_dataset,
         eval_dataset=small_eval_dataset,
+        data_collator=DataCollatorWithPadding(tokenizer),
         compute_metrics=compute_metrics,
     )
 
@@ -227,6 +362,7 @@ class LLM(SpamModel):
     def load(
         self, sha256_digest: str, model_registry_root: pathlib.Path
     ) -> SpamClassifier:
+        import torch
         from transformers import (
             AutoModelForSequenceClassification,
             AutoTokenizer,
@@ -236,10 +372,15 @@ class LLM(SpamModel):
         model_path = model_registry_root / sha256_digest
         model = AutoModelForSequenceClassification.from_pretrained(model_path)
         tokenizer = AutoTokenizer.from_pretrained(LLM.model_name)
-        return LLMSpamClassifier(
-            tokenizer=tokenizer,
-            model=model,
-        )
+        if torch.cuda.is_available():
+            return LLMSpamClassifier(
+                tokenizer=tokenizer, model=model.to("cuda")
+            )
+        classifier = LLMSpamClassifier(tokenizer=tokenizer, model=model)
+        if config.LLM_INT8_ON_CPU:
+            # Trade a little accuracy for much faster CPU inference.
+            return classifier.quantized()
+        return classifier
 
     def save(
         self,
@@ -345,6 +486,417 @@ class BadWords(SpamModel):
         return accuracy, precision
 
 
+class TokenCounts:
+    """
+    Per-token document counts for spam and ham examples.
+
+    Tokens are interned into a list, with counts held in compact arrays at
+    the token's index, so that shards of counts are cheap to send between
+    processes and merge.
+    """
+
+    def __init__(self) -> None:
+        self.tokens: list[str] = []
+        self.index: dict[str, int] = {}
+        self.spam_counts = array("L")
+        self.ham_counts = array("L")
+        self.spam_messages = 0
+        self.ham_messages = 0
+
+    def _intern(self, token: str) -> int:
+        i = self.index.get(token)
+        if i is None:
+            i = self.index[token] = len(self.tokens)
+            self.tokens.append(token)
+            self.spam_counts.append(0)
+            self.ham_counts.append(0)
+        return i
+
+    def add(self, example: Example) -> None:
+        counts = self.spam_counts if example.spam else self.ham_counts
+        if example.spam:
+            self.spam_messages += 1
+        else:
+            self.ham_messages += 1
+        for token in tokenize(example.email):
+            counts[self._intern(token)] += 1
+
+    def merge(self, other: "TokenCounts") -> None:
+        for token, spam, ham in zip(
+            other.tokens, other.spam_counts, other.ham_counts
+        ):
+            i = self._intern(token)
+            self.spam_counts[i] += spam
+            self.ham_counts[i] += ham
+        self.spam_messages += other.spam_messages
+        self.ham_messages += other.ham_messages
+
+    def __getstate__(self):
+        # The index is rebuilt on unpickling rather than sent between processes.
+        return (
+            self.tokens,
+            self.spam_counts,
+            self.ham_counts,
+            self.spam_messages,
+            self.ham_messages,
+        )
+
+    def __setstate__(self, state) -> None:
+        (
+            self.tokens,
+            self.spam_counts,
+            self.ham_counts,
+            self.spam_messages,
+            self.ham_messages,
+        ) = state
+        self.index = {token: i for i, token in enumerate(self.tokens)}
+
+
+def _count_shard(shard: list[Example]) -> TokenCounts:
+    counts = TokenCounts()
+    for example in shard:
+        counts.add(example)
+    return counts
+
+
+def _shards(
+    examples: Iterable[Example], shard_size: int
+) -> Iterator[list[Example]]:
+    it = iter(examples)
+    while shard := list(itertools.islice(it, shard_size)):
+        yield shard
+
+
+def _holdout_every_nth(
+    examples: Iterable[Example], *, test_set_size: float, holdout: list[Example]
+) -> Iterator[Example]:
+    n = round(1 / test_set_size) if test_set_size > 0 else 0
+    for i, example in enumerate(examples):
+        if n and i % n == n - 1:
+            holdout.append(example)
+        else:
+            yield example
+
+
+def count_tokens(
+    examples: Iterable[Example],
+    *,
+    num_workers: Optional[int] = None,
+    shard_size: int = 2_000,
+) -> TokenCounts:
+    """
+    Counts token occurrences over a (possibly streamed) collection of examples.
+
+    Examples are split into shards which are tokenized and counted in a process pool
+    and merged as they complete. At most a couple of shards per worker are in flight
+    at once, so memory use is bounded even if `examples` is a lazy iterator over a
+    corpus which doesn't fit in memory.
+    """
+    import concurrent.futures
+
+    num_workers = num_workers or os.cpu_count() or 1
+    shards = _shards(examples, shard_size)
+    first = next(shards, [])
+    second = next(shards, None)
+    if num_workers == 1 or second is None:
+        counts = _count_shard(first)
+        for shard in itertools.chain([second] if second else [], shards):
+            counts.merge(_count_shard(shard))
+        return counts
+
+    counts = TokenCounts()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=num_workers
+    ) as pool:
+        pending = {
+            pool.submit(_count_shard, first),
+            pool.submit(_count_shard, second),
+        }
+        for shard in shards:
+            if len(pending) >= 2 * num_workers:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    counts.merge(future.result())
+            pending.add(pool.submit(_count_shard, shard))
+        for future in concurrent.futures.as_completed(pending):
+            counts.merge(future.result())
+    return counts
+
+
+class CalibrationTable(NamedTuple):
+    """Precision and recall of a classifier at each candidate decision boundary."""
+
+    # Ascending, one per distinct score.
+    thresholds: list[float]
+    precisions: list[float]
+    recalls: list[float]
+
+    def to_csv(self) -> str:
+        rows = ["threshold,precision,recall"]
+        rows.extend(
+            f"{t!r},{p!r},{r!r}"
+            for t, p, r in zip(self.thresholds, self.precisions, self.recalls)
+        )
+        return "\n".join(rows) + "\n"
+
+
+def precision_recall_table(y_true, y_scores) -> CalibrationTable:
+    """
+    Equivalent to sklearn's `precision_recall_curve`, computed with one sort
+    and cumulative true/false positive sums so that it stays fast on large
+    evaluation sets without rounding the scores.
+    """
+    import numpy as np
+
+    y_true = np.asarray(y_true)
+    y_scores = np.asarray(y_scores, dtype=np.float64)
+    order = np.argsort(y_scores, kind="mergesort")[::-1]
+    y_scores = y_scores[order]
+    y_true = y_true[order]
+    # Keep the last index of each run of equal scores, so that every threshold
+    # counts all examples scoring at or above it as positive.
+    distinct_idxs = np.nonzero(np.diff(y_scores))[0]
+    threshold_idxs = np.r_[distinct_idxs, len(y_scores) - 1]
+    tps = np.cumsum(y_true)[threshold_idxs]
+    fps = 1 + threshold_idxs - tps
+    precisions = tps / (tps + fps)
+    recalls = tps / tps[-1] if tps[-1] > 0 else np.zeros_like(precisions)
+    return CalibrationTable(
+        thresholds=y_scores[threshold_idxs][::-1].tolist(),
+        precisions=precisions[::-1].tolist(),
+        recalls=recalls[::-1].tolist(),
+    )
+
+
+class HashedVocab:
+    """
+    Read-only token to index mapping laid out in flat arrays, so that it can be
+    memory-mapped straight from a model artifact instead of rebuilt as a dict.
+
+    Token `i` is the UTF-8 bytes `blob[offsets[i]:offsets[i + 1]]`. `table` is an
+    open-addressing hash table, with linear probing on the crc32 of the token,
+    holding `i + 1` for each token and 0 in empty slots.
+    """
+
+    def __init__(
+        self,
+        blob: Union[bytes, bytearray, memoryview],
+        offsets: Sequence[int],
+        table: Sequence[int],
+    ) -> None:
+        self.blob = memoryview(blob)
+        self.offsets = offsets
+        self.table = table
+        self.mask = len(table) - 1
+
+    @classmethod
+    def build(cls, tokens: Sequence[str]) -> "HashedVocab":
+        blob = bytearray()
+        offsets = array("Q", [0])
+        for token in tokens:
+            blob += token.encode()
+            offsets.append(len(blob))
+        # A power of two at least twice the vocabulary size keeps probe chains short.
+        table = array(
+            "I", bytes(4 * (1 << max(1, 2 * len(tokens) - 1).bit_length()))
+        )
+        mask = len(table) - 1
+        for i, token in enumerate(tokens):
+            slot = zlib.crc32(token.encode()) & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            table[slot] = i + 1
+        return cls(blob=blob, offsets=offsets, table=table)
+
+    def get(self, token: str) -> Optional[int]:
+        key = token.encode()
+        slot = zlib.crc32(key) & self.mask
+        while entry := self.table[slot]:
+            i = entry - 1
+            if self.blob[self.offsets[i] : self.offsets[i + 1]] == key:
+                return i
+            slot = (slot + 1) & self.mask
+        return None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+class NaiveBayesSpamClassifier:
+    """
+    SpamClassifier holding a compiled Naive-Bayes model.
+
+    Per-token log-probabilities of a token being present, log(p), and absent,
+    log(1 - p), are precomputed at training time, as is the baseline score of
+    an email containing no vocabulary tokens at all. Scoring an email then only
+    touches the email's own tokens, rather than the whole training vocabulary.
+    """
+
+    def __init__(
+        self,
+        vocab: Union[dict[str, int], HashedVocab],
+        log_p_spam: Sequence[float],
+        log_q_spam: Sequence[float],
+        log_p_ham: Sequence[float],
+        log_q_ham: Sequence[float],
+        decision_boundary: float = 0.5,
+        spam_baseline: Optional[float] = None,
+        ham_baseline: Optional[float] = None,
+    ) -> None:
+        self.vocab = vocab
+        self.log_p_spam = log_p_spam
+        self.log_q_spam = log_q_spam
+        self.log_p_ham = log_p_ham
+        self.log_q_ham = log_q_ham
+        self.decision_boundary = decision_boundary
+        # Log-probability of an email in which every vocabulary token is absent.
+        self.spam_baseline = (
+            math.fsum(log_q_spam) if spam_baseline is None else spam_baseline
+        )
+        self.ham_baseline = (
+            math.fsum(log_q_ham) if ham_baseline is None else ham_baseline
+        )
+
+    @classmethod
+    def from_counts(
+        cls,
+        counts: "TokenCounts",
+        *,
+        k: float,
+        decision_boundary: float = 0.5,
+    ) -> "NaiveBayesSpamClassifier":
+        # Sorted so that the serialized model, and thus its hash, is deterministic.
+        order = sorted(range(len(counts.tokens)), key=counts.tokens.__getitem__)
+        log_p_spam, log_q_spam = array("d"), array("d")
+        log_p_ham, log_q_ham = array("d"), array("d")
+        for i in order:
+            prob_if_spam = (counts.spam_counts[i] + k) / (
+                counts.spam_messages + 2 * k
+            )
+            prob_if_ham = (counts.ham_counts[i] + k) / (
+                counts.ham_messages + 2 * k
+            )
+            log_p_spam.append(math.log(prob_if_spam))
+            log_q_spam.append(math.log(1.0 - prob_if_spam))
+            log_p_ham.append(math.log(prob_if_ham))
+            log_q_ham.append(math.log(1.0 - prob_if_ham))
+        return cls(
+            vocab={counts.tokens[i]: j for j, i in enumerate(order)},
+            log_p_spam=log_p_spam,
+            log_q_spam=log_q_spam,
+            log_p_ham=log_p_ham,
+            log_q_ham=log_q_ham,
+            decision_boundary=decision_boundary,
+        )
+
+    def to_artifact(self) -> tuple[dict, dict[str, Sequence]]:
+        """Splits the model into scalar header fields and flat arrays for storage."""
+        if isinstance(self.vocab, HashedVocab):
+            vocab = self.vocab
+        else:
+            tokens = sorted(self.vocab, key=self.vocab.__getitem__)
+            vocab = HashedVocab.build(tokens)
+        header = {
+            "decision_boundary": self.decision_boundary,
+            "spam_baseline": self.spam_baseline,
+            "ham_baseline": self.ham_baseline,
+        }
+        arrays = {
+            "vocab_blob": vocab.blob,
+            "vocab_offsets": vocab.offsets,
+            "vocab_table": vocab.table,
+            "log_p_spam": self.log_p_spam,
+            "log_q_spam": self.log_q_spam,
+            "log_p_ham": self.log_p_ham,
+            "log_q_ham": self.log_q_ham,
+        }
+        return header, arrays
+
+    @classmethod
+    def from_artifact(
+        cls, header: dict, arrays: Mapping[str, Any]
+    ) -> "NaiveBayesSpamClassifier":
+        return cls(
+            vocab=HashedVocab(
+                blob=arrays["vocab_blob"],
+                offsets=arrays["vocab_offsets"],
+                table=arrays["vocab_table"],
+            ),
+            log_p_spam=arrays["log_p_spam"],
+            log_q_spam=arrays["log_q_spam"],
+            log_p_ham=arrays["log_p_ham"],
+            log_q_ham=arrays["log_q_ham"],
+            decision_boundary=header["decision_boundary"],
+            spam_baseline=header["spam_baseline"],
+            ham_baseline=header["ham_baseline"],
+        )
+
+    def predict_prob(self, email: str) -> float:
+        log_prob_if_spam = self.spam_baseline
+        log_prob_if_ham = self.ham_baseline
+        for token in tokenize(email):
+            i = self.vocab.get(token)
+            if i is None:
+                continue
+            # Swap the token's 'absent' term in the baseline for its 'present' term.
+            log_prob_if_spam += self.log_p_spam[i] - self.log_q_spam[i]
+            log_prob_if_ham += self.log_p_ham[i] - self.log_q_ham[i]
+        # Equal to P(spam) / (P(spam) + P(ham)), but computed in log-space
+        # so that it doesn't underflow on emails with large vocabularies.
+        diff = log_prob_if_spam - log_prob_if_ham
+        if diff >= 0:
+            return 1.0 / (1.0 + math.exp(-diff))
+        exp_diff = math.exp(diff)
+        return exp_diff / (1.0 + exp_diff)
+
+    def predict_prob_many(self, emails: Sequence[str]):
+        """
+        Scores a batch of emails with a single sparse matrix-vector product.
+        Returns a NumPy array of spam probabilities.
+        """
+        import numpy as np
+        import scipy.sparse
+        from scipy.special import expit
+
+        indptr = [0]
+        indices: list[int] = []
+        for email in emails:
+            for token in tokenize(email):
+                i = self.vocab.get(token)
+                if i is not None:
+                    indices.append(i)
+            indptr.append(len(indices))
+        doc_term_matrix = scipy.sparse.csr_matrix(
+            (
+                np.ones(len(indices), dtype=np.float64),
+                np.array(indices, dtype=np.int64),
+                np.array(indptr, dtype=np.int64),
+            ),
+            shape=(len(emails), len(self.vocab)),
+        )
+        spam_weights = np.asarray(self.log_p_spam) - np.asarray(self.log_q_spam)
+        ham_weights = np.asarray(self.log_p_ham) - np.asarray(self.log_q_ham)
+        log_probs_if_spam = self.spam_baseline + doc_term_matrix @ spam_weights
+        log_probs_if_ham = self.ham_baseline + doc_term_matrix @ ham_weights
+        return expit(log_probs_if_spam - log_probs_if_ham)
+
+    def predict_many(self, emails: Sequence[str]) -> list[Prediction]:
+        return [
+            Prediction(spam=bool(score > self.decision_boundary), score=score)
+            for score in self.predict_prob_many(emails).tolist()
+        ]
+
+    def __call__(self, email: str) -> Prediction:
+        """Ensures this class-based classifier can be used just like a function-based classifer."""
+        score = self.predict_prob(email)
+        return Prediction(
+            spam=score > self.decision_boundary,
+            score=score,
+        )
+
+
 class NaiveBayes(SpamModel):
     """
     The classic Naive-Bayes classifier. Implementation drawn from the
@@ -356,83 +908,52 @@ class NaiveBayes(SpamModel):
         k: float = 0.5,
         decision_boundary: Optional[float] = None,
         test_set_size: float = 0.05,
+        num_workers: Optional[int] = None,
+        shard_size: int = 2_000,
     ) -> None:
         self.k = k
         self.decision_boundary = decision_boundary
         self.classify_fn: Optional[SpamClassifier] = None
         self.test_set_size = test_set_size
-
-    def train(self, dataset: Dataset) -> tuple[SpamClassifier, TrainMetrics]:
-        k = self.k
-        dataset_tokens: set[str] = set()
-        token_spam_counts: dict[str, int] = defaultdict(int)
-        token_ham_counts: dict[str, int] = defaultdict(int)
-        spam_messages = ham_messages = 0
-        test_samples = int(len(dataset) * self.test_set_size)
-        if test_samples > 0:
-            train_set = dataset[:-test_samples]
-            test_set = dataset[-test_samples:]
+        # Token counting is spread over a process pool, one shard of examples at a time.
+        self.num_workers = num_workers
+        self.shard_size = shard_size
+        # Set during training when the decision boundary is calibrated.
+        self.calibration_table: Optional[CalibrationTable] = None
+
+    def train(
+        self, dataset: Union[Dataset, Iterable[Example]]
+    ) -> tuple[SpamClassifier, TrainMetrics]:
+        train_set: Iterable[Example]
+        test_set: list[Example]
+        if isinstance(dataset, Sequence):
+            test_samples = int(len(dataset) * self.test_set_size)
+            if test_samples > 0:
+                train_set = dataset[:-test_samples]
+                test_set = list(dataset[-test_samples:])
+            else:
+                train_set = dataset
+                test_set = []
         else:
-            train_set = dataset
+            # The length of a stream is unknown up front, so instead hold out
+            # every n-th example. `test_set` fills up as `train_set` is consumed.
             test_set = []
-
-        for example in train_set:
-            if example.spam:
-                spam_messages += 1
-            else:
-                ham_messages += 1
-
-            # Increment word counts
-            for token in tokenize(example.email):
-                dataset_tokens.add(token)
-                if example.spam:
-                    token_spam_counts[token] += 1
-                else:
-                    token_ham_counts[token] += 1
-
-        print("finished building word count dicts")
-
-        def predict_prob(email: str) -> float:
-            email_tokens = tokenize(email)
-            log_prob_if_spam = log_prob_if_ham = 0.0
-
-            # Iterate through each word in our vocabulary
-            for token in dataset_tokens:
-                spam = token_spam_counts[token]
-                ham = token_ham_counts[token]
-
-                prob_if_spam = (spam + k) / (spam_messages + 2 * k)
-                prob_if_ham = (ham + k) / (ham_messages + 2 * k)
-                # If *token* appears in the message,
-                # add the log probability of seeing it
-                if token in email_tokens:
-                    log_prob_if_spam += math.log(prob_if_spam)
-                    log_prob_if_ham += math.log(prob_if_ham)
-                # Otherwise add the log probability of _not_ seeing it,
-                # which is log(1 - probability of seeing it)
-                else:
-                    log_prob_if_spam += math.log(1.0 - prob_if_spam)
-                    log_prob_if_ham += math.log(1.0 - prob_if_ham)
-            prob_if_spam = math.exp(log_prob_if_spam)
-            prob_if_ham = math.exp(log_prob_if_ham)
-            score = (
-                prob_if_spam / (prob_if_spam + prob_if_ham)
-                if prob_if_spam
-                else 0.0
+            train_set = _holdout_every_nth(
+                dataset, test_set_size=self.test_set_size, holdout=test_set
             )
-            return score
-
-        def make_classifier(
-            prob_fn, decision_boundary: float
-        ) -> SpamClassifier:
-            def inner(email: str):
-                score = prob_fn(email)
-                return Prediction(
-                    spam=score > decision_boundary,
-                    score=score,
-                )
 
-            return inner
+        counts = count_tokens(
+            train_set,
+            num_workers=self.num_workers,
+            shard_size=self.shard_size,
+        )
+        print(
+            f"finished counting {len(counts.tokens)} tokens in "
+            f"{counts.spam_messages + counts.ham_messages} examples"
+        )
+
+        print("compiling classifier")
+        classifier = NaiveBayesSpamClassifier.from_counts(counts, k=self.k)
 
         if self.decision_boundary:
             decision_boundary, precision, recall = (
@@ -443,9 +964,10 @@ class NaiveBayes(SpamModel):
         else:
             print("setting decision boundary for binary classifier")
             decision_boundary, precision, recall = self._set_decision_boundary(
-                prob_fn=predict_prob,
+                classifier=classifier,
                 test_dataset=test_set,
             )
+        classifier.decision_boundary = decision_boundary
 
         metrics = TrainMetrics(
             dataset_id="enron",
@@ -454,16 +976,24 @@ class NaiveBayes(SpamModel):
             precision=precision,
             recall=recall,
         )
-        print("making classifier")
-        return make_classifier(predict_prob, decision_boundary), metrics
+        return classifier, metrics
 
     def load(
         self, sha256_digest: str, model_registry_root: pathlib.Path
     ) -> SpamClassifier:
-        return model_storage.load_pickle_serialized_model(
+        if not model_storage.is_array_model(
+            sha256_hash=sha256_digest, destination_root=model_registry_root
+        ):
+            # Models saved before the array format were pickled.
+            return model_storage.load_pickle_serialized_model(
+                sha256_hash=sha256_digest,
+                destination_root=model_registry_root,
+            )
+        header, arrays = model_storage.load_array_model(
             sha256_hash=sha256_digest,
             destination_root=model_registry_root,
         )
+        return NaiveBayesSpamClassifier.from_artifact(header, arrays)
 
     def save(
         self,
@@ -472,46 +1002,63 @@ class NaiveBayes(SpamModel):
         model_registry_root: pathlib.Path,
         git_commit_hash: str,
     ) -> str:
-        return model_storage.store_pickleable_model(
-            classifier_func=fn,
+        classifier = cast(NaiveBayesSpamClassifier, fn)
+        header, arrays = classifier.to_artifact()
+        model_id = model_storage.store_array_model(
+            header=header,
+            arrays=arrays,
+            impl_name=model_storage.model_name_from_function(classifier),
             metrics=metrics,
             model_destination_root=model_registry_root,
             current_git_commit_hash=git_commit_hash,
         )
+        if self.calibration_table is not None:
+            model_storage.store_model_artifact(
+                sha256_hash=model_id,
+                artifact_name="calibration.csv",
+                content=self.calibration_table.to_csv().encode(),
+                destination_root=model_registry_root,
+            )
+        return model_id
 
     def _set_decision_boundary(
-        self, prob_fn, test_dataset
+        self, classifier: NaiveBayesSpamClassifier, test_dataset: Dataset
     ) -> tuple[float, float, float]:
         import numpy as np
-        from sklearn.metrics import precision_recall_curve
 
+        if len(test_dataset) == 0:
+            raise ValueError("Calibration dataset cannot be empty.")
         print(
-            f"Using {len(test_dataset)} test dataset examples to set decision boundary.\n"
-            "Warning: this is a slow operation that takes ~15 minutes."
+            f"Using {len(test_dataset)} test dataset examples to set decision boundary."
         )
 
         minimum_acceptable_precision = (
             0.98  # ie. 2 in a 100 legit emails get marked as spam.
         )
         y_true = np.array([1 if ex.spam else 0 for ex in test_dataset])
-        # scores are rounded because curve calculation time scales quickly in dim U, where U is number of unique scores.
-        # NB: The precision-recall curve calculation is extremely slow on N ~10k+
-        y_scores = np.array(
-            [round(prob_fn(ex.email), ndigits=2) for ex in test_dataset]
+        y_scores = classifier.predict_prob_many(
+            [ex.email for ex in test_dataset]
         )
-        # TODO: Optimize this very slow process.
-        precisions, recalls, thresholds = precision_recall_curve(
-            y_true, y_scores
+        table = precision_recall_table(y_true, y_scores)
+        self.calibration_table = table
+        # Thresholds are ascending, so the first threshold reaching the minimum
+        # precision is the one with the best recall.
+        (reached,) = np.nonzero(
+            np.asarray(table.precisions) >= minimum_acceptable_precision
         )
-        for p, r, thres in zip(precisions, recalls, thresholds):
+        i = int(reached[0]) if len(reached) else len(table.thresholds) - 1
+        thres, p, r = table.thresholds[i], table.precisions[i], table.recalls[i]
+        if len(reached):
             print(
-                "Using threshold={} as decision boundary, we reach precision={} and recall={}".format(
-                    thres, p, r
-                )
+                f"Reached {minimum_acceptable_precision=} at threshold {thres}. Setting that as boundary."
             )
-            if p >= minimum_acceptable_precision:
-                print(
-                    f"Reached {minimum_acceptable_precision=} at threshold {thres}. Setting that as boundary."
-                )
-                break
+        else:
+            print(
+                f"Could not reach {minimum_acceptable_precision=}. Using highest threshold {thres}."
+            )
+        print(
+            "Using threshold={} as decision boundary, we reach precision={} and recall={}".format(
+                thres, p, r
+            )
+        )
         return thres, p, r
@@ -9,6 +9,7 @@ from pydantic import BaseModel
 
 from . import config, models
 from .app import stub, volume
+from .batching import MicroBatcher
 
 web_app = FastAPI()
 
@@ -40,15 +41,45 @@ class Model:
 
     @modal.method()
     def generate(self, text: str) -> ModelOutput:
-        prediction = self.classifier(text)
-        return ModelOutput(
-            spam=prediction.spam,
-            score=prediction.score,
-            metadata=ModelMetdata(
-                model_name=self.metadata.impl_name,
-                model_id=self.model_id,
-            ),
+        return self._generate([text])[0]
+
+    @modal.method()
+    def generate_batch(self, texts: list[str]) -> list[ModelOutput]:
+        return self._generate(texts)
+
+    def _generate(self, texts: list[str]) -> list[ModelOutput]:
+        predictions = models.classify_many(self.classifier, texts)
+        metadata = ModelMetdata(
+            model_name=self.metadata.impl_name,
+            model_id=self.model_id,
         )
+        return [
+            ModelOutput(
+                spam=prediction.spam,
+                score=prediction.score,
+                metadata=metadata,
+            )
+            for prediction in predictions
+        ]
+
+
+# One micro-batcher per model, living for as long as the web container.
+batchers: dict[str, MicroBatcher[str, ModelOutput]] = {}
+
+
+def get_batcher(model_id: str) -> MicroBatcher[str, ModelOutput]:
+    if model_id not in batchers:
+        model = Model(model_id)
+
+        async def dispatch(texts: list[str]):
+            return await model.generate_batch.remote.aio(texts)
+
+        batchers[model_id] = MicroBatcher(
+            dispatch,
+            max_batch_size=config.SERVING_MAX_BATCH_SIZE,
+            max_wait_s=config.SERVING_BATCH_WAIT_MS / 1_000,
+        )
+    return batchers[model_id]
 
 
 @web_app.get("/api/v1/models")
@@ -56,7 +87,7 @@ async def handle_list_models():
     """
     Show details of actively serving models.
     """
-    _, metadata = models.load_model(config.SERVING_MODEL_ID)
+    metadata = models.load_metadata(config.SERVING_MODEL_ID)
     return {config.SERVING_MODEL_ID: metadata.serialize()}
 
 
@@ -77,9 +108,16 @@ async def handle_classification(
     ```
     """
     model_id = model_id or config.SERVING_MODEL_ID
-    print(model_id)
-    model = Model(model_id)
-    return model.generate.remote(input_.text)
+    return await get_batcher(model_id).submit(input_.text)
+
+
+@web_app.get("/api/v1/batching")
+async def handle_batching_stats():
+    """
+    Show queue depth, batch size and latency histograms of the request micro-batchers,
+    for tuning `SERVING_BATCH_WAIT_MS` and `SERVING_MAX_BATCH_SIZE`.
+    """
+    return {model_id: batcher.stats() for model_id, batcher in batchers.items()}
 
 
 @stub.function()
@@ -18,7 +18,6 @@
 #
 
 import pathlib
-import random
 import subprocess
 from datetime import timedelta
 
@@ -90,6 +89,16 @@ def prep_dataset():
     volume.commit()  # Persist changes
 
 
+@stub.function(
+    timeout=int(timedelta(minutes=8).total_seconds()),
+    volumes={config.VOLUME_DIR: volume},
+)
+def convert_dataset():
+    """Converts a dataset prepared in the legacy all.json format to the columnar format."""
+    dataset.convert_legacy_json_dataset(base=config.DATA_DIR)
+    volume.commit()  # Persist changes
+
+
 @stub.function(
     volumes={config.VOLUME_DIR: volume},
     secrets=[modal.Secret.from_dict({"PYTHONHASHSEED": "10"})],
@@ -99,8 +108,7 @@ def train(
     model: models.SpamModel, dataset_path: pathlib.Path, git_commit_hash: str
 ):
     logger = config.get_logger()
-    enron_dataset = dataset.deserialize_dataset(dataset_path)
-    random.shuffle(enron_dataset)
+    enron_dataset = dataset.load_dataset(dataset_path).shuffled()
     classifier, metrics = model.train(enron_dataset)
     model_id = model.save(
         fn=classifier,
@@ -130,8 +138,7 @@ def train_gpu(
     model: models.SpamModel, dataset_path: pathlib.Path, git_commit_hash: str
 ):
     logger = config.get_logger()
-    enron_dataset = dataset.deserialize_dataset(dataset_path)
-    random.shuffle(enron_dataset)
+    enron_dataset = dataset.load_dataset(dataset_path).shuffled()
     classifier, metrics = model.train(enron_dataset)
     model_id = model.save(
         fn=classifier,
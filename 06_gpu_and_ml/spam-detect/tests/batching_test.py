@@ -0,0 +1,52 @@
+import asyncio
+
+from spam_detect.batching import Histogram, MicroBatcher
+
+
+def test_micro_batcher_batches_concurrent_requests():
+    dispatched: list[list[int]] = []
+
+    async def dispatch(items: list[int]) -> list[int]:
+        dispatched.append(items)
+        await asyncio.sleep(0)
+        return [item * 10 for item in items]
+
+    async def main():
+        batcher: MicroBatcher[int, int] = MicroBatcher(
+            dispatch, max_batch_size=4, max_wait_s=0.05
+        )
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+        return batcher, results
+
+    batcher, results = asyncio.run(main())
+    # Every caller gets its own result back.
+    assert results == [i * 10 for i in range(10)]
+    assert [len(batch) for batch in dispatched] == [4, 4, 2]
+    assert batcher.stats()["batch_size"]["total"] == 3
+    assert batcher.stats()["latency_ms"]["total"] == 10
+
+
+def test_micro_batcher_propagates_errors():
+    async def dispatch(items: list[int]) -> list[int]:
+        raise ValueError("model exploded")
+
+    async def main():
+        batcher: MicroBatcher[int, int] = MicroBatcher(
+            dispatch, max_batch_size=2, max_wait_s=0.01
+        )
+        return await asyncio.gather(
+            batcher.submit(1), batcher.submit(2), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_histogram_quantile():
+    h = Histogram([1, 2, 4, 8])
+    for value in [1, 1, 2, 3, 7, 100]:
+        h.observe(value)
+    assert h.counts == [2, 1, 1, 1, 1]
+    assert h.quantile(0.5) == 2
+    assert h.quantile(0.99) == float("inf")
+    assert Histogram([1]).quantile(0.5) == 0.0
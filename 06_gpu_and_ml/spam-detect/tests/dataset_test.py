@@ -0,0 +1,116 @@
+import pytest
+from spam_detect import dataset
+from spam_detect.dataset import Example
+
+EXAMPLES = [
+    Example(email="hello world", spam=False),
+    Example(email="", spam=True),
+    Example(email="ünïcödé ✉️", spam=True),
+    Example(email="meeting at 10am", spam=False),
+]
+
+
+def test_store_roundtrip(tmp_path):
+    path = tmp_path / "all"
+    n = dataset.write_dataset(iter(EXAMPLES), dest=path)
+    assert n == len(EXAMPLES)
+
+    store = dataset.load_dataset(path)
+    assert len(store) == len(EXAMPLES)
+    assert list(store) == EXAMPLES
+    assert store[2] == EXAMPLES[2]
+    assert store[-1] == EXAMPLES[-1]
+    assert list(store[1:3]) == EXAMPLES[1:3]
+    with pytest.raises(IndexError):
+        store[len(EXAMPLES)]
+
+
+def test_store_shuffle_and_chunks(tmp_path):
+    path = tmp_path / "all"
+    dataset.write_dataset(EXAMPLES * 5, dest=path)
+    store = dataset.load_dataset(path)
+
+    shuffled = store.shuffled(seed=42)
+    assert len(shuffled) == len(store)
+    assert sorted(shuffled) == sorted(store)
+    assert list(shuffled) == list(store.shuffled(seed=42))
+    assert list(shuffled[:-3]) + list(shuffled[-3:]) == list(shuffled)
+
+    chunks = list(shuffled.iter_chunks(chunk_size=6))
+    assert [len(c) for c in chunks] == [6, 6, 6, 2]
+    assert [ex for c in chunks for ex in c] == list(shuffled)
+
+
+def test_rewrite_replaces_dataset(tmp_path):
+    path = tmp_path / "all"
+    dataset.write_dataset(EXAMPLES, dest=path)
+    dataset.write_dataset(EXAMPLES[:2], dest=path)
+    assert list(dataset.load_dataset(path)) == EXAMPLES[:2]
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_failed_write_leaves_no_dataset(tmp_path):
+    path = tmp_path / "all"
+
+    def examples():
+        yield EXAMPLES[0]
+        raise RuntimeError("interrupted")
+
+    with pytest.raises(RuntimeError):
+        dataset.write_dataset(examples(), dest=path)
+    assert not path.exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_convert_legacy_json_dataset(tmp_path):
+    legacy_path = dataset.legacy_json_dataset_path(tmp_path)
+    legacy_path.parent.mkdir(parents=True)
+    legacy_path.write_text(
+        '[["hello world", false], ["buy now", true]]', encoding="utf-8"
+    )
+    dataset.convert_legacy_json_dataset(base=tmp_path)
+    store = dataset.load_dataset(dataset.dataset_path(tmp_path))
+    assert list(store) == [
+        Example(email="hello world", spam=False),
+        Example(email="buy now", spam=True),
+    ]
+
+
+def test_ingest_drops_duplicates(tmp_path):
+    pytest.importorskip("numpy")
+    import csv
+    import logging
+
+    body = " ".join(f"word{i}" for i in range(200))
+    rows = [
+        ("spam", "win money", body),
+        # Exact duplicate, modulo case and whitespace.
+        ("spam", "WIN  money", body),
+        # Near-duplicate: one word of 200 changed.
+        ("spam", "win money", body.replace("word100", "word100x")),
+        ("ham", "lunch", "see you at noon"),
+        ("ham", "report", "the quarterly report is attached"),
+    ]
+    csv_path = tmp_path / "enron.csv"
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Subject", "Message", "Spam/Ham"])
+        for label, subject, message in rows:
+            writer.writerow([subject, message, label])
+
+    dest = tmp_path / "all"
+    stats = dataset.ingest(
+        csv_path, dest=dest, logger=logging.getLogger(), chunk_size=2
+    )
+    store = dataset.load_dataset(dest)
+    assert [ex.email for ex in store] == [
+        "win money " + body,
+        "lunch see you at noon",
+        "report the quarterly report is attached",
+    ]
+    assert [(s.name, s.items_in, s.items_out) for s in stats] == [
+        ("read-csv", 5, 5),
+        ("exact-dedup", 5, 4),
+        ("near-dedup", 4, 3),
+        ("write", 3, 3),
+    ]
@@ -0,0 +1,97 @@
+import json
+import threading
+
+import pytest
+from spam_detect import config
+from spam_detect.model_registry import (
+    ModelMetadata,
+    TrainMetrics,
+    open_registry,
+)
+
+
+def metadata(impl_name, save_date, precision=None):
+    return ModelMetadata(
+        impl_name=impl_name,
+        save_date=save_date,
+        git_commit_hash="TEST-NOT-REALLY-A-COMMIT-HASH",
+        metrics=TrainMetrics(
+            dataset_id="enron", eval_set_size=10, precision=precision
+        )
+        if precision is not None
+        else None,
+    )
+
+
+def test_put_get_and_query(tmp_path):
+    registry = open_registry(tmp_path)
+    registry.put(
+        "sha256.A", metadata("NaiveBayes", "01-01-2023 10:00:00", 0.99)
+    )
+    registry.put(
+        "sha256.B", metadata("NaiveBayes", "03-01-2023 10:00:00", 0.90)
+    )
+    registry.put(
+        "sha256.C", metadata("NaiveBayes", "02-01-2023 10:00:00", 0.985)
+    )
+    registry.put("sha256.D", metadata("bert-base-cased", "04-01-2023 10:00:00"))
+
+    assert registry.get("sha256.A") == metadata(
+        "NaiveBayes", "01-01-2023 10:00:00", 0.99
+    )
+    assert registry.get("sha256.D").metrics is None
+    assert registry.get("sha256.MISSING") is None
+
+    newest = registry.query(impl_name="NaiveBayes", min_precision=0.98, limit=5)
+    assert [model_id for model_id, _ in newest] == ["sha256.C", "sha256.A"]
+    assert [model_id for model_id, _ in registry.query(limit=2)] == [
+        "sha256.D",
+        "sha256.B",
+    ]
+
+
+def test_put_conflicting_impl_raises(tmp_path):
+    registry = open_registry(tmp_path)
+    registry.put("sha256.A", metadata("NaiveBayes", "01-01-2023 10:00:00"))
+    with pytest.raises(RuntimeError):
+        registry.put("sha256.A", metadata("BadWords", "01-01-2023 10:00:00"))
+    assert registry.get("sha256.A").impl_name == "NaiveBayes"
+
+
+def test_legacy_json_registry_is_imported(tmp_path):
+    legacy = {
+        "sha256.A": metadata(
+            "NaiveBayes", "01-01-2023 10:00:00", 0.99
+        ).serialize(),
+        "sha256.B": metadata(
+            "bert-base-cased", "02-01-2023 10:00:00"
+        ).serialize(),
+    }
+    (tmp_path / config.MODEL_REGISTRY_FILENAME).write_text(json.dumps(legacy))
+    registry = open_registry(tmp_path)
+    assert {
+        model_id: m.serialize()
+        for model_id, m in registry.list_models().items()
+    } == legacy
+
+
+def test_concurrent_writers_do_not_clobber(tmp_path):
+    open_registry(tmp_path).close()
+
+    def save_models(worker: int):
+        registry = open_registry(tmp_path)
+        for i in range(20):
+            registry.put(
+                f"sha256.{worker}-{i}",
+                metadata("NaiveBayes", "01-01-2023 10:00:00"),
+            )
+        registry.close()
+
+    threads = [
+        threading.Thread(target=save_models, args=(w,)) for w in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(open_registry(tmp_path).list_models()) == 80
@@ -68,3 +68,56 @@ def test_load_model_corrupted_data(tmp_path):
             sha256_hash=bogus_hash,
             destination_root=tmp_path,
         )
+
+
+def test_array_model_roundtrip(tmp_path):
+    from array import array
+
+    arrays: dict[str, model_storage.ArrayLike] = {
+        "bytes": b"abc",
+        "ints": array("Q", [1, 2, 3]),
+        "floats": array("d", [0.5, -1.25]),
+    }
+    digest = model_storage.store_array_model(
+        header={"decision_boundary": 0.5},
+        arrays=arrays,
+        impl_name="dummy",
+        metrics=None,
+        model_destination_root=tmp_path,
+        current_git_commit_hash="TEST-NOT-REALLY-A-COMMIT-HASH",
+    )
+    model_path = tmp_path / digest
+    assert model_storage.create_hashtag_from_file(model_path) == digest
+    assert digest == model_storage.create_hashtag_from_bytes(
+        model_path.read_bytes()
+    )
+    assert model_storage.is_array_model(
+        sha256_hash=digest, destination_root=tmp_path
+    )
+
+    header, loaded = model_storage.load_array_model(
+        sha256_hash=digest, destination_root=tmp_path
+    )
+    assert header == {"decision_boundary": 0.5}
+    assert {name: list(view) for name, view in loaded.items()} == {
+        name: list(memoryview(arr)) for name, arr in arrays.items()
+    }
+
+
+def test_load_array_model_corrupted_data(tmp_path):
+    digest = model_storage.store_array_model(
+        header={},
+        arrays={"floats": b"12345678"},
+        impl_name="dummy",
+        metrics=None,
+        model_destination_root=tmp_path,
+        current_git_commit_hash="TEST-NOT-REALLY-A-COMMIT-HASH",
+    )
+    with open(tmp_path / digest, "r+b") as f:
+        f.seek(-1, 2)
+        f.write(b"\xff")
+
+    with pytest.raises(ValueError):
+        model_storage.load_array_model(
+            sha256_hash=digest, destination_root=tmp_path
+        )
@@ -1,5 +1,6 @@
 import math
 
+import pytest
 from spam_detect import models
 from spam_detect.dataset import Example
 
@@ -35,3 +36,187 @@ def test_prob_calculation():
     expected = p_if_spam / (p_if_spam + p_if_ham)
     residual = abs(actual - expected)
     assert residual <= 0.001
+
+
+def test_naive_bayes_predict_many_matches_single():
+    pytest.importorskip("scipy")
+    dataset = [
+        Example(email="spam rules", spam=True),
+        Example(email="buy cheap pills now", spam=True),
+        Example(email="ham rules", spam=False),
+        Example(email="hello ham", spam=False),
+    ]
+    classifier, _ = models.NaiveBayes(
+        decision_boundary=0.5, test_set_size=0.0
+    ).train(dataset)
+    assert isinstance(classifier, models.NaiveBayesSpamClassifier)
+    emails = [
+        "hello spam",
+        "cheap pills",
+        "",
+        "tokens unseen during training",
+    ]
+
+    batch_predictions = classifier.predict_many(emails)
+    for email, batch_prediction in zip(emails, batch_predictions):
+        prediction = classifier(email)
+        assert prediction.spam == batch_prediction.spam
+        assert abs(prediction.score - batch_prediction.score) <= 1e-9
+
+
+def test_precision_recall_table_matches_sklearn():
+    np = pytest.importorskip("numpy")
+    sklearn_metrics = pytest.importorskip("sklearn.metrics")
+
+    rng = np.random.default_rng(seed=42)
+    y_true = rng.integers(0, 2, size=500)
+    # Coarse scores so that many examples tie on the same threshold.
+    y_scores = np.round(rng.random(500) * 0.5 + y_true * 0.3, decimals=2)
+
+    table = models.precision_recall_table(y_true, y_scores)
+    (
+        precisions,
+        recalls,
+        thresholds,
+    ) = sklearn_metrics.precision_recall_curve(y_true, y_scores)
+    # sklearn appends a final (precision=1, recall=0) point with no threshold.
+    assert np.allclose(table.thresholds, thresholds)
+    assert np.allclose(table.precisions, precisions[:-1])
+    assert np.allclose(table.recalls, recalls[:-1])
+
+
+def test_naive_bayes_calibration_artifact(tmp_path):
+    pytest.importorskip("numpy")
+    dataset = [
+        Example(email="buy cheap pills now", spam=True),
+        Example(email="hello from the team", spam=False),
+    ] * 20
+    model = models.NaiveBayes(test_set_size=0.5)
+    classifier, metrics = model.train(dataset)
+    assert metrics.precision is not None
+    model_id = model.save(
+        fn=classifier,
+        metrics=metrics,
+        model_registry_root=tmp_path,
+        git_commit_hash="TEST-NOT-REALLY-A-COMMIT-HASH",
+    )
+    calibration_csv = (tmp_path / f"{model_id}.calibration.csv").read_text()
+    assert calibration_csv.startswith("threshold,precision,recall\n")
+
+
+def test_count_tokens_parallel_matches_serial():
+    dataset = [
+        Example(email=f"offer {i} cheap pills", spam=True) for i in range(10)
+    ] + [Example(email=f"meeting at {i} pm", spam=False) for i in range(10)]
+
+    serial = models.count_tokens(dataset, num_workers=1)
+    # Streamed from an iterator, in shards across two worker processes.
+    parallel = models.count_tokens(iter(dataset), num_workers=2, shard_size=3)
+
+    def as_dict(counts):
+        return {
+            token: (counts.spam_counts[i], counts.ham_counts[i])
+            for i, token in enumerate(counts.tokens)
+        }
+
+    assert as_dict(serial) == as_dict(parallel)
+    assert (serial.spam_messages, serial.ham_messages) == (10, 10)
+    assert (parallel.spam_messages, parallel.ham_messages) == (10, 10)
+
+
+def test_llm_classify_batch_matches_single(tmp_path):
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from spam_detect import benchmark
+
+    classifier = benchmark.tiny_bert_classifier(tmp_path)
+    emails = benchmark.synthetic_emails(10)
+    batch_predictions = classifier.classify_batch(emails, batch_size=4)
+    for email, batch_prediction in zip(emails, batch_predictions):
+        prediction = classifier(email)
+        assert prediction.spam == batch_prediction.spam
+        assert abs(prediction.score - batch_prediction.score) <= 1e-4
+
+
+def _store_naive_bayes_model(root, emails):
+    model = models.NaiveBayes(decision_boundary=0.5, test_set_size=0.0)
+    classifier, metrics = model.train(
+        [
+            Example(email=email, spam=i % 2 == 0)
+            for i, email in enumerate(emails)
+        ]
+    )
+    return model.save(
+        fn=classifier,
+        metrics=metrics,
+        model_registry_root=root,
+        git_commit_hash="TEST-NOT-REALLY-A-COMMIT-HASH",
+    )
+
+
+def test_naive_bayes_array_model_roundtrip(tmp_path):
+    emails = [
+        "win a free prize now",
+        "meeting notes attached",
+        "free money, claim your prize",
+        "lunch tomorrow?",
+        "café ünïcode prize",
+    ]
+    model_id = _store_naive_bayes_model(tmp_path, emails)
+    loaded = models.NaiveBayes().load(model_id, tmp_path)
+    assert isinstance(loaded, models.NaiveBayesSpamClassifier)
+    assert isinstance(loaded.vocab, models.HashedVocab)
+
+    trained = models.NaiveBayes(decision_boundary=0.5, test_set_size=0.0)
+    classifier, _ = trained.train(
+        [
+            Example(email=email, spam=i % 2 == 0)
+            for i, email in enumerate(emails)
+        ]
+    )
+    assert isinstance(classifier, models.NaiveBayesSpamClassifier)
+    assert isinstance(classifier.vocab, dict)
+    assert len(loaded.vocab) == len(classifier.vocab)
+    for token, i in classifier.vocab.items():
+        assert loaded.vocab.get(token) == i
+    assert loaded.vocab.get("not-in-vocab") is None
+    test_emails = emails + ["prize prize unseen words"]
+    assert [loaded(e) for e in test_emails] == [
+        classifier(e) for e in test_emails
+    ]
+    assert loaded.predict_many(test_emails) == classifier.predict_many(
+        test_emails
+    )
+
+
+def test_model_cache_lru_eviction(tmp_path, monkeypatch):
+    cache = models.ModelCache(max_entries=2, max_bytes=10**9)
+    monkeypatch.setattr(models, "model_cache", cache)
+    model_ids = [
+        _store_naive_bayes_model(tmp_path, [f"spam{i}", f"ham{i}"])
+        for i in range(3)
+    ]
+
+    first, metadata = models.load_model(model_ids[0], tmp_path)
+    assert metadata.impl_name == "NaiveBayesSpamClassifier"
+    assert models.load_model(model_ids[0], tmp_path)[0] is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    models.load_model(model_ids[1], tmp_path)
+    models.load_model(model_ids[2], tmp_path)
+    # model 0 was least recently used, so it was evicted and must be reloaded.
+    assert models.load_model(model_ids[0], tmp_path)[0] is not first
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_load_metadata_reloads_changed_registry(tmp_path):
+    model_id = _store_naive_bayes_model(tmp_path, ["spam", "ham"])
+    assert models.load_metadata(model_id, tmp_path).git_commit_hash == (
+        "TEST-NOT-REALLY-A-COMMIT-HASH"
+    )
+    other_id = _store_naive_bayes_model(tmp_path, ["more spam", "more ham"])
+    assert models.load_metadata(other_id, tmp_path).impl_name == (
+        "NaiveBayesSpamClassifier"
+    )
+    with pytest.raises(ValueError):
+        models.load_metadata("sha256.NOT-A-MODEL", tmp_path)